@@ -0,0 +1,125 @@
+# action_stream.py
+# 说明：PromptingNode 与 ExecutionNode 之间的增量 JSON 解析。
+#       LLM 还在流式输出时，"actions" 数组里每闭合一个 {"function":..., "args":...} 就立刻交给执行器，
+#       数据加载、前几个过滤与模型生成后续步骤重叠进行。
+
+import contextvars
+import json
+import queue
+import re
+import threading
+
+_ACTIONS_RE = re.compile(r'"actions"\s*:\s*\[')
+_DONE = object()
+
+
+class ActionStreamParser:
+    """
+    增量扫描 LLM 输出
+      feed(text) → 本次新闭合的 action 列表
+      done       → 已读到 actions 数组的 "]"
+    只跟踪字符串 / 转义 / 花括号深度，不回头重扫已处理的文本
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0             # 下一个待扫描字符
+        self.in_array = False
+        self.done = False
+        self.depth = 0
+        self.in_str = False
+        self.escape = False
+        self.obj_start = None
+
+    def feed(self, text):
+        self.buf += text
+        out = []
+        if self.done:
+            return out
+        if not self.in_array:
+            m = _ACTIONS_RE.search(self.buf)
+            if not m:
+                return out
+            self.in_array, self.pos = True, m.end()
+
+        buf = self.buf
+        for i in range(self.pos, len(buf)):
+            ch = buf[i]
+            if self.in_str:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_str = False
+                continue
+            if ch == '"':
+                self.in_str = True
+            elif ch == "{":
+                if self.depth == 0:
+                    self.obj_start = i
+                self.depth += 1
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    out.append(json.loads(buf[self.obj_start:i + 1]))
+                    self.obj_start = None
+            elif ch == "]" and self.depth == 0:
+                self.done = True
+                self.pos = i + 1
+                return out
+        self.pos = len(buf)
+        return out
+
+
+class StreamingPlan:
+    """
+    后台线程消费 LLM 文本块；迭代本对象即按顺序拿到已闭合的 action（阻塞等待下一个）
+      .text       → 完整原始输出（流结束后）
+      on_complete → 流结束回调 fn(text)，用于打印日志 / 写计划缓存
+    """
+
+    def __init__(self, chunks, on_complete=None):
+        self._queue = queue.Queue()
+        self._on_complete = on_complete
+        self._finished = threading.Event()
+        self.text = ""
+        self.error = None
+        self.found_actions = False
+        # 在创建者的 contextvars 上下文里消费（追踪 span、server.py 的请求日志都挂在当前请求下）
+        ctx = contextvars.copy_context()
+        self._thread = threading.Thread(target=ctx.run, args=(self._pump, chunks), daemon=True)
+        self._thread.start()
+
+    def _pump(self, chunks):
+        parser = ActionStreamParser()
+        parts = []
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                for action in parser.feed(chunk):
+                    self._queue.put(action)
+        except Exception as e:              # 网络中断 / 解析失败：已交付的 action 照常执行
+            self.error = e
+        finally:
+            self.text = "".join(parts)
+            self.found_actions = parser.in_array
+            try:
+                # 先记录 / 写缓存，再通知结束：wait() 返回时计划已经日志化并进了缓存
+                if self._on_complete and self.error is None:
+                    self._on_complete(self.text)
+            finally:
+                self._finished.set()
+                self._queue.put(_DONE)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            yield item
+
+    def wait(self):
+        """阻塞到流结束，返回完整文本"""
+        self._finished.wait()
+        return self.text
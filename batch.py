@@ -0,0 +1,140 @@
+# batch.py
+# 说明：批量模式入口。读取 JSONL 请求文件，按 Preprocessing → Prompting → Execution 跑完每一条，
+#       LLM 调用走 asyncio 并发（共用连接池 + 限速），pandas 执行交给进程池，结果写入 JSONL。
+#
+#   python batch.py questions.jsonl -o results.jsonl --concurrency 8 --rps 4 --workers 4
+#
+# 输入每行一个 JSON：{"request_id": ..., "request": "..."}（也接受 text / body / question 字段）
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from log_capture import captured, installed
+from node_0_preprocessing import PreprocessingNode
+from node_2_execution import ExecutionNode, result_to_json
+
+_TEXT_FIELDS = ("request", "text", "body", "question")
+
+
+class AsyncRateLimiter:
+    """每秒最多放行 rate 个请求（按最小间隔排队），rate<=0 表示不限速"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._lock = asyncio.Lock()
+        self._next = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+
+# ---------- 进程池 worker：每个进程一个 ExecutionNode，数据集走快照只加载一次 ----------
+_EXEC_NODE = None
+
+
+def _init_worker(lazy):
+    global _EXEC_NODE
+    with contextlib.redirect_stdout(io.StringIO()):
+        _EXEC_NODE = ExecutionNode(lazy=lazy)
+
+
+def _execute(plan_text, max_rows):
+    log = io.StringIO()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        result = _EXEC_NODE.run(plan_text)
+    return result_to_json(result, max_rows), time.perf_counter() - t0, log.getvalue()
+
+
+# ---------- 单条请求 ----------
+async def _run_one(idx, record, pre_node, prompt_node, pool, sem, limiter, args):
+    req_id = record.get("request_id", record.get("id", idx))
+    text = next((record[f] for f in _TEXT_FIELDS if f in record), None)
+    out = {"index": idx, "request_id": req_id, "request": text, "plan": None,
+           "result": None, "error": None, "timings": {}}
+    t0 = time.perf_counter()
+    try:
+        if text is None:
+            raise ValueError(f"record has none of the fields {_TEXT_FIELDS}")
+        # 本任务的预处理 / LLM 日志收集到自己的缓冲区（contextvars 按任务隔离），不跨 await 替换 sys.stdout
+        with captured():
+            processed = pre_node.run(text)
+
+            async with sem:
+                await limiter.wait()
+                t1 = time.perf_counter()
+                plan = await prompt_node.arun(processed)
+                out["timings"]["llm_s"] = time.perf_counter() - t1
+        out["plan"] = plan
+
+        loop = asyncio.get_running_loop()
+        result, exec_s, log = await loop.run_in_executor(pool, _execute, plan, args.max_rows)
+        out["result"], out["timings"]["exec_s"] = result, exec_s
+        if "[ERROR]" in log:
+            out["error"] = "; ".join(l for l in log.splitlines() if l.startswith("[ERROR]"))
+    except Exception as e:
+        out["error"] = f"{type(e).__name__}: {e}"
+        out["traceback"] = traceback.format_exc()
+    out["timings"]["total_s"] = time.perf_counter() - t0
+    return out
+
+
+async def run_batch(args):
+    from node_1_prompting import PromptingNode
+
+    with open(args.input, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    print(f"[LOG] Batch: {len(records)} requests, concurrency={args.concurrency}, "
+          f"rps={args.rps}, workers={args.workers}")
+
+    pre_node = PreprocessingNode()
+    prompt_node = PromptingNode(max_connections=args.concurrency)
+    sem = asyncio.Semaphore(args.concurrency)
+    limiter = AsyncRateLimiter(args.rps)
+
+    t0 = time.perf_counter()
+    n_err = 0
+    with installed(echo=False), \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                initargs=(args.lazy,)) as pool, \
+            open(args.output, "w", encoding="utf-8") as out_f:
+        tasks = [asyncio.create_task(_run_one(i, r, pre_node, prompt_node, pool, sem, limiter, args))
+                 for i, r in enumerate(records)]
+        for fut in asyncio.as_completed(tasks):     # 完成一条写一条，index 字段保留原顺序
+            res = await fut
+            n_err += res["error"] is not None
+            out_f.write(json.dumps(res, ensure_ascii=False, default=str) + "\n")
+            out_f.flush()
+
+    if prompt_node.plan_cache is not None:
+        print(f"[LOG] Plan cache: {prompt_node.plan_cache.stats()}")
+    print(f"[LOG] Batch finished: {len(records)} requests, {n_err} errors, "
+          f"{time.perf_counter() - t0:.1f}s → {args.output}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run many requests through the graph concurrently")
+    ap.add_argument("input", help="JSONL file, one request per line")
+    ap.add_argument("-o", "--output", default="batch_results.jsonl")
+    ap.add_argument("--concurrency", type=int, default=8, help="max in-flight LLM calls")
+    ap.add_argument("--rps", type=float, default=0, help="max LLM calls started per second (0 = unlimited)")
+    ap.add_argument("--workers", type=int, default=None, help="execution processes (default: CPU count)")
+    ap.add_argument("--max-rows", type=int, default=20, help="DataFrame rows kept per result")
+    ap.add_argument("--lazy", action="store_true", help="run plans through the lazy optimizer")
+    asyncio.run(run_batch(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
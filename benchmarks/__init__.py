@@ -0,0 +1,2 @@
+# benchmarks/__init__.py
+# 说明：规模基准（datagen.py 生成合成数据，bench.py 计时并与基线比较）。在仓库根目录用 python -m benchmarks.bench 运行
@@ -0,0 +1,232 @@
+# benchmarks/bench.py
+# 说明：工具函数与多步计划的规模基准。每个规模生成一份合成作业表（datagen.py），
+#       逐个计时 tool_functions 里的工具，再把几条典型计划交给 ExecutionNode 跑（不经过 LLM，
+#       直接喂计划 JSON），记录耗时、吞吐（行/秒）和峰值内存（tracemalloc）。
+#
+#   python -m benchmarks.bench --sizes 1e3,1e5,1e6                 → 打印结果
+#   python -m benchmarks.bench --sizes 1e5 --save-baseline         → 写 benchmarks/baseline.json
+#   python -m benchmarks.bench --sizes 1e5 --threshold 0.25        → 与基线比较，变慢超过 25% 时退出码 1
+#
+# 计时取 --repeat 次中的最小值；峰值内存单独再跑一次（tracemalloc 会拖慢计时）。
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.datagen import DATA_DIR, ensure_csv
+from dataset_cache import DATASET
+from node_2_execution import ExecutionNode
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# 每个工具至少一组参数；cur=None 表示在全量数据上执行
+TOOL_CASES = {
+    "select_rows": [{"column": "Processing_Time", "condition": ">= 50 AND <= 120"},
+                    {"column": "Machine_ID", "condition": "IN ('M01','M03') AND NOT Job_Status == 'Failed'"}],
+    "sort_rows": [{"column": "Energy_Consumption", "order": "desc"}],
+    "top_n": [{"column": "Energy_Consumption", "n": 10, "order": "desc"}],
+    "group_top_n": [{"group_column": "Machine_ID", "sort_column": "Processing_Time", "n": 3}],
+    "filter_date_range": [{"column": "Actual_Start", "start": "2023-03-20 00:00", "end": "2023-03-22 00:00"}],
+    "add_derived_column": [{"name": "EC_per_PT", "formula": "Energy_Consumption / Processing_Time"},
+                           {"name": "ratio", "formula": "(Actual_End - Actual_Start) / Processing_Time"}],
+    "rolling_average": [{"column": "Energy_Consumption", "window": 5},
+                        {"column": "Processing_Time", "window": "2h", "group_by": "Machine_ID",
+                         "order_by": "Scheduled_Start"}],
+    "group_by_aggregate": [{"group_column": "Machine_ID", "target_column": "Energy_Consumption", "agg": "avg"},
+                           {"group_column": ["Operation_Type", "Machine_ID"],
+                            "metrics": [{"agg": "count"}, {"column": "Processing_Time", "agg": "p95"},
+                                        {"column": "Processing_Time", "agg": "corr",
+                                         "other_column": "Energy_Consumption"}],
+                            "having": "count >= 5"}],
+    "calculate_average": [{"column": "Processing_Time"}],
+    "calculate_median": [{"column": "Processing_Time"}],
+    "calculate_mode": [{"column": "Machine_ID"}],
+    "calculate_sum": [{"column": "Energy_Consumption"}],
+    "calculate_min": [{"column": "Energy_Consumption"}],
+    "calculate_max": [{"column": "Energy_Consumption"}],
+    "calculate_std": [{"column": "Processing_Time"}],
+    "calculate_variance": [{"column": "Processing_Time"}],
+    "calculate_percentile": [{"column": "Processing_Time", "percentile": 95},
+                             {"column": "Energy_Consumption", "percentile": 90, "group_by": "Machine_ID"}],
+    "calculate_correlation": [{"column1": "Processing_Time", "column2": "Energy_Consumption"}],
+    "calculate_covariance": [{"column1": "Processing_Time", "column2": "Energy_Consumption",
+                              "group_by": "Machine_ID"}],
+    "calculate_stats": [{"column": "Processing_Time", "stats": ["mean", "std", "min", "max", "p50", "p95"]}],
+    "count_rows": [{}],
+    "calculate_delay_avg": [{"unit": "minutes"}],
+    "calculate_failure_rate": [{"group_column": "Machine_ID"}],
+    "calculate_delay_avg_grouped": [{"group_column": "Operation_Type", "unit": "minutes"}],
+}
+
+# 典型多步计划（与 LLM 实际产出的形状一致）
+PLANS = {
+    "filter_then_stats": [
+        {"function": "select_rows", "args": {"column": "Machine_ID", "condition": "== 'M01'"}},
+        {"function": "calculate_average", "args": {"column": "Processing_Time"}},
+        {"function": "calculate_std", "args": {"column": "Processing_Time"}},
+        {"function": "calculate_percentile", "args": {"column": "Processing_Time", "percentile": 95}}],
+    "derived_top_n": [
+        {"function": "calculate_average", "args": {"column": "Energy_Consumption"}},
+        {"function": "add_derived_column", "args": {"name": "dev", "formula": "Energy_Consumption - {last_scalar}"}},
+        {"function": "sort_rows", "args": {"column": "dev", "order": "desc"}},
+        {"function": "top_n", "args": {"column": "dev", "n": 5}}],
+    "date_window_grouped": [
+        {"function": "filter_date_range", "args": {"column": "Scheduled_Start",
+                                                   "start": "2023-03-19 00:00", "end": "2023-03-24 00:00"}},
+        {"function": "select_rows", "args": {"column": "Job_Status", "condition": "!= 'Failed'"}},
+        {"function": "group_by_aggregate", "args": {
+            "group_column": "Machine_ID",
+            "metrics": [{"agg": "count", "alias": "n"},
+                        {"derived": {"type": "timedelta", "end_col": "Actual_End", "start_col": "Scheduled_End",
+                                     "unit": "minutes", "name": "delay"}, "agg": "avg"}]}}],
+    "rolling_by_machine": [
+        {"function": "select_rows", "args": {"column": "Operation_Type", "condition": "IN ('Lathe','Milling')"}},
+        {"function": "rolling_average", "args": {"column": "Energy_Consumption", "window": 10,
+                                                 "group_by": "Machine_ID", "order_by": "Scheduled_Start"}},
+        {"function": "top_n", "args": {"column": "rolling_avg_Energy_Consumption", "n": 10}}],
+    # 命名中间结果：共同前缀只算一次，两个分支并行（plan_dag.py）
+    "named_branches": [
+        {"function": "select_rows", "args": {"column": "Job_Status", "condition": "== 'Completed'"}, "as": "done"},
+        {"function": "select_rows", "args": {"column": "Operation_Type", "condition": "== 'Grinding'"},
+         "input": "done"},
+        {"function": "calculate_average", "args": {"column": "Energy_Consumption"}, "as": "grinding"},
+        {"function": "select_rows", "args": {"column": "Operation_Type", "condition": "== 'Milling'"},
+         "input": "done"},
+        {"function": "calculate_average", "args": {"column": "Energy_Consumption"}, "as": "milling"},
+        {"function": "add_derived_column", "args": {"name": "vs_grinding",
+                                                    "formula": "Energy_Consumption / {grinding}"}, "input": "done"},
+        {"function": "top_n", "args": {"column": "vs_grinding", "n": 10}}],
+}
+
+
+def _quiet(fn):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn()
+
+
+def _measure(fn, repeat):
+    """最小耗时（秒）+ 峰值分配（MB）"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        _quiet(fn)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        _quiet(fn)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak / 2**20
+
+
+def _record(results, key, n, seconds, peak_mb):
+    results[key] = {"rows": n, "seconds": seconds, "rows_per_s": n / seconds if seconds else None,
+                    "peak_mb": peak_mb}
+    print(f"  {key:<60} {seconds * 1e3:10.2f} ms {n / max(seconds, 1e-12):14,.0f} rows/s {peak_mb:9.1f} MB")
+
+
+def run_size(n, repeat, seed, results, lazy_plans=True):
+    path = ensure_csv(n, seed)
+    DATASET.use(path, cache_dir=os.path.join(DATA_DIR, ".cache"))
+    for source in ("csv", "snapshot"):                 # 冷启动：解析 CSV / 读快照
+        DATASET.clear()
+        if source == "csv":
+            _remove_snapshot()
+        t0 = time.perf_counter()
+        _quiet(DATASET.get)
+        _record(results, f"{n}/load/{DATASET.last_source}", n, time.perf_counter() - t0, 0.0)
+
+    node = _quiet(ExecutionNode)
+    funcs = {**node.df_funcs, **node.scalar_funcs}
+    missing = sorted(set(funcs) - set(TOOL_CASES))
+    if missing:
+        print(f"[WARN] No benchmark case for: {missing}")
+
+    for name, cases in TOOL_CASES.items():
+        for i, args in enumerate(cases):
+            s, peak = _measure(lambda: funcs[name](None, args), repeat)
+            _record(results, f"{n}/tool/{name}#{i}", n, s, peak)
+
+    modes = [("eager", node)] + ([("lazy", _quiet(lambda: ExecutionNode(lazy=True)))] if lazy_plans else [])
+    for name, actions in PLANS.items():
+        text = json.dumps({"actions": actions})
+        for mode, ex in modes:
+            s, peak = _measure(lambda: ex.run(text), repeat)
+            _record(results, f"{n}/plan/{name}/{mode}", n, s, peak)
+
+
+def _remove_snapshot():
+    for fmt in ("feather", "pickle"):
+        for p in DATASET._snapshot_paths(fmt):
+            with contextlib.suppress(OSError):
+                os.remove(p)
+
+
+def compare(results, baseline, threshold, min_ms):
+    """比基线慢 threshold 以上（且绝对差超过 min_ms）的条目"""
+    regressions = []
+    for key, cur in results.items():
+        base = baseline.get("results", {}).get(key)
+        if not base or "/load/" in key:
+            continue
+        ratio = cur["seconds"] / base["seconds"] if base["seconds"] else float("inf")
+        if ratio > 1 + threshold and (cur["seconds"] - base["seconds"]) * 1e3 > min_ms:
+            regressions.append((key, base["seconds"], cur["seconds"], ratio))
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark tool functions and plans at synthetic scale")
+    ap.add_argument("--sizes", default="1e3,1e5", help="comma-separated row counts, e.g. 1e3,1e5,1e6,1e7")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--no-lazy", action="store_true", help="skip lazy-mode plan runs")
+    ap.add_argument("-o", "--output", default=None, help="write this run's results as JSON")
+    ap.add_argument("--baseline", default=BASELINE)
+    ap.add_argument("--save-baseline", action="store_true", help="overwrite the baseline with this run")
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    ap.add_argument("--min-ms", type=float, default=1.0, help="ignore slowdowns smaller than this")
+    args = ap.parse_args()
+
+    results = {}
+    for size in args.sizes.split(","):
+        n = int(float(size))
+        print(f"[LOG] Benchmark: {n:,} rows")
+        run_size(n, args.repeat, args.seed, results, lazy_plans=not args.no_lazy)
+
+    report = {"meta": {"python": sys.version.split()[0], "pandas": pd.__version__, "numpy": np.__version__,
+                       "platform": platform.platform(), "seed": args.seed, "repeat": args.repeat,
+                       "created": time.strftime("%Y-%m-%d %H:%M:%S")},
+              "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[LOG] Baseline saved → {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_ms)
+        for key, old, new, ratio in regressions:
+            print(f"[WARN] Regression {key}: {old * 1e3:.2f} ms → {new * 1e3:.2f} ms (×{ratio:.2f})")
+        print(f"[LOG] {len(regressions)} regressions vs {args.baseline} (threshold {args.threshold:.0%})")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
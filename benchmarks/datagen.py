@@ -0,0 +1,90 @@
+# benchmarks/datagen.py
+# 说明：按 hybrid_manufacturing_categorical.csv 的 schema 与分布生成任意规模的作业表（固定随机种子，可复现）
+#
+#   python -m benchmarks.datagen 1000000 -o benchmarks/.data/jobs_1000000.csv
+#
+# 分布取自原始 1000 行样本：
+#   • Machine_ID M01–M05、Operation_Type 五类，均匀
+#   • Material_Used U(1, 5)、Energy_Consumption U(2, 15)，两位小数；Processing_Time 20–120 分钟；
+#     Machine_Availability 80–99
+#   • Scheduled_Start 从 2023‑03‑18 08:00 起每 10 分钟一单，Scheduled_End = 开始 + Processing_Time
+#   • Job_Status：Completed 67.3% / Delayed 19.8% / Failed 12.9%
+#       Completed 实际开始偏移 −5…5 分钟，Delayed 偏移 10…30 分钟，Failed 没有实际时间
+#   • Optimization_Category：Delayed / Failed 全部是 Low Efficiency，Completed 按样本比例
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+MACHINES = ["M01", "M02", "M03", "M04", "M05"]
+OPERATIONS = ["Additive", "Drilling", "Grinding", "Lathe", "Milling"]
+STATUS = (["Completed", "Delayed", "Failed"], [0.673, 0.198, 0.129])
+COMPLETED_CATEGORY = (["High Efficiency", "Low Efficiency", "Moderate Efficiency", "Optimal Efficiency"],
+                      [161 / 673, 323 / 673, 183 / 673, 6 / 673])
+START = np.datetime64("2023-03-18T08:00")
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data")
+
+
+def generate_jobs(n, seed=0):
+    """n 行作业表（DataFrame，列与原始 CSV 一致）"""
+    rng = np.random.default_rng(seed)
+    n = int(n)
+    pt = rng.integers(20, 121, n)
+    status = rng.choice(STATUS[0], n, p=STATUS[1])
+    completed, delayed = status == "Completed", status == "Delayed"
+
+    sched_start = START + np.arange(n) * np.timedelta64(10, "m")
+    sched_end = sched_start + pt.astype("timedelta64[m]")
+    offset = np.where(completed, rng.integers(-5, 6, n), rng.integers(10, 31, n))
+    act_start = (sched_start + offset.astype("timedelta64[m]")).astype("datetime64[ns]")
+    act_start[~(completed | delayed)] = np.datetime64("NaT")
+    act_end = act_start + pt.astype("timedelta64[m]")
+
+    category = np.full(n, "Low Efficiency", dtype=object)
+    category[completed] = rng.choice(COMPLETED_CATEGORY[0], int(completed.sum()), p=COMPLETED_CATEGORY[1])
+
+    return pd.DataFrame({
+        "Job_ID": [f"J{i:03d}" for i in range(1, n + 1)],
+        "Machine_ID": rng.choice(MACHINES, n),
+        "Operation_Type": rng.choice(OPERATIONS, n),
+        "Material_Used": rng.uniform(1, 5, n).round(2),
+        "Processing_Time": pt,
+        "Energy_Consumption": rng.uniform(2, 15, n).round(2),
+        "Machine_Availability": rng.integers(80, 100, n),
+        "Scheduled_Start": sched_start,
+        "Scheduled_End": sched_end,
+        "Actual_Start": act_start,
+        "Actual_End": act_end,
+        "Job_Status": status,
+        "Optimization_Category": category,
+    })
+
+
+def ensure_csv(n, seed=0, data_dir=DATA_DIR):
+    """生成（或复用已生成的）CSV，返回路径"""
+    path = os.path.join(data_dir, f"jobs_{int(n)}_s{seed}.csv")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        tmp = path + ".tmp"
+        generate_jobs(n, seed).to_csv(tmp, index=False, date_format="%Y-%m-%d %H:%M:%S")
+        os.replace(tmp, path)
+    return path
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a synthetic job table")
+    ap.add_argument("rows", type=float)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("-o", "--output", default=None)
+    args = ap.parse_args()
+    if args.output:
+        generate_jobs(args.rows, args.seed).to_csv(args.output, index=False, date_format="%Y-%m-%d %H:%M:%S")
+        print(args.output)
+    else:
+        print(ensure_csv(args.rows, args.seed))
+
+
+if __name__ == "__main__":
+    main()
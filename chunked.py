@@ -0,0 +1,407 @@
+# chunked.py
+# 说明：ExecutionNode 的分块（out-of-core）执行模式，用于放不进内存的作业日志。
+#       CSV 按 chunksize 行分块读取，峰值内存只和块大小（以及分组数 / top_n 的 n）有关：
+#         • 过滤、add_derived_column 逐块执行
+#         • calculate_* 标量、group_by_aggregate、calculate_failure_rate、calculate_delay_avg(_grouped)、
+#           calculate_covariance / correlation 逐块产出可相加的部分统计量，最后合并
+#         • top_n 每块只保留前 n 行（有界的“堆”）
+#         • 归约（top_n / group_by_aggregate）之后结果已很小，其余步骤回到内存中照常执行
+#         • 需要全局状态的步骤（排序、中位数 / 分位数、众数、rolling、group_top_n …）直接拒绝
+#
+#   python main.py --chunked          （块大小取环境变量 CHUNK_ROWS，默认 100000）
+
+import numpy as np
+import pandas as pd
+
+from dataset_cache import DATASET, SCHEMA, TIME_COLS, apply_schema, format_key, measure, scan_key_formats
+from plan_dag import uses_names
+from plan_optimizer import optimize, run_filter
+from tracing import TRACER
+from tool_functions import (_AGG_MAP, _group_keys, _metric_agg, _metric_input, _metric_specs, _num,
+                            _stat_name, add_derived_column, apply_having, pair_from_sums, top_n)
+
+DEFAULT_CHUNK_ROWS = 100_000
+
+MOMENT_FUNCS = {"calculate_average": "mean", "calculate_sum": "sum", "calculate_min": "min",
+                "calculate_max": "max", "calculate_std": "std", "calculate_variance": "var"}
+GROUPED_FUNCS = {"calculate_failure_rate", "calculate_delay_avg_grouped"}
+PAIR_FUNCS = {"calculate_covariance": "cov", "calculate_correlation": "corr"}
+REDUCERS = {"top_n", "group_by_aggregate"}
+MERGEABLE_STATS = {"mean", "sum", "min", "max", "std", "var", "count"}
+MERGEABLE_AGGS = {"avg", "mean", "sum", "min", "max", "std", "var", "count", "cov", "corr"}
+
+
+class ChunkedPlanError(ValueError):
+    """计划里有需要全局状态的步骤，无法分块执行"""
+
+
+def iter_chunks(csv_file, chunksize):
+    """按 schema 分块读取；类别在块内编码，跨块合并时按值对齐；key 格式按整表定一次"""
+    key_formats = scan_key_formats(csv_file, chunksize)
+    for chunk in pd.read_csv(csv_file, chunksize=chunksize, parse_dates=TIME_COLS):
+        yield apply_schema(chunk, key_formats)
+
+
+def _restore_categories(df):
+    """不同块的类别表不同，拼接后退化成 object；按 SCHEMA 还原成 category"""
+    cats = {c: df[c].astype("category") for c in df.columns
+            if SCHEMA.get(c) == "category" and not isinstance(df[c].dtype, pd.CategoricalDtype)}
+    return df.assign(**cats) if cats else df
+
+
+def _concat(frames):
+    frames = [f for f in frames if f is not None]
+    return _restore_categories(pd.concat(frames)) if frames else None
+
+
+def _key_values(ser):
+    """分组键按值分组（块间类别表不一致时也能对齐）"""
+    return ser.astype(object) if isinstance(ser.dtype, pd.CategoricalDtype) else ser
+
+
+# ---------- 可合并的部分统计量 ----------
+class PartialAgg:
+    """
+    每个 spec 逐块产出可相加的统计量（按分组键对齐），合并只是按位相加 / 取 min / max
+      spec = (name, kind, fn)
+        kind = "moments" → fn(chunk) 返回数值 Series；累计 n、Σx、Σ(x−c)、Σ(x−c)²、min、max
+        kind = "count"   → fn(chunk) 返回 Series；累计非空个数
+        kind = "size"    → 行数
+        kind = "pair"    → fn(chunk) 返回 (x, y)；累计 pair_from_sums 需要的充分统计量
+    c 取首个非空块的均值并固定下来（平移后求平方和，减小抵消误差，且各块仍可直接相加）
+    """
+
+    def __init__(self, specs, keys=None):
+        self.specs, self.keys = specs, keys or []
+        self.shift = {}
+        self.acc = None
+
+    def _columns(self, chunk):
+        cols = {}
+        for name, kind, fn in self.specs:
+            if kind == "size":
+                cols[f"{name}|n"] = np.ones(len(chunk), dtype=np.int64)
+            elif kind == "count":
+                cols[f"{name}|n"] = fn(chunk).notna().to_numpy().astype(np.int64)
+            elif kind == "moments":
+                x = fn(chunk).to_numpy(dtype=np.float64, na_value=np.nan)
+                valid = ~np.isnan(x)
+                if name not in self.shift and valid.any():
+                    self.shift[name] = x[valid].mean()
+                d = np.where(valid, x - self.shift.get(name, 0.0), 0.0)
+                cols.update({f"{name}|n": valid.astype(np.int64), f"{name}|sum": np.where(valid, x, 0.0),
+                             f"{name}|s1": d, f"{name}|s2": d * d, f"{name}|min": x, f"{name}|max": x})
+            elif kind == "pair":
+                x, y = (v.to_numpy(dtype=np.float64, na_value=np.nan) for v in fn(chunk))
+                valid = ~(np.isnan(x) | np.isnan(y))
+                if name not in self.shift and valid.any():
+                    self.shift[name] = (x[valid].mean(), y[valid].mean())
+                cx, cy = self.shift.get(name, (0.0, 0.0))
+                x, y = np.where(valid, x - cx, 0.0), np.where(valid, y - cy, 0.0)
+                cols.update({f"{name}|n": valid.astype(np.int64), f"{name}|sx": x, f"{name}|sy": y,
+                             f"{name}|sxy": x * y, f"{name}|sxx": x * x, f"{name}|syy": y * y})
+        return cols
+
+    def update(self, chunk):
+        if not len(chunk):
+            return
+        cols = self._columns(chunk)
+        frame = pd.DataFrame(cols, index=chunk.index)
+        by = ([_key_values(chunk[k]) for k in self.keys] if self.keys
+              else np.zeros(len(chunk), dtype=np.int8))
+        how = {c: ("min" if c.endswith("|min") else "max" if c.endswith("|max") else "sum") for c in cols}
+        part = frame.groupby(by, observed=True, sort=False).agg(how)
+        self.acc = part if self.acc is None else _merge(self.acc, part)
+
+    def result(self):
+        """DataFrame：每个 spec 的终值列（name|mean、name|std、name|cov …），索引为分组键"""
+        if self.acc is None:
+            return None
+        acc = self.acc.sort_index() if self.keys else self.acc
+        out = {}
+        for name, kind, _ in self.specs:
+            n = acc[f"{name}|n"]
+            out[f"{name}|count"] = n
+            if kind == "moments":
+                s1, s2 = acc[f"{name}|s1"], acc[f"{name}|s2"]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    var = ((s2 - s1 ** 2 / n) / (n - 1)).where(n > 1).clip(lower=0)
+                    out[f"{name}|mean"] = (acc[f"{name}|sum"] / n).where(n > 0)
+                out.update({f"{name}|sum": acc[f"{name}|sum"], f"{name}|var": var,
+                            f"{name}|std": np.sqrt(var),
+                            f"{name}|min": acc[f"{name}|min"], f"{name}|max": acc[f"{name}|max"]})
+            elif kind == "pair":
+                sums = acc[[f"{name}|{s}" for s in ("n", "sx", "sy", "sxy", "sxx", "syy")]]
+                pm = pair_from_sums(sums.rename(columns=lambda c: c.split("|")[1]))
+                out[f"{name}|cov"], out[f"{name}|corr"] = pm["cov"], pm["corr"]
+        return pd.DataFrame(out, index=acc.index)
+
+
+def _merge(a, b):
+    a, b = a.align(b, join="outer")
+    out = {}
+    for c in a.columns:
+        if c.endswith("|min"):
+            out[c] = np.fmin(a[c], b[c])
+        elif c.endswith("|max"):
+            out[c] = np.fmax(a[c], b[c])
+        else:
+            out[c] = a[c].fillna(0) + b[c].fillna(0)
+    return pd.DataFrame(out, index=a.index)
+
+
+def _scalar(res, col, default=np.nan):
+    return default if res is None else res[col].iloc[0]
+
+
+def _grouped_frame(res, keys, cols):
+    """PartialAgg 结果 → 与内存版一致的 DataFrame（键列在前、类别列还原）"""
+    if res is None:
+        return pd.DataFrame(columns=keys + list(cols))
+    out = pd.DataFrame({alias: res[src] for alias, src in cols.items()})
+    out.index.names = keys
+    out = out.reset_index()
+    return _restore_categories(out)
+
+
+# ---------- 各类步骤的分块版本（sink）----------
+class _ScalarSink:
+    """单个 calculate_* 调用 → [(fname, value)]"""
+
+    def __init__(self, fname, args):
+        self.fname, self.args = fname, args
+        col = args.get("column")
+        if fname in MOMENT_FUNCS:
+            self.agg = PartialAgg([("x", "moments", lambda c: _num(c[col]))])
+            if fname in ("calculate_min", "calculate_max"):     # key 列的最值还原成 'J001'
+                self.pick = lambda r: format_key(col, _scalar(r, f"x|{MOMENT_FUNCS[fname]}"))
+            else:
+                self.pick = lambda r: _scalar(r, f"x|{MOMENT_FUNCS[fname]}")
+        elif fname == "count_rows":
+            self.agg = PartialAgg([("rows", "size", None)])
+            self.pick = lambda r: int(_scalar(r, "rows|count", 0))
+        elif fname == "calculate_delay_avg":
+            unit, use_abs = args.get("unit", "seconds"), bool(args.get("abs", False))
+
+            def delay(c):
+                d = measure(c, "end_delay", unit).where((c["Job_Status"] == "Completed").to_numpy())
+                return d.abs() if use_abs else d
+            self.agg = PartialAgg([("x", "moments", delay)])
+            self.pick = lambda r: _scalar(r, "x|mean")
+        elif fname == "calculate_failure_rate":
+            g = args["group_column"]
+            keys = [g] if isinstance(g, str) else list(g)
+            self.agg = PartialAgg([("x", "moments", lambda c: (c["Job_Status"] == "Failed").astype(np.float64))], keys)
+            self.pick = lambda r: _grouped_frame(r, keys, {"failure_rate": "x|mean"})
+        elif fname == "calculate_delay_avg_grouped":
+            g, unit = args["group_column"], args.get("unit", "seconds")
+            keys = [g] if isinstance(g, str) else list(g)
+            self.agg = PartialAgg([("x", "moments", lambda c: measure(c, "end_delay", unit))], keys)
+            self.pick = lambda r: _grouped_frame(r, keys, {f"avg_delay_{unit}": "x|mean"})
+        elif fname in PAIR_FUNCS:
+            x = args.get("x") or args.get("column1")
+            y = args.get("y") or args.get("column2")
+            g = args.get("group_by") or args.get("group_column")
+            keys = ([g] if isinstance(g, str) else list(g)) if g else []
+            stat = PAIR_FUNCS[fname]
+            self.agg = PartialAgg([("p", "pair", lambda c: (_num(c[x]), _num(c[y])))], keys)
+            self.pick = ((lambda r: _grouped_frame(r, keys, {f"{stat}_{x}_{y}": f"p|{stat}"})) if keys
+                         else (lambda r: float(_scalar(r, f"p|{stat}"))))
+        else:
+            raise ChunkedPlanError(f"{fname} needs the whole column at once (not mergeable across chunks)")
+
+    def update(self, chunk):
+        self.agg.update(chunk)
+
+    def outputs(self):
+        return [(self.fname, self.pick(self.agg.result()))]
+
+
+class _StatsSink:
+    """优化器合并出的 Stats 步骤 / calculate_stats：每列一组矩统计量，按原顺序回填"""
+
+    def __init__(self, outputs):
+        self.outs = outputs                                    # [(fname, column, stat)]
+        bad = sorted({st for _, _, st in outputs} - MERGEABLE_STATS)
+        if bad:
+            raise ChunkedPlanError(f"stats {bad} need the whole column at once (not mergeable across chunks)")
+        cols = list(dict.fromkeys(c for _, c, _ in outputs))
+        self.agg = PartialAgg([(c, "moments", lambda ch, c=c: _num(ch[c])) for c in cols])
+
+    def update(self, chunk):
+        self.agg.update(chunk)
+
+    def outputs(self):
+        res = self.agg.result()
+        vals = [(f, _scalar(res, f"{c}|{st}", 0 if st == "count" else np.nan)) for f, c, st in self.outs]
+        if self.outs and self.outs[0][0] == "calculate_stats":
+            col = self.outs[0][1]
+            return [("calculate_stats", pd.Series({st: v for (_, _, st), (_, v) in zip(self.outs, vals)},
+                                                  name=col, dtype=object))]
+        return vals
+
+
+class _TopNSink:
+    """每块先取前 n，再与已有的前 n 合并：任何时刻只保留 n 行（并列按读入顺序，与内存版一致）"""
+
+    def __init__(self, args):
+        self.args, self.best = args, None
+
+    def update(self, chunk):
+        top = top_n(chunk, self.args)
+        self.best = top_n(_concat([self.best, top]), self.args) if self.best is not None else top
+
+    def result(self):
+        return _restore_categories(self.best) if self.best is not None else None
+
+
+class _GroupAggSink:
+    """group_by_aggregate：可合并的 agg（avg/sum/min/max/std/var/count/cov/corr、count(*)）"""
+
+    def __init__(self, args):
+        if args.get("keep_all"):
+            raise ChunkedPlanError("group_by_aggregate keep_all joins results back to every row")
+        self.args, self.keys = args, _group_keys(args)
+        specs, self.cols = [], {}
+        for i, m in enumerate(_metric_specs(args)):
+            agg, _ = _metric_agg(m)
+            if agg not in MERGEABLE_AGGS:
+                raise ChunkedPlanError(f"group_by_aggregate agg {agg!r} needs whole groups at once")
+            name = f"m{i}"
+            colname = m.get("derived", {}).get("name", "derived") if m.get("derived") else m.get("column")
+            if colname is None:                                  # count(*)
+                specs.append((name, "size", None))
+                self.cols[m.get("alias") or "count"] = f"{name}|count"
+            elif agg in ("cov", "corr"):
+                other = m.get("other_column")
+                if other is None: raise ValueError("other_column required for cov/corr")
+                specs.append((name, "pair", lambda c, m=m: (_metric_input(c, m, "avg")[0], _num(c[other]))))
+                self.cols[m.get("alias") or f"{agg}_{colname}_{other}"] = f"{name}|{agg}"
+            else:
+                kind = "count" if agg == "count" else "moments"
+                specs.append((name, kind, lambda c, m=m, agg=agg: _metric_input(c, m, agg)[0]))
+                self.cols[m.get("alias") or f"{agg}_{colname}"] = f"{name}|{_AGG_MAP[agg]}"
+        self.agg = PartialAgg(specs, self.keys)
+
+    def update(self, chunk):
+        self.agg.update(chunk)
+
+    def result(self):
+        res = _grouped_frame(self.agg.result(), self.keys, self.cols)
+        return apply_having(res, self.args["having"]) if self.args.get("having") else res
+
+
+class _CollectSink:
+    """计划以行级步骤结尾：结果就是过滤后的全部行，只能整体物化"""
+
+    def __init__(self):
+        self.frames = []
+
+    def update(self, chunk):
+        self.frames.append(chunk)
+
+    def result(self):
+        return _concat(self.frames)
+
+
+def _make_sink(step):
+    if step.op == "top_n" or (step.op == "call" and step.fname == "top_n"):
+        return _TopNSink(step.args)
+    if step.op == "stats":
+        return _StatsSink([(f, a["column"], st) for f, a, st in step.steps])
+    if step.fname == "group_by_aggregate":
+        return _GroupAggSink(step.args)
+    if step.fname == "calculate_stats":
+        col = step.args["column"]
+        stats = step.args.get("stats") or ["count", "mean", "std", "min", "max"]
+        return _StatsSink([("calculate_stats", col, _stat_name(s)) for s in stats])
+    if step.fname in MOMENT_FUNCS or step.fname in GROUPED_FUNCS or step.fname in PAIR_FUNCS \
+            or step.fname in ("count_rows", "calculate_delay_avg"):
+        return _ScalarSink(step.fname, step.args)
+    raise ChunkedPlanError(f"{step.fname} needs the whole dataset at once (global sort / window / quantile)")
+
+
+def _is_row_op(step):
+    return step.op == "filter" or (step.op == "call" and step.fname == "add_derived_column")
+
+
+def check_plan(plan, scalar_funcs):
+    """读数据之前先检查：第一个归约之前的每一步都必须能分块执行"""
+    for step in plan.steps:
+        if _is_row_op(step):
+            continue
+        if step.op != "stats" and step.fname not in REDUCERS and step.fname not in scalar_funcs:
+            raise ChunkedPlanError(f"{step.fname} needs the whole dataset at once (global sort / window / quantile)")
+        _make_sink(step)
+        if step.op == "top_n" or step.fname in REDUCERS:
+            return
+
+
+# ---------- 驱动 ----------
+def run_chunked(node, actions, state, chunksize=DEFAULT_CHUNK_ROWS, csv_file=None):
+    """
+    分块执行 actions，返回 (current_data, last_fname)，与 ExecutionNode._run_lazy 一致
+    标量之后若有步骤用到 {last_scalar}，先结束本轮扫描拿到标量，再从头重放行级步骤开始下一轮
+    """
+    if uses_names(actions):
+        raise ChunkedPlanError("named results (as / input) keep intermediate tables in memory")
+    csv_file = csv_file or DATASET.csv_file
+    plan = optimize(actions)
+    print(plan.explain())
+    check_plan(plan, node.scalar_funcs)
+
+    row_ops, pending = [], []            # pending: [(step, sink, 其前面的行级步骤数)]
+    progress = {"current": None, "passes": 0}
+
+    def flush():
+        if not pending:
+            return
+        progress["passes"] += 1
+        n_chunks = n_rows = 0
+        with TRACER.span("chunked pass", profile=True, chunk_rows=chunksize, row_steps=len(row_ops),
+                         sinks=[step.describe() for step, _, _ in pending]) as span:
+            for chunk in iter_chunks(csv_file, chunksize):
+                n_chunks += 1
+                n_rows += len(chunk)
+                stage = 0
+                for _, sink, at in pending:            # 每个 sink 看到的是它在计划中所处位置的数据
+                    while stage < at:
+                        chunk = row_ops[stage](chunk)
+                        stage += 1
+                    sink.update(chunk)
+            span.set(rows_in=n_rows, chunks=n_chunks)
+        print(f"[LOG] Chunked pass {progress['passes']}: {n_rows} rows in {n_chunks} chunks of ≤{chunksize}")
+        for step, sink, _ in pending:
+            if isinstance(sink, (_TopNSink, _GroupAggSink, _CollectSink)):
+                progress["current"] = sink.result()
+                continue
+            for fname, result in sink.outputs():
+                state.last_scalar = result
+                print(f"[LOG] {fname} result: {result}")
+        pending.clear()
+
+    reduced = False
+    for step in plan.steps:
+        if reduced:                                   # 归约之后的数据已在内存里
+            progress["current"] = node._run_step(step, progress["current"], state)
+            continue
+        print(f"[LOG] Executing (chunked): {step.describe()}")
+        if step.op == "filter":
+            row_ops.append(lambda c, s=step: run_filter(c, s, node.mask_funcs))
+        elif _is_row_op(step):
+            if "{last_scalar}" in step.args.get("formula", ""):
+                flush()                               # 先拿到本轮的标量
+            args = node._bind_placeholders(step.fname, step.args, state.param)
+            if args is not None:
+                row_ops.append(lambda c, a=args: add_derived_column(c, a))
+        else:
+            pending.append((step, _make_sink(step), len(row_ops)))
+            if step.op == "top_n" or step.fname in REDUCERS:
+                flush()
+                reduced = True
+
+    if not reduced and plan.steps and _is_row_op(plan.steps[-1]):
+        print("[WARN] Plan ends with row-level steps; materializing every matching row")
+        pending.append((plan.steps[-1], _CollectSink(), len(row_ops)))
+    flush()
+    return progress["current"], (plan.steps[-1].fname if plan.steps else None)
@@ -0,0 +1,415 @@
+# dataset_cache.py
+# 说明：进程级数据集缓存。CSV 只解析一次，之后转存为带类型的列式快照（Feather / pickle），
+#       后续加载先看内存，再看快照，最后才回退到 CSV。tool_functions 与 ExecutionNode 共用同一份。
+
+import json
+import os
+import threading
+import time
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from schema import SCHEMA, TIME_COLS     # 列类型见 schema.py
+
+# ---------- 基础 ----------
+CSV_FILE = os.path.join("data", "hybrid_manufacturing_categorical.csv")
+CACHE_DIR = os.path.join("data", ".cache")
+
+SNAPSHOT_VERSION = 3     # 快照格式/加载逻辑变化时 +1，旧快照自动失效
+
+# key 列的显示格式 {列名: (前缀, 补零位数)}，加载时从数据推断
+KEY_FORMATS = {}
+_SCANNED_KEYS = {}       # 分块模式：(文件, mtime, size) → 整表推断出的 key 格式
+_KEY_RE = r"^([A-Za-z_\-]*)(\d+)$"
+
+
+def _downcast(ser, kind):
+    """
+    int   → 最窄 int32：更窄的整数在 add_derived_column 的乘法里容易溢出
+    float → 只有全部值能无损放进 float32 时才转换；十进制小数通常做不到，保持 float64
+    """
+    if kind == "int":
+        if ser.isna().any():
+            return ser                              # 含缺失值的整数列保持 float64
+        lo, hi = ser.min(), ser.max()
+        info = np.iinfo(np.int32)
+        return ser.astype(np.int32) if info.min <= lo and hi <= info.max else ser
+    f32 = ser.astype(np.float32)
+    same = (f32.astype(np.float64) == ser) | ser.isna()
+    return f32 if bool(same.all()) else ser
+
+
+class _KeyScan:
+    """
+    key 列格式推断，可以分块累积。格式 (前缀, 最小位数) 成立的条件：
+      前缀统一；按最小位数补零能原样还原每个值（J001…J999, J1000 → ("J", 3)；J01 与 J001 并存则不行）；
+      无重复；数字在 int32 范围内。不成立时 result() 返回 None（退回 category）
+    """
+
+    def __init__(self):
+        self.ok = True
+        self.prefixes = set()
+        self.min_len = None
+        self.zero_len = 0              # 以 0 开头的数字串的最大长度：必须等于最小位数
+        self.codes = []
+
+    def update(self, ser):
+        parts = ser.astype(str).str.extract(_KEY_RE)
+        if parts.isna().any().any():
+            self.ok = False
+        if not self.ok or not len(parts):
+            return self
+        self.prefixes.update(parts[0].unique())
+        lens = parts[1].str.len()
+        self.min_len = int(lens.min()) if self.min_len is None else min(self.min_len, int(lens.min()))
+        zero = parts[1].str.startswith("0")
+        if zero.any():
+            self.zero_len = max(self.zero_len, int(lens[zero].max()))
+        self.codes.append(parts[1].astype(np.int64).to_numpy())
+        return self
+
+    def result(self):
+        if not self.ok or len(self.prefixes) != 1 or not self.codes or self.zero_len > self.min_len:
+            return None
+        codes = np.concatenate(self.codes)
+        if codes.max() > np.iinfo(np.int32).max or len(np.unique(codes)) != len(codes):
+            return None
+        return next(iter(self.prefixes)), self.min_len
+
+
+def _encode_key(ser):
+    """"J001" → 1（格式已确认可还原）"""
+    return ser.astype(str).str.extract(_KEY_RE)[1].astype(np.int64).astype(np.int32)
+
+
+def scan_key_formats(csv_file, chunksize):
+    """分块模式：先整表扫一遍 key 列定出格式，各块共用（不随块变化）；同一文件版本只扫一次"""
+    st = os.stat(csv_file)
+    memo_key = (os.path.abspath(csv_file), st.st_mtime_ns, st.st_size)
+    if memo_key not in _SCANNED_KEYS:
+        header = pd.read_csv(csv_file, nrows=0).columns
+        cols = [c for c in header if SCHEMA.get(c) == "key"]
+        scans = {c: _KeyScan() for c in cols}
+        if cols:
+            for chunk in pd.read_csv(csv_file, usecols=cols, dtype=str, chunksize=chunksize):
+                for c in cols:
+                    scans[c].update(chunk[c])
+        _SCANNED_KEYS[memo_key] = {c: scan.result() for c, scan in scans.items()}
+    formats = _SCANNED_KEYS[memo_key]
+    _set_key_formats(formats)
+    return formats
+
+
+def _set_key_formats(formats):
+    for col, fmt in formats.items():
+        if fmt is None:
+            KEY_FORMATS.pop(col, None)
+        else:
+            KEY_FORMATS[col] = fmt
+
+
+def apply_schema(df, key_formats=None):
+    """
+    按 SCHEMA 转换列类型（CSV 整表或分块读取时共用）
+    key_formats 给定时（分块模式，见 scan_key_formats）按它编码，不从本块数据推断
+    """
+    out = {}
+    for col in df.columns:
+        kind = SCHEMA.get(col)
+        ser = df[col]
+        if kind == "key":
+            if len(ser) and not pd.api.types.is_integer_dtype(ser):
+                if key_formats is None:
+                    fmt = _KeyScan().update(ser).result()
+                    _set_key_formats({col: fmt})
+                else:
+                    fmt = key_formats.get(col)
+                ser = _encode_key(ser) if fmt is not None else ser.astype("category")
+        elif kind == "category":
+            ser = ser.astype("category")
+        elif kind in ("int", "float"):
+            ser = _downcast(pd.to_numeric(ser, errors="coerce"), kind)
+        elif kind == "datetime" and not pd.api.types.is_datetime64_any_dtype(ser):
+            ser = pd.to_datetime(ser, errors="coerce")
+        out[col] = ser
+    return pd.DataFrame(out, index=df.index)
+
+
+def parse_key(col, text):
+    """条件里的 'J001' → 1；已经是数字就直接用"""
+    prefix, _ = KEY_FORMATS[col]
+    text = str(text).strip()
+    if prefix and text.startswith(prefix):
+        text = text[len(prefix):]
+    return int(text)
+
+
+def format_keys(df):
+    """把整数 key 列还原成 'J001' 形式，用于展示 / 输出"""
+    cols = [c for c in KEY_FORMATS if c in df.columns and pd.api.types.is_integer_dtype(df[c])]
+    if not cols:
+        return df
+    fmt = {c: (lambda v, p=KEY_FORMATS[c][0], w=KEY_FORMATS[c][1]: f"{p}{v:0{w}d}") for c in cols}
+    return df.assign(**{c: df[c].map(fmt[c]) for c in cols})
+
+
+def format_key(col, value):
+    """key 列上的单个标量（calculate_mode / min / max 的结果）还原成 'J001'；其它值原样返回"""
+    if col not in KEY_FORMATS or isinstance(value, (bool, np.bool_)) \
+            or not isinstance(value, (int, float, np.integer, np.floating)) or value != value:
+        return value
+    prefix, width = KEY_FORMATS[col]
+    return f"{prefix}{int(value):0{width}d}"
+
+
+# ---------- 派生度量：常用时间差，按数据集版本缓存为 int64 秒 ----------
+MEASURES = {
+    "end_delay":          ("Actual_End", "Scheduled_End"),
+    "start_delay":        ("Actual_Start", "Scheduled_Start"),
+    "actual_duration":    ("Actual_End", "Actual_Start"),
+    "scheduled_duration": ("Scheduled_End", "Scheduled_Start"),
+}
+UNIT_SECONDS = {"seconds": 1, "minutes": 60, "hours": 3600}
+
+_FRAME_MEMO = {}     # id(df) → {(end, start): (secs, valid)}，df 被回收时自动清掉
+
+
+def _as_seconds(ser):
+    if not pd.api.types.is_datetime64_any_dtype(ser):
+        ser = pd.to_datetime(ser, errors="coerce")
+    vals = ser.to_numpy()
+    return vals.astype("datetime64[s]").view("i8"), ~np.isnat(vals)
+
+
+def _diff_seconds(df, end_col, start_col):
+    """(end − start) 的 int64 秒 + 有效位（两端都非 NaT）"""
+    e, ev = _as_seconds(df[end_col])
+    s, sv = _as_seconds(df[start_col])
+    valid = ev & sv
+    secs = np.where(valid, e - s, 0).astype(np.int64)
+    return secs, valid
+
+
+def seconds_between(df, end_col, start_col, unit="seconds"):
+    """
+    (end_col − start_col) 换算到 unit，返回与 df 行对齐的 float64 数组（缺失为 NaN）
+      • df 是共享全量数据 → 每个数据集版本只算一次
+      • 其他 DataFrame     → 按对象缓存，同一计划里多次使用只算一次
+    """
+    key = (end_col, start_col)
+    if DATASET.is_base(df):
+        secs, valid = DATASET.derived(("seconds", key), lambda base: _diff_seconds(base, *key))
+    else:
+        memo = _FRAME_MEMO.get(id(df))
+        if memo is None:
+            memo = _FRAME_MEMO[id(df)] = {}
+            weakref.finalize(df, _FRAME_MEMO.pop, id(df), None)
+        if key not in memo:
+            memo[key] = _diff_seconds(df, *key)
+        secs, valid = memo[key]
+    scale = UNIT_SECONDS.get(unit, 1)
+    out = secs / scale                       # 单位换算只是一次缩放
+    out[~valid] = np.nan
+    return out
+
+
+def measure(df, name, unit="seconds"):
+    """MEASURES 里的命名度量（end_delay / start_delay / actual_duration / scheduled_duration）"""
+    end_col, start_col = MEASURES[name]
+    return pd.Series(seconds_between(df, end_col, start_col, unit), index=df.index, name=name)
+
+
+def memory_report(df=None):
+    """每列内存占用（deep），外加总计行"""
+    df = get_dataset() if df is None else df
+    rep = pd.DataFrame({"dtype": df.dtypes.astype(str),
+                        "bytes": df.memory_usage(deep=True, index=False)})
+    rep.loc["TOTAL"] = ["", int(rep["bytes"].sum())]
+    return rep
+
+
+def _snapshot_format():
+    """有 pyarrow 就用 Feather（列式、可零拷贝），否则退回 pickle（同样保留 dtype）"""
+    try:
+        import pyarrow  # noqa: F401
+        return "feather"
+    except ImportError:
+        return "pickle"
+
+
+class TimeIndex:
+    """
+    单个时间列的有序索引：按时间排好的行号 + 对应的时间值（NaT 不入索引）
+    窗口查询用 searchsorted 二分定位，只取窗口内的行号
+    """
+
+    def __init__(self, ser):
+        vals = ser.to_numpy()
+        valid = np.flatnonzero(~np.isnat(vals))
+        order = valid[np.argsort(vals[valid], kind="stable")]
+        self.positions = order
+        self.values = vals[order]
+
+    def _bound(self, ts):
+        return pd.Timestamp(ts).to_datetime64().astype(self.values.dtype)
+
+    def window(self, start=None, end=None, left_closed=True, right_closed=True):
+        """[start, end] 内的行号（按原始行序升序）；端点开闭由 left/right_closed 决定"""
+        lo, hi = 0, len(self.values)
+        if start is not None:
+            lo = np.searchsorted(self.values, self._bound(start), side="left" if left_closed else "right")
+        if end is not None:
+            hi = np.searchsorted(self.values, self._bound(end), side="right" if right_closed else "left")
+        return np.sort(self.positions[lo:max(lo, hi)])
+
+
+class DatasetCache:
+    """
+    一个 CSV 对应一个缓存实例
+      get()      → 共享的只读 DataFrame（调用方不得原地修改）
+      version    → 数据集版本号，文件变化后递增，供下游派生缓存失效使用
+    """
+
+    def __init__(self, csv_file=CSV_FILE, cache_dir=CACHE_DIR):
+        self.csv_file = csv_file
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._sig = None
+        self._frame = None
+        self.version = 0
+        self.last_source = None        # memory | snapshot | csv
+        self.last_load_seconds = 0.0
+        self._derived = {}             # 当前版本上的派生结构（时间索引等），版本变化即清空
+
+    # ----------- 文件签名 / 快照路径 -----------
+    def _signature(self):
+        if not os.path.exists(self.csv_file):
+            raise FileNotFoundError(self.csv_file)
+        st = os.stat(self.csv_file)
+        return [st.st_mtime_ns, st.st_size, SNAPSHOT_VERSION]
+
+    def _snapshot_paths(self, fmt):
+        stem = os.path.splitext(os.path.basename(self.csv_file))[0]
+        data = os.path.join(self.cache_dir, f"{stem}.{fmt}")
+        return data, data + ".meta.json"
+
+    # ----------- 快照读写 -----------
+    def _read_snapshot(self, sig):
+        fmt = _snapshot_format()
+        data_path, meta_path = self._snapshot_paths(fmt)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("signature") != sig or not os.path.exists(data_path):
+            return None
+        self._key_formats = meta.get("key_formats", {})
+        try:
+            if fmt == "feather":
+                return pd.read_feather(data_path, memory_map=True)
+            return pd.read_pickle(data_path)
+        except Exception as e:      # 快照损坏 → 当作未命中，重新解析 CSV
+            print(f"[WARN] Snapshot unreadable ({e}); re-parsing CSV")
+            return None
+
+    def _write_snapshot(self, df, sig):
+        fmt = _snapshot_format()
+        data_path, meta_path = self._snapshot_paths(fmt)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{data_path}.{os.getpid()}.tmp"
+            if fmt == "feather":
+                df.to_feather(tmp)
+            else:
+                df.to_pickle(tmp)
+            os.replace(tmp, data_path)           # 先写数据再写 meta，保证 meta 永远指向完整快照
+            with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"signature": sig, "format": fmt, "key_formats": KEY_FORMATS}, f)
+            os.replace(meta_path + ".tmp", meta_path)
+        except OSError as e:        # 只读目录等情况：不影响本次结果
+            print(f"[WARN] Could not write snapshot: {e}")
+
+    def _parse_csv(self):
+        cats = {c: "category" for c, k in SCHEMA.items() if k == "category"}
+        return apply_schema(pd.read_csv(self.csv_file, parse_dates=TIME_COLS, dayfirst=False, dtype=cats))
+
+    def _restore_key_formats(self, df):
+        for col, fmt in getattr(self, "_key_formats", {}).items():
+            if col in df.columns:
+                KEY_FORMATS[col] = tuple(fmt)
+
+    # ----------- 对外接口 -----------
+    def get(self):
+        sig = self._signature()
+        with self._lock:
+            if self._frame is not None and sig == self._sig:
+                self.last_source = "memory"
+                self.last_load_seconds = 0.0
+                return self._frame
+
+            t0 = time.perf_counter()
+            df = self._read_snapshot(sig)
+            source = "snapshot"
+            if df is None:
+                df = self._parse_csv()
+                self._write_snapshot(df, sig)
+                source = "csv"
+
+            if source == "snapshot":
+                self._restore_key_formats(df)
+            self._frame, self._sig = df, sig
+            self._derived = {}
+            self.version += 1
+            self.last_source = source
+            self.last_load_seconds = time.perf_counter() - t0
+            print(f"[LOG] Dataset loaded from {source} in {self.last_load_seconds:.3f}s")
+            return df
+
+    def is_base(self, df):
+        """df 是否就是当前缓存的全量数据（未过滤、未派生）"""
+        return df is not None and df is self._frame
+
+    def derived(self, name, builder):
+        """
+        按数据集版本缓存的派生结构：同一版本只 builder(frame) 一次
+          DATASET.derived(("time_index", col), lambda df: TimeIndex(df[col]))
+        """
+        frame = self.get()
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = builder(frame)
+            return self._derived[name]
+
+    def time_index(self, col):
+        """TIME_COLS 列的有序索引（懒构建，每个版本一次）"""
+        return self.derived(("time_index", col), lambda df: TimeIndex(df[col]))
+
+    def clear(self):
+        with self._lock:
+            self._frame, self._sig = None, None
+            self._derived = {}
+
+    def use(self, csv_file, cache_dir=None):
+        """切换到另一个 CSV（基准测试 / 离线数据），下次 get() 重新加载"""
+        with self._lock:
+            self.csv_file = csv_file
+            if cache_dir is not None:
+                self.cache_dir = cache_dir
+        self.clear()
+
+
+# 进程内唯一实例
+DATASET = DatasetCache()
+
+
+def get_dataset():
+    """共享的全量数据（只读）"""
+    return DATASET.get()
+
+
+if __name__ == "__main__":
+    # python dataset_cache.py → 打印每列内存占用
+    print(memory_report().to_string())
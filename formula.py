@@ -0,0 +1,208 @@
+# formula.py
+# 说明：add_derived_column 的表达式编译器。公式只解析一次（按文本缓存），编译成闭包树，
+#       在 NumPy 数组上向量化求值：
+#         • 列引用在求值前对照 DataFrame 的列检查，缺列直接报出列名
+#         • 两个时间列相减 → 秒（float），可以继续参与混合运算，如 (Actual_End - Actual_Start) / Processing_Time
+#         • {last_scalar} 等占位符作为参数绑定，不再把字面量拼进公式文本
+#         • `带空格的列名` 用反引号引用（与 pandas.eval 一致）
+
+import ast
+import operator
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from dataset_cache import seconds_between
+
+_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+_BACKTICK_RE = re.compile(r"`([^`]+)`")
+_PARAM_PREFIX = "__param_"
+_QUOTED_PREFIX = "__col_"
+
+_BINOPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+           ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+           ast.Pow: operator.pow, ast.BitAnd: operator.and_, ast.BitOr: operator.or_}
+_CMPOPS = {ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt,
+           ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge}
+_FUNCS = {"abs": np.abs, "sqrt": np.sqrt, "log": np.log, "log10": np.log10, "exp": np.exp,
+          "floor": np.floor, "ceil": np.ceil, "round": np.round}
+
+
+class FormulaError(ValueError):
+    """公式语法不受支持或引用了不存在的列"""
+
+
+class Program:
+    """
+    编译后的公式
+      columns → 引用到的列名
+      params  → 需要绑定的占位符名（如 last_scalar）
+      evaluate(df, params) → 与 df 行对齐的 numpy 数组（或标量）
+    """
+
+    def __init__(self, formula, fn, columns, params):
+        self.formula, self._fn = formula, fn
+        self.columns, self.params = columns, params
+
+    def check(self, columns):
+        missing = sorted(set(self.columns) - set(columns))
+        if missing:
+            raise FormulaError(f"Unknown column(s) {missing} in formula {self.formula!r}; "
+                               f"available: {list(columns)}")
+
+    def evaluate(self, df, params=None):
+        self.check(df.columns)
+        params = params or {}
+        unbound = [p for p in self.params if params.get(p) is None]
+        if unbound:
+            raise FormulaError(f"Unbound placeholder(s) {unbound} in formula {self.formula!r}")
+        return self._fn(_Env(df, params))
+
+
+class _Env:
+    """求值环境：列按需取成 numpy 数组（小整数升到 int64，避免乘法溢出），每列只取一次"""
+
+    def __init__(self, df, params):
+        self.df, self.params, self._cols = df, params, {}
+
+    def column(self, name):
+        if name not in self._cols:
+            ser = self.df[name]
+            if isinstance(ser.dtype, pd.CategoricalDtype):
+                arr = ser.astype(object).to_numpy()
+            elif pd.api.types.is_integer_dtype(ser):
+                arr = ser.to_numpy(dtype=np.int64)
+            elif pd.api.types.is_datetime64_any_dtype(ser):
+                arr = ser.to_numpy()
+            elif pd.api.types.is_numeric_dtype(ser):
+                arr = ser.to_numpy(dtype=np.float64, na_value=np.nan)
+            else:
+                arr = ser.to_numpy()
+            self._cols[name] = arr
+        return self._cols[name]
+
+
+def _is_time(x):
+    return isinstance(x, np.ndarray) and x.dtype.kind == "M"
+
+
+def _time_diff_seconds(a, b):
+    delta = (a - b).astype("timedelta64[ns]")
+    out = delta.astype(np.int64) / 1e9
+    out[np.isnat(delta)] = np.nan
+    return out
+
+
+# ---------- 编译：AST → 闭包 ----------
+def _compile(node, columns, params, quoted):
+    if isinstance(node, ast.Expression):
+        return _compile(node.body, columns, params, quoted)
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str, bool)):
+        value = node.value
+        return lambda env: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name.startswith(_PARAM_PREFIX):
+            p = name[len(_PARAM_PREFIX):]
+            params.append(p)
+            return lambda env: env.params[p]
+        name = quoted.get(name, name)
+        columns.append(name)
+        return lambda env: env.column(name)
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+        op = _BINOPS[type(node.op)]
+        lhs = _compile(node.left, columns, params, quoted)
+        rhs = _compile(node.right, columns, params, quoted)
+        if isinstance(node.op, ast.Sub) and isinstance(node.left, ast.Name) and isinstance(node.right, ast.Name) \
+                and not node.left.id.startswith(_PARAM_PREFIX) and not node.right.id.startswith(_PARAM_PREFIX):
+            a, b = quoted.get(node.left.id, node.left.id), quoted.get(node.right.id, node.right.id)
+
+            def sub(env):
+                x, y = lhs(env), rhs(env)
+                if _is_time(x) and _is_time(y):          # 两个时间列相减：走派生度量缓存
+                    return seconds_between(env.df, a, b)
+                return op(x, y)
+            return sub
+
+        def binop(env):
+            x, y = lhs(env), rhs(env)
+            if _is_time(x) and _is_time(y) and op is operator.sub:
+                return _time_diff_seconds(x, y)
+            if _is_time(x) or _is_time(y):
+                raise FormulaError("Datetime columns can only be subtracted from each other")
+            return op(x, y)
+        return binop
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd, ast.Not, ast.Invert)):
+        inner = _compile(node.operand, columns, params, quoted)
+        if isinstance(node.op, ast.USub):
+            return lambda env: -inner(env)
+        if isinstance(node.op, ast.UAdd):
+            return inner
+        return lambda env: ~np.asarray(inner(env), dtype=bool)
+
+    if isinstance(node, ast.Compare):
+        parts = [_compile(c, columns, params, quoted) for c in [node.left] + node.comparators]
+        ops = []
+        for o in node.ops:
+            if type(o) not in _CMPOPS:
+                raise FormulaError(f"Unsupported comparison: {type(o).__name__}")
+            ops.append(_CMPOPS[type(o)])
+
+        def compare(env):
+            vals = [p(env) for p in parts]
+            out = True
+            for op, x, y in zip(ops, vals, vals[1:]):
+                out = out & op(x, y)
+            return out
+        return compare
+
+    if isinstance(node, ast.BoolOp):
+        parts = [_compile(v, columns, params, quoted) for v in node.values]
+        combine = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+
+        def boolop(env):
+            out = np.asarray(parts[0](env), dtype=bool)
+            for p in parts[1:]:
+                out = combine(out, np.asarray(p(env), dtype=bool))
+            return out
+        return boolop
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCS \
+            and len(node.args) == 1 and not node.keywords:
+        fn = _FUNCS[node.func.id]
+        arg = _compile(node.args[0], columns, params, quoted)
+        return lambda env: fn(arg(env))
+
+    raise FormulaError(f"Unsupported syntax in formula: {ast.dump(node)[:80]}")
+
+
+def placeholders(formula):
+    """公式里的 {name} 占位符名（按出现顺序、去重），不编译公式"""
+    return tuple(dict.fromkeys(_PLACEHOLDER_RE.findall(str(formula))))
+
+
+@lru_cache(maxsize=512)
+def compile_formula(formula):
+    """公式文本 → Program；同一公式只解析 / 编译一次"""
+    quoted = {}
+
+    def _quote(m):
+        alias = f"{_QUOTED_PREFIX}{len(quoted)}"
+        quoted[alias] = m.group(1)
+        return alias
+
+    text = _BACKTICK_RE.sub(_quote, formula.strip())
+    text = _PLACEHOLDER_RE.sub(lambda m: _PARAM_PREFIX + m.group(1), text)
+    try:
+        tree = ast.parse(text, mode="eval")
+    except SyntaxError as e:
+        raise FormulaError(f"Bad formula syntax: {formula!r} ({e.msg})")
+    columns, params = [], []
+    fn = _compile(tree, columns, params, quoted)
+    return Program(formula, fn, tuple(dict.fromkeys(columns)), tuple(dict.fromkeys(params)))
@@ -0,0 +1,189 @@
+# llm_backends.py
+# 说明：PromptingNode 背后的 LLM 后端。PromptingNode 只依赖 stream() / astream() 两个方法，
+#       具体用哪个后端由环境变量 LLM_BACKEND 决定：
+#
+#   LLM_BACKEND=openai                （默认）OpenAI 兼容接口（NVIDIA NIM），需要 NGC_API_KEY
+#   LLM_BACKEND=replay:plans.jsonl    离线回放：按请求文本返回录好的计划，不联网、结果确定
+#   LLM_RECORD=plans.jsonl            另外把真实后端的每次输出追加到回放文件（录制夹具）
+#
+#   • openai / dotenv / httpx 都在第一次调用时才导入，客户端也在那时创建；
+#     只跑 ExecutionNode / tool_functions 的场景不付这部分导入开销，缺少密钥时也不会在 import 阶段失败
+#   • 回放文件每行一个 JSON：{"request": "...", "plan": {...} 或 "<LLM 原始输出>"}
+
+import json
+import os
+import threading
+
+NIM_BASE_URL = "https://integrate.api.nvidia.com/v1"
+DEFAULT_MODEL = "meta/llama-3.1-70b-instruct"
+
+
+def normalize_request(text):
+    """回放键：折叠空白（与 PreprocessingNode 一致），忽略大小写"""
+    return " ".join(str(text).split()).lower()
+
+
+class LLMBackend:
+    """
+    后端接口
+      stream(prompt, sampling, request)  → 同步文本块迭代器
+      astream(prompt, sampling, request) → 异步文本块迭代器
+    request 是（预处理后的）用户原始请求，真实后端忽略它，回放后端用它查计划
+    """
+    model = None
+
+    def stream(self, prompt, sampling, request=None):
+        raise NotImplementedError
+
+    async def astream(self, prompt, sampling, request=None):
+        for chunk in self.stream(prompt, sampling, request):
+            yield chunk
+
+
+class OpenAIBackend(LLMBackend):
+    def __init__(self, model=DEFAULT_MODEL, base_url=NIM_BASE_URL, api_key_env="NGC_API_KEY",
+                 max_connections=16):
+        self.model, self.base_url, self.api_key_env = model, base_url, api_key_env
+        self.max_connections = max_connections
+        self._client = None
+        self._async_client = None          # 批量模式的异步客户端，首次 astream() 时创建
+        self._lock = threading.Lock()
+
+    def _api_key(self):
+        try:
+            from dotenv import load_dotenv     # 可选：从 .env 读取密钥
+            load_dotenv()
+        except ImportError:
+            pass
+        key = os.getenv(self.api_key_env)
+        if key is None:
+            raise ValueError(f"{self.api_key_env} is not set in the .env file")
+        return key
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI(base_url=self.base_url, api_key=self._api_key())
+        return self._client
+
+    def _get_async_client(self):
+        """异步客户端按需创建；所有并发请求共用一个 httpx 连接池"""
+        with self._lock:
+            if self._async_client is None:
+                import httpx
+                from openai import AsyncOpenAI
+                self._async_client = AsyncOpenAI(
+                    base_url=self.base_url,
+                    api_key=self._api_key(),
+                    http_client=httpx.AsyncClient(limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_connections)),
+                )
+        return self._async_client
+
+    def stream(self, prompt, sampling, request=None):
+        messages = [{"role": "user", "content": prompt}]
+        response = self._get_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            **sampling
+        )
+        try:
+            for chunk in response:
+                delta = chunk.choices[0].delta if chunk.choices else None
+                if delta and delta.content:
+                    yield delta.content
+        finally:
+            response.close()          # 消费方提前停止（推测模式取消候选）时立即断开连接
+
+    async def astream(self, prompt, sampling, request=None):
+        messages = [{"role": "user", "content": prompt}]
+        stream = await self._get_async_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            **sampling
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta if chunk.choices else None
+            if delta and delta.content:
+                yield delta.content
+
+
+class ReplayBackend(LLMBackend):
+    """
+    离线回放：request → 录好的计划文本。没有录过的请求抛 KeyError（不猜）。
+    计划按 chunk_chars 切块输出，流式执行路径（--stream）也能离线跑。
+    """
+
+    def __init__(self, path, chunk_chars=64):
+        self.path, self.chunk_chars = path, chunk_chars
+        self.model = f"replay:{os.path.basename(path)}"
+        self._plans = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self.add(**json.loads(line))
+        print(f"[LOG] Replay backend: {len(self._plans)} plans from {path}")
+
+    def add(self, request, plan):
+        self._plans[normalize_request(request)] = plan if isinstance(plan, str) else json.dumps(plan)
+
+    def stream(self, prompt, sampling, request=None):
+        try:
+            text = self._plans[normalize_request(request)]
+        except KeyError:
+            raise KeyError(f"No recorded plan for request {request!r} in {self.path}") from None
+        for i in range(0, len(text), self.chunk_chars):
+            yield text[i:i + self.chunk_chars]
+
+
+class RecordingBackend(LLMBackend):
+    """包装另一个后端，把每次完整输出追加到回放文件"""
+
+    def __init__(self, inner, path):
+        self.inner, self.path = inner, path
+        self.model = inner.model
+        self._lock = threading.Lock()
+
+    def _save(self, request, parts):
+        line = json.dumps({"request": request, "plan": "".join(parts)}, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def stream(self, prompt, sampling, request=None):
+        parts = []
+        for chunk in self.inner.stream(prompt, sampling, request):
+            parts.append(chunk)
+            yield chunk
+        self._save(request, parts)
+
+    async def astream(self, prompt, sampling, request=None):
+        parts = []
+        async for chunk in self.inner.astream(prompt, sampling, request):
+            parts.append(chunk)
+            yield chunk
+        self._save(request, parts)
+
+
+def make_backend(spec=None, max_connections=16):
+    """
+    按 spec（默认取 LLM_BACKEND）创建后端：
+      "openai" | "replay:<path>"
+    """
+    spec = spec or os.getenv("LLM_BACKEND", "openai")
+    kind, _, arg = spec.partition(":")
+    if kind == "openai":
+        backend = OpenAIBackend(model=arg or DEFAULT_MODEL, max_connections=max_connections)
+    elif kind == "replay":
+        if not arg:
+            raise ValueError("LLM_BACKEND=replay needs a fixture file, e.g. replay:plans.jsonl")
+        backend = ReplayBackend(arg)
+    else:
+        raise ValueError(f"Unknown LLM backend: {spec!r}")
+    record = os.getenv("LLM_RECORD")
+    if record and kind != "replay":
+        backend = RecordingBackend(backend, record)
+    return backend
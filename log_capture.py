@@ -0,0 +1,52 @@
+# log_capture.py
+# 说明：按请求收集 print 输出。sys.stdout 换成 RequestStdout 之后，在 captured() 里打印的内容
+#       写进当前 contextvars 上下文的缓冲区 —— 每个线程 / asyncio 任务各有一份，
+#       并发请求互不串日志，也不用在 await 前后替换进程级的 sys.stdout。
+#       server.py（一个请求一个线程）和 batch.py（一个请求一个 asyncio 任务）共用。
+
+import contextvars
+import io
+import sys
+from contextlib import contextmanager
+
+_REQUEST_LOG = contextvars.ContextVar("request_log", default=None)
+
+
+class RequestStdout(io.TextIOBase):
+    """进程 stdout 的替身：按 contextvars 把输出抄送给当前请求的日志；echo=False 时被收集的输出不再打到终端"""
+
+    def __init__(self, real, echo=True):
+        self.real, self.echo = real, echo
+
+    def write(self, text):
+        buf = _REQUEST_LOG.get()
+        if buf is not None:
+            buf.append(text)
+        if self.echo or buf is None:
+            self.real.write(text)
+        return len(text)
+
+    def flush(self):
+        self.real.flush()
+
+
+@contextmanager
+def installed(echo=True):
+    """在 with 块内把 sys.stdout 换成 RequestStdout，退出时还原"""
+    real = sys.stdout
+    sys.stdout = RequestStdout(real, echo)
+    try:
+        yield sys.stdout
+    finally:
+        sys.stdout = real
+
+
+@contextmanager
+def captured():
+    """当前上下文里的输出收集到返回的列表（需先 installed()）"""
+    lines = []
+    token = _REQUEST_LOG.set(lines)
+    try:
+        yield lines
+    finally:
+        _REQUEST_LOG.reset(token)
@@ -1,52 +1,148 @@
 # main.py
 # 说明：此文件是程序的入口，负责启动所有节点并管理数据流
 
+import contextvars
+import os
 import sys
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 # 如果实际安装了 LangGraph，请使用正确的导入方式
 # from langgraph import Graph, Node
 
+from chunked import DEFAULT_CHUNK_ROWS
+from plan_dag import DEFAULT_DAG_WORKERS
 from node_0_preprocessing import PreprocessingNode
 from node_1_prompting import PromptingNode
 from node_2_execution import ExecutionNode
+from tracing import TRACER
 
 
 class Graph:
     """
-    Mock class for demonstration. In a real scenario, import and use the actual LangGraph library.
+    DAG 调度器：邻接索引 + 拓扑序 + 汇合等待 + 独立分支并行。
+      • 只有一个上游的节点收到该上游的输出；
+      • 有多个上游的节点（fan-in）等所有上游完成后，收到按 add_edge 顺序排列的输出元组；
+      • 入度为 0 的节点一就绪就提交到线程池，兄弟分支并行执行。
+    run() 返回 {node: output}，每个节点的墙钟耗时记录在 self.timings。
+    每个节点在调用方的追踪上下文里执行（线程池不会自动传递 contextvars），span 挂在当前请求下。
     """
-    def __init__(self):
+    def __init__(self, max_workers=None):
         self.nodes = []
         self.edges = []
+        self.max_workers = max_workers
+        self._succ = defaultdict(list)   # 邻接索引，避免每个节点重扫 self.edges
+        self._pred = defaultdict(list)
+        self.timings = {}
 
     def add_nodes(self, node_list):
         self.nodes.extend(node_list)
 
     def add_edge(self, from_node, to_node):
         self.edges.append((from_node, to_node))
+        self._succ[from_node].append(to_node)
+        self._pred[to_node].append(from_node)
+
+    def _reachable(self, start_node):
+        seen, stack = {start_node}, [start_node]
+        while stack:
+            for nxt in self._succ[stack.pop()]:
+                if nxt not in seen:
+                    seen.add(nxt)
+                    stack.append(nxt)
+        return seen
+
+    def topological_order(self, start_node):
+        """从 start_node 可达子图的拓扑序（Kahn）；有环时报错"""
+        nodes = self._reachable(start_node)
+        indeg = {n: sum(p in nodes for p in self._pred[n]) for n in nodes}
+        ready = deque(n for n in nodes if indeg[n] == 0)
+        order = []
+        while ready:
+            node = ready.popleft()
+            order.append(node)
+            for nxt in self._succ[node]:
+                indeg[nxt] -= 1
+                if indeg[nxt] == 0:
+                    ready.append(nxt)
+        if len(order) != len(nodes):
+            raise ValueError("Graph contains a cycle")
+        return order
+
+    def _name(self, node):
+        return getattr(node, "name", None) or f"{type(node).__name__}@{id(node):x}"
 
     def run(self, start_node, input_data):
-        """
-        Simple BFS-like approach: Start at start_node, pass data along edges.
-        In a real scenario, you'd use more sophisticated graph execution logic.
-        """
-        queue = [(start_node, input_data)]
-        visited = set()
-
-        while queue:
-            node, data = queue.pop(0)
-            if node in visited:
-                # Prevent infinite loops
-                continue
-            visited.add(node)
-
-            # Run the node, get output
-            output_data = node.run(data)
-
-            # Find next nodes
-            next_nodes = [edge[1] for edge in self.edges if edge[0] == node]
-            for nxt in next_nodes:
-                queue.append((nxt, output_data))
+        order = self.topological_order(start_node)          # 顺带做环检测
+        nodes = set(order)
+        preds = {n: [p for p in self._pred[n] if p in nodes] for n in order}
+        remaining = {n: len(preds[n]) for n in order}
+        outputs = {}
+        self.timings = {}
+
+        def call(node, data):
+            t0 = time.perf_counter()
+            with TRACER.span(f"node {self._name(node)}"):
+                out = node.run(data)
+            return out, time.perf_counter() - t0
+
+        def submit(pool, node, data):
+            return pool.submit(contextvars.copy_context().run, call, node, data)
+
+        def node_input(node):
+            if node is start_node:
+                return input_data
+            ups = [outputs[p] for p in preds[node]]
+            return ups[0] if len(ups) == 1 else tuple(ups)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            running = {submit(pool, start_node, input_data): start_node}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    node = running.pop(fut)
+                    try:
+                        outputs[node], self.timings[self._name(node)] = fut.result()
+                    except Exception:
+                        for f in running:
+                            f.cancel()
+                        raise
+                    for nxt in self._succ[node]:
+                        remaining[nxt] -= 1
+                        if remaining[nxt] == 0:              # fan-in：所有上游都完成才提交
+                            running[submit(pool, nxt, node_input(nxt))] = nxt
+
+        for name, sec in self.timings.items():
+            print(f"[LOG] Node {name} finished in {sec:.3f}s")
+        return outputs
+
+
+def build_nodes(argv=()):
+    """按命令行开关构建三个节点（main.py 与 server.py 共用）"""
+    pre_node = PreprocessingNode()
+    # --speculative：并发 SPECULATIVE_PLANS 个补全，取第一个通过静态检查的计划
+    speculative = int(os.environ.get("SPECULATIVE_PLANS", 3)) if "--speculative" in argv else 1
+    prompt_node = PromptingNode(stream_actions="--stream" in argv,   # --stream：边生成边执行
+                                speculative=speculative)
+    # --lazy：先优化 action 计划再执行；--chunked：按 CHUNK_ROWS 行分块读 CSV（数据放不进内存时）
+    chunksize = int(os.environ.get("CHUNK_ROWS", DEFAULT_CHUNK_ROWS)) if "--chunked" in argv else None
+    # --parallel：分组类工具按分组键分片到 EXEC_WORKERS 个进程
+    workers = int(os.environ.get("EXEC_WORKERS", os.cpu_count() or 1)) if "--parallel" in argv else None
+    # 带命名中间结果的计划：独立分支最多 DAG_WORKERS 个线程并行
+    dag_workers = int(os.environ.get("DAG_WORKERS", DEFAULT_DAG_WORKERS))
+    exec_node = ExecutionNode(lazy="--lazy" in argv, chunksize=chunksize, workers=workers,
+                              dag_workers=dag_workers)
+    return pre_node, prompt_node, exec_node
+
+
+def build_graph(pre_node, prompt_node, exec_node):
+    """Preprocessing → Prompting → Execution；节点本身无请求状态，可以每个请求建一张图"""
+    graph = Graph()
+    graph.add_nodes([pre_node, prompt_node, exec_node])
+    graph.add_edge(pre_node, prompt_node)
+    graph.add_edge(prompt_node, exec_node)
+    return graph
 
 
 def main():
@@ -54,15 +150,10 @@ def main():
     print("[LOG] Program started. Building graph...")
 
     # 构建节点
-    pre_node = PreprocessingNode()
-    prompt_node = PromptingNode()
-    exec_node = ExecutionNode()
+    pre_node, prompt_node, exec_node = build_nodes(sys.argv)
 
     # 构建图
-    graph = Graph()
-    graph.add_nodes([pre_node, prompt_node, exec_node])
-    graph.add_edge(pre_node, prompt_node)
-    graph.add_edge(prompt_node, exec_node)
+    graph = build_graph(pre_node, prompt_node, exec_node)
 
     # 日志输出：提示用户输入
     print("[LOG] Graph construction completed. Awaiting user input...")
@@ -72,7 +163,8 @@ def main():
 
     # 运行图
     print("[LOG] Starting graph execution...")
-    graph.run(start_node=pre_node, input_data=user_input)
+    with TRACER.span("request", request=user_input):      # TRACE_FILE 未设置时为空操作
+        graph.run(start_node=pre_node, input_data=user_input)
 
     # 日志输出：程序执行完毕
     print("[LOG] Program execution finished.")
@@ -15,7 +15,8 @@ class PreprocessingNode:
 
         # 在此进行一些简单的文本操作，例如去除多余空格，转小写等
         # 下方示例仅作简单处理，可根据需求自行扩展
-        processed_input = user_input.strip()
+        # 连续空白折叠成一个空格：同一问题的不同排版得到同一个计划缓存键
+        processed_input = " ".join(user_input.split())
 
         # 日志输出：处理完毕
         print(f"[LOG] Preprocessing completed. Output: {processed_input}")
@@ -1,215 +1,206 @@
 # node_1_prompting.py
 # 说明：此节点负责构造提示词，调用LLM并获取返回结果
 
-import json
+import contextvars
 import os
-from string import Template
-from openai import OpenAI
+import queue
+import threading
+import time
 # 这里示例使用第二种 LangChain 方式
 # from langchain_nvidia_ai_endpoints import ChatNVIDIA
 
-from dotenv import load_dotenv
-import os
-
-# Load environment variables from .env
-load_dotenv()
-
-# Get NGC_API_KEY
-NGC_API_KEY = os.getenv("NGC_API_KEY")
+from action_stream import StreamingPlan
+from llm_backends import make_backend
+from plan_cache import PlanCache, make_key
+from prompt_builder import PromptBuilder, estimate_tokens
+from tracing import TRACER
 
-if NGC_API_KEY is None:
-    raise ValueError("NGC_API_KEY is not set in the .env file")
+# LLM 客户端见 llm_backends.py：openai / dotenv 在第一次调用时才导入，NGC_API_KEY 也在那时检查
 
 class PromptingNode:
-    def __init__(self):
+    def __init__(self, plan_cache=None, stream_actions=False, max_connections=16, backend=None, speculative=1):
         # 日志输出：节点初始化
         print("[LOG] PromptingNode initialized.")
 
-        # 手动列出可用的列名，以及工具函数列表。
-        # 注意：实际中可根据需要动态生成或更复杂处理
-        self.prompt_template = Template("""
-        You are an assistant that MUST translate a user's natural‑language request
-        into a raw JSON command describing a sequence of data‑processing steps.
-        If the question restricts rows (e.g. “for Grinding jobs”), ALWAYS start with a select_rows action that applies that filter.
-
-        JSON schema you MUST follow  ⬇︎
-        {
-          "actions": [
-            {
-              "function": "<one of: select_rows | sort_rows | calculate_average | calculate_mode | calculate_median>",
-              "args": {
-                // key–value pairs required by that function
-              }
-            },
-            ...
-          ]
-        }
-
-        ––––––––––––––––––––––––––––––––––––
-        Tool functions and what they do
-        ––––––––––––––––––––––––––––––––––––
-        select_rows
-            • Select rows by comparing one column with a value.
-            • args = { "column": <str>, "condition": "<op1> <value1> [AND|OR] <op2> <value2>" }
-              operators: ==, !=, <, <=, >, >=
-              value may be number, string, or datetime (dd/mm/yyyy HH:MM).
-
-        sort_rows
-            • Sort current rows by a column.
-            • args = { "column": <str>, "order": "asc" | "desc" }
-
-        calculate_average
-            • Return the arithmetic mean of a numeric column.
-            • args = { "column": <str> }
-
-        calculate_mode
-            • Return the most common value of a column.
-            • args = { "column": <str> }
-        
-        calculate_median
-            • Return the median of a numeric column.
-            • args = { "column": <str> }
-            
-        add_derived_column
-            • Create a new column from a pandas‑style formula.
-            • args = { "name": <str>, "formula": "<expr>" }
-            • You may use the placeholder {last_scalar} to refer to the scalar returned by the most recent scalar function.
-            • You may write {last_scalar} in the formula; it will be replaced by the scalar returned by the most recent scalar‑function step.
-
-        filter_date_range
-            • Keep rows whose datetime column is between start and end.
-            • args = { "column": <str>, "start": <datetime>, "end": <datetime>,
-                       "inclusive": "both|left|right|neither" }
-
-        group_top_n
-            • For each group, keep the first N rows after sorting (defaults to keep_all = true,
-              so you usually don't need to pass it).
-            • args = { "group_column": <str>, "sort_column": <str>,
-                       "order": "asc|desc", "n": <int> }
-        
-        group_by_aggregate
-            • Group rows by one column, then aggregate another column.
-            • Supports derived metrics such as time deltas.
-            • group_by_aggregate does NOT support covariance/correlation.
-            • args = {
-                "group_column": <str>,
-                // EITHER:
-                "target_column": <str>,
-                // OR (for derived metric):
-                "derived": {
-                    "name": <str>,              # name for new column
-                    "type": "timedelta",
-                    ""end_col": "Actual_End",
-                    "start_col": "Scheduled_End"
-                    "unit": "seconds" | "minutes" | "hours"
-                },
-                "agg": "avg" | "sum" | "min" | "max" | "count" | "std" | "var"
-                "keep_all": true | false
-              }
-        
-        calculate_sum
-            • Return the sum of a numeric column.
-            • args = { "column": <str> }
-        
-        calculate_min / calculate_max
-            • Return the minimum / maximum of a numeric column.
-            • args = { "column": <str> }
-        
-        calculate_std
-            • Return the standard deviation of a numeric column.
-            • args = { "column": <str> }
-        
-        count_rows
-            • Return the number of current rows.
-            • args = {}   (no args needed)
-        
-        top_n
-            • Keep only the first N rows after sorting a column.
-            • args = { "column": <str>, "order": "asc" | "desc", "n": <int> }
-        
-        calculate_delay_avg
-            • For completed jobs, return the average delay in seconds between Actual_End and Scheduled_End.
-            • args = { "unit": "seconds|minutes|hours" (default seconds),
-                       "abs": true|false (default false) }
-
-        
-        rolling_average
-            • Rolling mean over a window.
-            • args = { "column": <str>, "window": <int>, "group_by": <str?> }
-
-        calculate_variance
-        calculate_covariance
-        calculate_correlation
-        calculate_percentile
-        calculate_failure_rate
-            • Return ( #Failed / total ) per group_column.
-            • args = { "group_column": <str> }
-        
-        ––––––––––––––––––––––––––––––––––––
-        Columns available in the CSV
-        ––––––––––––––––––––––––––––––––––––
-        Job_ID · Machine_ID · Operation_Type · Material_Used · Processing_Time ·
-        Energy_Consumption · Machine_Availability · Scheduled_Start ·
-        Scheduled_End · Actual_Start · Actual_End · Job_Status · Optimization_Category
-
-        ––––––––––––––––––––––––––––––––––––
-        Example I/O
-        ––––––––––––––––––––––––––––––––––––
-        User input:
-        "I need all jobs whose Optimization_Category is Low Efficiency AND
-        Processing_Time ≤ 50, then sort them by Machine_Availability descending."
-
-        Expected JSON output (RAW, no markdown):
-        {
-          "actions": [
-            { "function": "select_rows",
-              "args": { "column": "Optimization_Category", "condition": "== 'Low Efficiency'" }
-            },
-            { "function": "select_rows",
-              "args": { "column": "Processing_Time", "condition": "<= 50" }
-            },
-            { "function": "sort_rows",
-              "args": { "column": "Machine_Availability", "order": "desc" }
-            }
-          ]
-        }
-
-        ––––––––––––––––––––––––––––––––––––
-        Reminder: if you need the scalar you just computed, insert {last_scalar} in your formula ,but ONLY if you actually calculated a scalar in a previous step.
-        Now analyse the user's request below and output ONLY the JSON, no markdown, no explanations:
-        \"\"\"$user_request\"\"\"
-        """)
-
-        # ============ 真正实例化 LLM ============ #
-
-        self.client = OpenAI(
-            base_url="https://integrate.api.nvidia.com/v1",
-            api_key=os.getenv("NGC_API_KEY")    # 建议放环境变量
-        )
+        # 提示词：静态前缀 + 按请求挑选的工具说明（见 prompt_builder.py）；PROMPT_SLIM=0 时给全量工具
+        self.prompt_builder = PromptBuilder(slim=os.getenv("PROMPT_SLIM", "1") != "0")
+
+        # ============ LLM 后端（客户端在第一次调用时才创建）============ #
+
+        self.backend = backend if backend is not None else make_backend(max_connections=max_connections)
+        self.model = self.backend.model
+        self.sampling = {"temperature": 0.0, "top_p": 0.7, "max_tokens": 10240}
+
+        # stream_actions=True：run() 返回 StreamingPlan，actions 一闭合就交给 ExecutionNode
+        self.stream_actions = stream_actions
+
+        # speculative=K>1：并发发出 K 个补全（提示词 / 温度各不相同），
+        # 取第一个通过静态检查（plan_validator.py）的计划，其余立即取消
+        self.speculative = max(1, int(speculative))
+
+        # 计划缓存：PLAN_CACHE=0 关闭
+        self.plan_cache = plan_cache if plan_cache is not None else (
+            PlanCache() if os.getenv("PLAN_CACHE", "1") != "0" else None)
 
     def run(self, user_input: str) -> str:
+        """
+        返回 LLM 原始输出（str）；stream_actions=True 时立即返回 StreamingPlan，
+        ExecutionNode 边收边执行
+        """
         # 日志输出：节点执行
         print("[LOG] PromptingNode running...")
 
-        # 在此基于模板和用户输入构造 Prompt
-        final_prompt = self.prompt_template.substitute(user_request=user_input)
-
-        # ------ 调用 LLM（流式）------
-        messages = [{"role": "user", "content": final_prompt}]
-        llm_response = ""
-        for chunk in self.client.chat.completions.create(
-            model="meta/llama-3.1-70b-instruct",
-            messages=messages,
-            temperature=0.0,
-            top_p=0.7,
-            max_tokens=10240,
-            stream=True
-        ):
-            delta = chunk.choices[0].delta
-            if delta and delta.content:
-                llm_response += delta.content
-        # --------------------------------
-
-        print(f"[LOG] LLM raw output:\n{llm_response}")
+        with TRACER.span("prompting", stream_actions=self.stream_actions) as span:
+            # 基于静态前缀、挑选出的工具和用户输入构造 Prompt
+            final_prompt = self._build_prompt(user_input, span)
+
+            # ------ 先查计划缓存 ------
+            key, cached = self._cache_lookup(user_input, final_prompt)
+            span.set(plan_cache_hit=cached is not None)
+            if cached is not None:
+                return StreamingPlan([cached]) if self.stream_actions else cached
+
+            def finish(llm_response):
+                self._finish(key, llm_response)
+
+            if self.speculative > 1:              # 需要完整计划才能检查，不能边生成边执行
+                llm_response, prompt, sampling = self._speculate(user_input, final_prompt, span)
+                # 胜出的候选可能用了全量提示词 / 更高温度：按它实际的提示词和采样参数入缓存
+                if key is not None:
+                    key = make_key(user_input, prompt, self.model, sampling)
+                self._finish(key, llm_response)
+                return StreamingPlan([llm_response]) if self.stream_actions else llm_response
+
+            # LLM span：ttft_ms（首个文本块）、stream_ms（整段流）；流式执行时在消费线程里结束
+            chunks = TRACER.stream("llm", self.backend.stream(final_prompt, self.sampling, user_input),
+                                   model=self.model)
+            if self.stream_actions:
+                return StreamingPlan(chunks, on_complete=finish)
+
+            llm_response = "".join(chunks)
+            finish(llm_response)
+            return llm_response
+
+    async def arun(self, user_input: str) -> str:
+        """
+        run() 的异步版本，供批量模式并发调用；共用计划缓存与 HTTP 连接池
+        """
+        final_prompt = self._build_prompt(user_input)
+        key, cached = self._cache_lookup(user_input, final_prompt)
+        if cached is not None:
+            return cached
+
+        parts = []
+        with TRACER.span("llm", model=self.model, prompt_chars=len(final_prompt)) as span:
+            t0 = time.perf_counter()
+            async for chunk in self.backend.astream(final_prompt, self.sampling, user_input):
+                if not parts:
+                    span.set(ttft_ms=(time.perf_counter() - t0) * 1e3)
+                parts.append(chunk)
+            span.set(stream_ms=(time.perf_counter() - t0) * 1e3, chunks=len(parts))
+        llm_response = "".join(parts)
+        self._finish(key, llm_response)
         return llm_response
 
+    def _build_prompt(self, user_input, span=None):
+        """构造提示词并记录 token 估算（与全量工具的提示词对比）"""
+        final_prompt, tools = self.prompt_builder.build(user_input)
+        tokens = estimate_tokens(final_prompt)
+        print(f"[LOG] Prompt: {len(tools)} tools, ~{tokens} tokens "
+              f"(all tools ~{self.prompt_builder.full_tokens}): {', '.join(tools)}")
+        if span is not None:
+            span.set(prompt_chars=len(final_prompt), prompt_tokens=tokens, prompt_tools=tools)
+        return final_prompt
+
+    def _cache_lookup(self, user_input, final_prompt):
+        key = None
+        if self.plan_cache is not None:
+            # 提示词由请求决定（工具挑选、前缀），整段参与哈希：工具说明改了旧计划自动失效
+            key = make_key(user_input, final_prompt, self.model, self.sampling)
+            cached = self.plan_cache.get(key)
+            if cached is not None:
+                print(f"[LOG] Plan cache hit. stats={self.plan_cache.stats()}")
+                print(f"[LOG] LLM raw output (cached):\n{cached}")
+                return key, cached
+        return key, None
+
+    def _finish(self, key, llm_response):
+        print(f"[LOG] LLM raw output:\n{llm_response}")
+        errors = _validate(llm_response)
+        for err in errors:
+            print(f"[WARN] Plan check: {err}")
+        # 只缓存通过静态检查的计划，避免把坏输出固化下来
+        if key is not None and not errors:
+            self.plan_cache.put(key, llm_response)
+            print(f"[LOG] Plan cached. stats={self.plan_cache.stats()}")
+
+    # ---------- 推测式并行生成 ----------
+    def _variants(self, user_input, final_prompt):
+        """
+        第 i 个候选的 (提示词, 采样参数)：
+          偶数 → 精简提示词，奇数 → 全量工具提示词（防止工具挑选漏掉需要的工具）
+          每两个一组温度 +0.3（候选 0 与普通模式完全相同）
+        """
+        full_prompt = None
+        for i in range(self.speculative):
+            if i % 2:
+                full_prompt = full_prompt or self.prompt_builder.build(user_input, slim=False)[0]
+            temperature = min(1.0, self.sampling["temperature"] + 0.3 * (i // 2))
+            yield (full_prompt if i % 2 else final_prompt), {**self.sampling, "temperature": temperature}
+
+    def _speculate(self, user_input, final_prompt, span):
+        """
+        并发 K 个补全，返回第一个通过检查的计划；都不通过时返回问题最少的一个
+        返回 (计划文本, 该候选的提示词, 该候选的采样参数)
+        """
+        stop = threading.Event()
+        results = queue.Queue()
+
+        def candidate(i, prompt, sampling):
+            parts = []
+            chunks = TRACER.stream("llm", self.backend.stream(prompt, sampling, user_input),
+                                   model=self.model, candidate=i, temperature=sampling["temperature"])
+            try:
+                for chunk in chunks:
+                    if stop.is_set():             # 已有候选胜出：停止读取，关闭连接
+                        results.put((i, None, ["cancelled"]))
+                        return
+                    parts.append(chunk)
+            except Exception as e:
+                results.put((i, None, [f"{type(e).__name__}: {e}"]))
+                return
+            finally:
+                chunks.close()
+            text = "".join(parts)
+            results.put((i, text, _validate(text)))
+
+        variants = list(self._variants(user_input, final_prompt))
+        for i, (prompt, sampling) in enumerate(variants):
+            ctx = contextvars.copy_context()     # 候选的 llm span 挂在当前 prompting span 下
+            threading.Thread(target=ctx.run, args=(candidate, i, prompt, sampling), daemon=True).start()
+
+        best, rejected = None, 0
+        for _ in variants:
+            i, text, errors = results.get()
+            if text is not None and not errors:
+                stop.set()
+                print(f"[LOG] Speculative: candidate {i} passed validation "
+                      f"({rejected} rejected, {len(variants) - rejected - 1} cancelled)")
+                span.set(speculative_candidates=len(variants), speculative_winner=i, speculative_rejected=rejected)
+                return (text, *variants[i])
+            rejected += 1
+            print(f"[WARN] Speculative: candidate {i} rejected: {'; '.join(errors[:3])}")
+            if text is not None and (best is None or len(errors) < len(best[2])):
+                best = (i, text, errors)
+
+        span.set(speculative_candidates=len(variants), speculative_winner=None, speculative_rejected=rejected)
+        if best is None:
+            raise RuntimeError(f"All {len(variants)} speculative completions failed")
+        print(f"[WARN] Speculative: no candidate passed validation; using candidate {best[0]}")
+        return (best[1], *variants[best[0]])
+
+
+def _validate(text):
+    """静态检查（plan_validator 依赖 pandas，第一次用到时才导入）"""
+    from plan_validator import validate_plan
+    return validate_plan(text)
@@ -3,119 +3,350 @@
 
 import pandas as pd
 import json
-from tool_functions import load_data
-from tool_functions import (
-    # 行过滤 / 排序
-    select_rows, sort_rows, top_n, group_top_n, group_by_aggregate, filter_date_range, rolling_average, add_derived_column,
-    # 统计值
-    calculate_average, calculate_mode, calculate_median,
-    calculate_sum, calculate_min, calculate_max, calculate_std,
-    calculate_delay_avg, calculate_variance, calculate_percentile, calculate_correlation, calculate_covariance,
-    calculate_failure_rate, count_rows, calculate_delay_avg_grouped
-)
+from contextlib import contextmanager
+from action_stream import StreamingPlan
+from chunked import ChunkedPlanError, run_chunked
+from dataset_cache import DATASET, format_keys
+from formula import placeholders
+from plan_dag import DATASET_INPUT, DEFAULT_DAG_WORKERS, PlanError, build_dag, check_name, run_dag, uses_names
+from plan_optimizer import optimize, run_filter, run_stats, run_top_n
+from sharded import ShardedRunner
+from tracing import TRACER
+import tool_functions
+from tool_functions import _df, select_mask, date_range_mask
+from tool_registry import tools_of_kind
+
+class RunState:
+    """
+    一次 run() 的执行状态（最近一次标量、"as" 命名的结果）。每次 run() 新建一个，
+    ExecutionNode 本身不保存请求相关的状态，可以被并发请求共用（见 server.py）
+    """
 
-class ExecutionNode:
     def __init__(self):
+        self.last_scalar = None
+        self.named = {}                 # 名字 → DataFrame 或标量
+
+    def param(self, name):
+        """公式占位符 {name} 的值；没有时返回 None"""
+        return self.last_scalar if name == "last_scalar" else self.named.get(name)
+
+    def pick(self, returns):
+        """顶层 "return"：一个名字 → 该结果；名字列表 → {名字: 结果}"""
+        for name in [returns] if isinstance(returns, str) else returns:
+            if name not in self.named:
+                print(f"[ERROR] return refers to undefined result {name!r}")
+        if isinstance(returns, str):
+            return self.named.get(returns)
+        return {name: self.named.get(name) for name in returns}
+
+
+class ExecutionNode:
+    def __init__(self, lazy=False, chunksize=None, workers=None, dag_workers=DEFAULT_DAG_WORKERS):
         # 日志输出：节点初始化
         print("[LOG] ExecutionNode initialized.")
 
+        # lazy=True：先把 actions 建成计划并优化（见 plan_optimizer.py），再执行
+        self.lazy = lazy
+        # chunksize=N：按 N 行分块读 CSV 执行（见 chunked.py），不把整表放进内存
+        self.chunksize = chunksize
+        # workers=N：分组类工具按分组键哈希分片，交给 N 个进程并行（见 sharded.py）
+        self.sharded = ShardedRunner(workers) if workers else None
+        # 带 as / input 的计划按 DAG 执行（见 plan_dag.py），独立分支最多 dag_workers 个线程并行
+        self.dag_workers = dag_workers
+
+        # 工具登记表（tool_registry.py）同时决定提示词里的工具说明，两边不会不同步
         # DataFrame → DataFrame 类型的函数
-        self.df_funcs = {
-            "select_rows": select_rows,
-            "sort_rows": sort_rows,
-            "group_by_aggregate": group_by_aggregate,
-            "top_n": top_n,
-            "group_top_n": group_top_n,
-            "filter_date_range": filter_date_range,
-            "add_derived_column": add_derived_column,
-            "rolling_average": rolling_average,
-        }
+        self.df_funcs = {name: getattr(tool_functions, name) for name in tools_of_kind("df")}
 
         # DataFrame → 标量 的函数
-        self.scalar_funcs = {
-            "calculate_average": calculate_average,
-            "calculate_mode": calculate_mode,
-            "calculate_median": calculate_median,
-            "calculate_sum": calculate_sum,
-            "calculate_min": calculate_min,
-            "calculate_max": calculate_max,
-            "calculate_std": calculate_std,
-            "calculate_variance": calculate_variance,
-            "calculate_percentile": calculate_percentile,
-            "calculate_correlation": calculate_correlation,
-            "calculate_covariance": calculate_covariance,
-            "calculate_delay_avg": calculate_delay_avg,
-            "calculate_failure_rate": calculate_failure_rate,
-            "count_rows": count_rows,
-            "calculate_delay_avg_grouped": calculate_delay_avg_grouped,
+        self.scalar_funcs = {name: getattr(tool_functions, name) for name in tools_of_kind("scalar")}
+
+        # 过滤类函数的 mask 版本，lazy 模式下融合成一次切片
+        self.mask_funcs = {
+            "select_rows": select_mask,
+            "filter_date_range": date_range_mask,
         }
 
-        from tool_functions import load_data
-        self.orig_data = load_data()  # ★ 全量数据 ← 永远不变的“原汁原味”数据
-        self.orig_data = load_data()
-        self.last_scalar = None  # ① 初始化，给 last_scalar 先放个空值
+        if not chunksize:
+            DATASET.get()        # 预热共享缓存（CSV → 快照），首个 action 不再付解析开销
+
+    @property
+    def orig_data(self):
+        """★ 全量数据 ← 进程级共享缓存，只读；文件变化时自动重新加载"""
+        return DATASET.get()
 
-    def run(self, llm_json_str: str):
+    def run(self, llm_json_str):
+        """
+        llm_json_str 可以是完整的 JSON 字符串，也可以是 StreamingPlan（边流式生成边执行）
+        """
+        mode = "chunked" if self.chunksize else "lazy" if self.lazy else "eager"
+        with TRACER.span("execution", mode=mode):
+            return self._run_plan(llm_json_str)
+
+    def _run_plan(self, llm_json_str):
         # 日志输出：节点执行
         print("[LOG] ExecutionNode running...")
 
-        # 解析 LLM 返回的 JSON
-        try:
-            llm_data = json.loads(llm_json_str)
-        except json.JSONDecodeError:
-            print("[ERROR] Failed to decode JSON. Please check the LLM response.")
-            return None
-
-        # 验证是否包含 "actions"
-        if "actions" not in llm_data:
-            print("[ERROR] No 'actions' found in LLM response.")
-            return None
-
-        # 依次执行每个操作
-        current_data = None                  # ★ 流水线数据
-        for action in llm_data["actions"]:
-            fname = action.get("function")
-            args  = action.get("args", {})
-
-            # -------- ② 如果有 {last_scalar} 就替换 --------
-            if fname == "add_derived_column" and "{last_scalar}" in str(args):
-                if "{last_scalar}" in json.dumps(args) and getattr(self, "last_scalar", None) is None:  # 占位符防御，在 raise 报错处改为早返回原 DF
-                    print("[WARN] last_scalar not set; placeholder left untouched")
-                    continue  # 跳过此 action，继续流水
-                if self.last_scalar is None:
-                    raise ValueError("No scalar available for {last_scalar}")
-                # 把占位符换成字面量（字符串加引号，其余直接写数值）
-                lit = (f"'{self.last_scalar}'"
-                       if isinstance(self.last_scalar, str)
-                       else str(self.last_scalar))
-                args = json.loads(json.dumps(args).replace("{last_scalar}", lit))
-            # ------------------------------------------------
-
-            print(f"[LOG] Executing: {fname}  args={args}")
-
-            if fname in self.df_funcs:           # DataFrame → DataFrame
-                func = self.df_funcs[fname]
-                current_data = func(current_data, args)
-
-
-            elif fname in self.scalar_funcs:  # DataFrame → 标量，把最近一次得到的标量记下来
-                func = self.scalar_funcs[fname]
-                data_for_scalar = current_data if current_data is not None else self.orig_data
-                result = func(data_for_scalar, args)
-                self.last_scalar = result  # 存下来
-                globals()["_LAST_SCALAR"] = result  # 提供给 add_derived_column
-                # --------  新增  --------
-                self.last_scalar = result  # 供后续步骤占位符替换
-                # ------------------------
-                print(f"[LOG] {fname} result: {result}")
-
-
-            else:
-                print(f"[ERROR] Unknown function: {fname}")
+        llm_data = None
+        if isinstance(llm_json_str, StreamingPlan):
+            actions = llm_json_str               # 迭代时阻塞等待下一个闭合的 action
+        else:
+            # 解析 LLM 返回的 JSON
+            try:
+                llm_data = json.loads(llm_json_str)
+            except json.JSONDecodeError:
+                print("[ERROR] Failed to decode JSON. Please check the LLM response.")
+                return None
+
+            # 验证是否包含 "actions"
+            if "actions" not in llm_data:
+                print("[ERROR] No 'actions' found in LLM response.")
+                return None
+            actions = llm_data["actions"]
+
+        state = RunState()                       # ① 本次请求的 last_scalar / 命名结果，不与其它请求共享
+        if self.lazy and not self.chunksize:
+            actions = list(actions)              # 计划优化 / DAG 都需要完整的 actions，流式输入在此等待流结束
+
+        pipeline = None                          # 线性执行的 (current_data, last_fname)
+        if self.chunksize:
+            try:
+                pipeline = run_chunked(self, list(actions), state, self.chunksize)
+            except ChunkedPlanError as e:
+                print(f"[ERROR] Plan cannot run in chunked mode: {e}")
+                return None
+        elif isinstance(actions, list) and uses_names(actions, _plan_fields(llm_json_str, llm_data)):
+            # 命名中间结果：整个计划建成 DAG，公共前缀只算一次，独立分支并行
+            returns = _plan_fields(llm_json_str, llm_data).get("return")
+            try:
+                result = run_dag(self, build_dag(actions, returns), self.dag_workers)
+            except PlanError as e:
+                print(f"[ERROR] Invalid plan: {e}")
+                return None
+        elif self.lazy:
+            pipeline = self._run_lazy(actions, state)
+        else:
+            # 依次执行每个操作（流式计划里的 as / input 也在这里按顺序处理）
+            current_data, last_fname = None, None    # ★ 流水线数据
+            for action in actions:
+                last_fname = action.get("function")
+                current_data = self._run_named(action, current_data, state)
+            pipeline = current_data, last_fname
+
+        if isinstance(llm_json_str, StreamingPlan):
+            llm_json_str.wait()
+            if llm_json_str.error is not None:
+                print(f"[ERROR] LLM stream failed: {llm_json_str.error}")
+            elif not llm_json_str.found_actions:
+                print("[ERROR] No 'actions' found in LLM response.")
+
+        if pipeline is None:                     # DAG 已经给出结果
+            self._print_result(result)
+            return result
+        return self._finish(*pipeline, state, _plan_fields(llm_json_str, llm_data).get("return"))
+
+    def _finish(self, current_data, last_fname, state, returns=None):
+        """线性执行结束：有顶层 "return" 时返回命名结果，否则返回最后一步的产出"""
+        if returns is not None:
+            result = state.pick(returns)
+            self._print_result(result)
+            return result
 
         # ---------- 结束后把结果展示出来 ----------
-        if isinstance(current_data, pd.DataFrame):
+        self._print_result(current_data)
+
+        # 返回最后一步的产出：标量函数结尾返回标量，否则返回 DataFrame
+        return state.last_scalar if last_fname in self.scalar_funcs else current_data
+
+    def _print_result(self, result):
+        if isinstance(result, pd.DataFrame):
             print("[LOG] Final DataFrame preview (first 10 rows):")
-            print(current_data.head(10).to_string(index=False))
+            print(format_keys(result.head(10)).to_string(index=False))
+        elif isinstance(result, dict):
+            for name, value in result.items():
+                if isinstance(value, pd.DataFrame):
+                    print(f"[LOG] Result {name!r} ({len(value)} rows, first 10):")
+                    print(format_keys(value.head(10)).to_string(index=False))
+                else:
+                    print(f"[LOG] Result {name!r}: {value}")
+
+    def _bind_placeholders(self, fname, args, lookup):
+        """
+        {last_scalar} / {name} 作为公式参数传入（不改写公式文本），lookup(名字) 给出标量；
+        有占位符没有值时返回 None 表示跳过此 action
+        """
+        if fname != "add_derived_column":
+            return args
+        names = placeholders(args.get("formula", ""))
+        if not names:
+            return args
+        params = {}
+        for name in names:
+            params[name] = lookup(name)
+            if params[name] is None:  # 占位符防御，在 raise 报错处改为早返回原 DF
+                print(f"[WARN] {name} not set; placeholder left untouched")
+                return None  # 跳过此 action，继续流水
+        return {**args, "params": {**args.get("params", {}), **params}}
+
+    def _run_named(self, action, current_data, state):
+        """顺序执行一个 action，处理 "input"（从命名结果读）和 "as"（命名输出）"""
+        fname = action.get("function")
+        src = action.get("input")
+        if src is None:
+            data = current_data
+        elif src == DATASET_INPUT:
+            data = None
+        elif isinstance(state.named.get(src), pd.DataFrame):
+            data = state.named[src]
+        else:
+            what = "is not a table" if src in state.named else "is not defined"
+            print(f"[ERROR] input {src!r} {what}; skipping {fname}")
+            return current_data
+
+        out = self._run_action(fname, action.get("args", {}), data, state)
+        if fname in self.scalar_funcs:           # 标量步骤不改变流水线
+            value, out = state.last_scalar, current_data
+        else:
+            value = out
+        if action.get("as") is not None:
+            try:
+                state.named[check_name(action["as"])] = value
+            except PlanError as e:
+                print(f"[ERROR] {e}")
+        return out
+
+    def _run_action(self, fname, args, current_data, state):
+        """执行一个 action，返回新的 current_data"""
+        # -------- ② 如果有 {last_scalar} 等占位符就绑定参数 --------
+        args = self._bind_placeholders(fname, args, state.param)
+        if args is None:
+            return current_data
+        # ------------------------------------------------
+
+        out = self._apply(fname, args, current_data)
+        if fname in self.scalar_funcs:  # DataFrame → 标量，把最近一次得到的标量记下来
+            state.last_scalar = out     # 供后续步骤占位符替换
+            return current_data
+        return out
+
+    def _apply(self, fname, args, data):
+        """调用一个工具：DataFrame 工具返回新表，标量工具返回结果；未知函数报错并原样返回输入"""
+        print(f"[LOG] Executing: {fname}  args={args}")
+
+        if fname in self.df_funcs:           # DataFrame → DataFrame
+            func = self.df_funcs[fname]
+            with self._action_span(fname, args, data) as span:
+                out = self._call(fname, func, data, args)
+                _set_rows_out(span, out)
+            return out
+
+        elif fname in self.scalar_funcs:     # DataFrame → 标量
+            func = self.scalar_funcs[fname]
+            with self._action_span(fname, args, data) as span:
+                data_for_scalar = data if data is not None else self.orig_data
+                result = self._call(fname, func, data_for_scalar, args)
+                _set_rows_out(span, result)
+            print(f"[LOG] {fname} result: {result}")
+            return result
+
+        print(f"[ERROR] Unknown function: {fname}")
+        return data
+
+    def _action_span(self, name, args, current_data):
+        """每个 action 一个 span：输入行数、数据来源（流水线 / 共享缓存及其加载耗时）"""
+        span_cm = TRACER.span(f"action {name}", profile=True, **{"action.function": name})
+        if TRACER.enabled:
+            from_dataset = current_data is None or DATASET.is_base(current_data)
+            rows_in = len(current_data) if current_data is not None else len(self.orig_data)
+            attrs = {"action.args": json.dumps(args, ensure_ascii=False, default=str), "rows_in": rows_in,
+                     "input": "dataset" if from_dataset else "pipeline"}
+            if from_dataset:
+                attrs.update(dataset_source=DATASET.last_source,
+                             dataset_load_ms=DATASET.last_load_seconds * 1e3,
+                             dataset_version=DATASET.version)
+            return _with_attrs(span_cm, attrs)
+        return span_cm
+
+    def _call(self, fname, func, data, args):
+        """分组类工具优先走多进程分片；不能分片（或数据太小）时单进程执行"""
+        if self.sharded is not None:
+            result = self.sharded.run(fname, args, _df(data))
+            if result is not None:
+                return result
+        return func(data, args)
+
+    def _run_lazy(self, actions, state):
+        """lazy 模式：先生成并打印物理计划，再逐步执行（过滤融合 / 下推 / 排序消除 / 标量合并）"""
+        plan = optimize(actions)
+        print(plan.explain())
+
+        current_data = None
+        for step in plan.steps:
+            current_data = self._run_step(step, current_data, state)
+        return current_data, (plan.steps[-1].fname if plan.steps else None)
+
+    def _run_step(self, step, current_data, state):
+        """执行物理计划中的一步，返回新的 current_data"""
+        if step.op == "call":
+            return self._run_action(step.fname, step.args, current_data, state)
+        print(f"[LOG] Executing: {step.describe()}")
+        with self._action_span(step.op, {"plan_step": step.describe()}, current_data) as span:
+            if step.op == "filter":
+                out = run_filter(_df(current_data), step, self.mask_funcs)
+            elif step.op == "top_n":
+                out = run_top_n(_df(current_data), step.args)
+            else:                                            # stats
+                for fname, result in run_stats(current_data, step):
+                    state.last_scalar = result
+                    print(f"[LOG] {fname} result: {result}")
+                out = current_data
+            _set_rows_out(span, out)
+        return out
+
+
+@contextmanager
+def _with_attrs(span_cm, attrs):
+    with span_cm as span:
+        yield span.set(**attrs)
+
+
+def _set_rows_out(span, out):
+    if isinstance(out, pd.DataFrame):
+        span.set(rows_out=len(out), result_type="DataFrame")
+    else:
+        span.set(result_type=type(out).__name__)
+
+
+def _plan_fields(plan, parsed):
+    """计划的顶层对象：非流式时就是已解析的 dict；流式时等流结束后解析完整文本（顶层 "return" 在最后）"""
+    if parsed is not None:
+        return parsed
+    if isinstance(plan, StreamingPlan):
+        try:
+            data = json.loads(plan.wait())
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+    return {}
 
 
+def result_to_json(result, max_rows=20):
+    """执行结果 → 可 JSON 序列化的 dict（DataFrame 只带前 max_rows 行预览；命名结果逐个转换）"""
+    if isinstance(result, dict):
+        return {"type": "named", "values": {str(k): result_to_json(v, max_rows) for k, v in result.items()}}
+    if isinstance(result, pd.DataFrame):
+        preview = format_keys(result.head(max_rows))
+        return {"type": "dataframe", "rows": int(len(result)),
+                "columns": [str(c) for c in result.columns],
+                "preview": json.loads(preview.to_json(orient="records", date_format="iso"))}
+    if isinstance(result, pd.Series):
+        return result_to_json(result.to_frame(), max_rows)
+    if result is None:
+        return {"type": "none", "value": None}
+    if hasattr(result, "isoformat"):
+        return {"type": "scalar", "value": result.isoformat()}
+    if hasattr(result, "item"):                  # numpy 标量
+        result = result.item()
+    if isinstance(result, float) and result != result:
+        result = None                            # NaN → null
+    return {"type": "scalar", "value": result}
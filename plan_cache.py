@@ -0,0 +1,117 @@
+# plan_cache.py
+# 说明：“请求 → JSON 计划”缓存，挡在 PromptingNode 的 LLM 调用前面。
+#       两级：进程内 LRU + SQLite 持久层；支持 TTL 与按条目数淘汰，并统计命中/未命中。
+#       temperature=0.0 时同一提示词得到同一计划，命中即可完全跳过网络请求。
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+PLAN_CACHE_FILE = os.path.join(".cache", "plan_cache.sqlite")
+
+
+def make_key(request, template, model, params):
+    """
+    缓存键 = 规范化后的请求 + 提示词模板哈希 + 模型名 + 采样参数
+    模板 / 模型 / 参数任何一项变化，旧计划自动失效
+    """
+    tpl_hash = hashlib.sha256(template.encode("utf-8")).hexdigest()
+    payload = json.dumps({"request": request, "template": tpl_hash,
+                          "model": model, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    def __init__(self, path=PLAN_CACHE_FILE, max_memory=256, max_disk=10000, ttl=7 * 24 * 3600):
+        """
+        max_memory : 内存 LRU 条目上限
+        max_disk   : SQLite 条目上限，超过后按最近访问时间淘汰
+        ttl        : 秒；过期条目视为未命中并删除。None 表示永不过期
+        path=None  : 只用内存层
+        """
+        self.max_memory, self.max_disk, self.ttl = max_memory, max_disk, ttl
+        self._mem = OrderedDict()          # key → (plan, created)
+        self._lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+        self._db = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute("""CREATE TABLE IF NOT EXISTS plans (
+                                      key TEXT PRIMARY KEY, plan TEXT NOT NULL,
+                                      created REAL NOT NULL, accessed REAL NOT NULL)""")
+                self._db.commit()
+            except sqlite3.Error as e:     # 磁盘不可写时退化为纯内存缓存
+                print(f"[WARN] Plan cache disk tier disabled: {e}")
+                self._db = None
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, key, plan, created):
+        self._mem[key] = (plan, created)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_memory:
+            self._mem.popitem(last=False)
+
+    # ----------- 对外接口 -----------
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            if key in self._mem:
+                plan, created = self._mem[key]
+                if not self._expired(created, now):
+                    self._mem.move_to_end(key)
+                    self.hits["memory"] += 1
+                    return plan
+                del self._mem[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT plan, created FROM plans WHERE key = ?", (key,)).fetchone()
+                if row and not self._expired(row[1], now):
+                    self._db.execute("UPDATE plans SET accessed = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[0], row[1])
+                    self.hits["disk"] += 1
+                    return row[0]
+                if row:
+                    self._db.execute("DELETE FROM plans WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, key, plan):
+        now = time.time()
+        with self._lock:
+            self._remember(key, plan, now)
+            if self._db is None:
+                return
+            self._db.execute("INSERT OR REPLACE INTO plans (key, plan, created, accessed) VALUES (?, ?, ?, ?)",
+                             (key, plan, now, now))
+            if self.ttl is not None:
+                self._db.execute("DELETE FROM plans WHERE created < ?", (now - self.ttl,))
+            self._db.execute("""DELETE FROM plans WHERE key IN (
+                                  SELECT key FROM plans ORDER BY accessed DESC LIMIT -1 OFFSET ?)""",
+                             (self.max_disk,))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM plans")
+                self._db.commit()
+
+    def stats(self):
+        total = self.hits["memory"] + self.hits["disk"] + self.misses
+        return {"memory_hits": self.hits["memory"], "disk_hits": self.hits["disk"],
+                "misses": self.misses,
+                "hit_rate": (total - self.misses) / total if total else 0.0}
@@ -0,0 +1,233 @@
+# plan_dag.py
+# 说明：带命名中间结果的计划。action 除 function / args 外可以写
+#         "as": "grinding"       给这一步的输出命名（DataFrame 或标量）
+#         "input": "grinding"    从命名结果读（"dataset" 表示原始表），而不是接着上一个 DataFrame 步骤
+#       公式里的 {name} 引用命名标量（与 {last_scalar} 一样按参数绑定），
+#       计划顶层 "return": "name" | ["a", "b"] 指定返回哪些命名结果（列表 → {name: 结果}）。
+#       没写 input 的步骤仍接在上一个 DataFrame 步骤之后，旧的线性计划就是一条链。
+#
+#   build_dag(actions) → PlanDag
+#     • 函数、参数、输入都相同的步骤合并成一个节点 —— 两个分支共同的前缀只算一次
+#     • 记下每个节点的消费者个数；执行时最后一个消费者完成就释放它的输出（峰值内存有界）
+#   run_dag(node, dag) → 线程池执行：输入都已就绪的节点立即提交，独立分支并行
+
+import contextvars
+import json
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from dataset_cache import DATASET
+from formula import placeholders
+from tool_registry import TOOLS
+from tracing import TRACER
+
+DATASET_INPUT = "dataset"                 # "input": "dataset" → 原始表
+RESERVED_NAMES = {DATASET_INPUT, "last_scalar"}
+DEFAULT_DAG_WORKERS = 4
+
+_NAME_RE = re.compile(r"[A-Za-z_]\w*$")   # 要能写进公式占位符 {name}
+
+
+class PlanError(ValueError):
+    """命名相关的计划错误：引用未定义的名字、重名、把标量当表用等"""
+
+
+def uses_names(actions, plan=None):
+    """计划是否用到了 as / input / return（否则就是普通线性计划）"""
+    if isinstance(plan, dict) and "return" in plan:
+        return True
+    return any(isinstance(a, dict) and ("as" in a or "input" in a) for a in actions)
+
+
+def check_name(name):
+    if not isinstance(name, str) or not _NAME_RE.match(name):
+        raise PlanError(f"result name must be an identifier, got {name!r}")
+    if name in RESERVED_NAMES:
+        raise PlanError(f"{name!r} is reserved and cannot be used as a result name")
+    return name
+
+
+class DagNode:
+    """
+    一个去重后的步骤
+      source → 输入表的节点（None = 原始表）
+      deps   → 占位符名 → 产生该标量的节点（None = 计划里还没有，执行时跳过本步并告警）
+    """
+
+    def __init__(self, id, fname, args, source, deps):
+        self.id, self.fname, self.args = id, fname, args
+        self.source, self.deps = source, deps
+        self.kind = TOOLS[fname].kind if fname in TOOLS else "df"     # 未知函数：执行时报错并原样传递
+        self.names = []
+        self.actions = []                  # 合并进来的 action 下标
+        self.consumers = 0
+
+    def upstream(self):
+        ups = [self.source] + list(self.deps.values())
+        return list({n.id: n for n in ups if n is not None}.values())
+
+    def describe(self):
+        args = json.dumps(self.args, ensure_ascii=False, default=str)
+        src = f"#{self.source.id}" if self.source is not None else DATASET_INPUT
+        text = f"#{self.id} {self.fname} {args} <- {src}"
+        if self.deps:
+            text += " with " + ", ".join(f"{{{p}}}=" + (f"#{d.id}" if d else "?") for p, d in self.deps.items())
+        if self.names:
+            text += f"  as {', '.join(self.names)}"
+        if len(self.actions) > 1:
+            text += f"  (shared by actions {self.actions})"
+        return text
+
+
+class PlanDag:
+    def __init__(self, nodes, named, last, returns):
+        self.nodes, self.named, self.last, self.returns = nodes, named, last, returns
+        self.n_actions = sum(len(n.actions) for n in nodes)
+
+    def output_nodes(self):
+        if self.returns is None:
+            return [self.last] if self.last is not None else []
+        names = [self.returns] if isinstance(self.returns, str) else self.returns
+        return [self.named[n] for n in names]
+
+    def result(self, values):
+        """节点输出 → 计划结果：没有 return 时与线性计划一样返回最后一步的输出"""
+        if self.returns is None:
+            return values.get(self.last.id) if self.last is not None else None
+        if isinstance(self.returns, str):
+            return values[self.named[self.returns].id]
+        return {n: values[self.named[n].id] for n in self.returns}
+
+    def explain(self):
+        shared = self.n_actions - len(self.nodes)
+        lines = [f"[PLAN] DAG: {self.n_actions} actions -> {len(self.nodes)} nodes"
+                 + (f" ({shared} shared)" if shared else "")]
+        lines += [f"  {n.describe()}" for n in self.nodes]
+        return "\n".join(lines)
+
+
+def build_dag(actions, returns=None):
+    """actions（+ 顶层 return）→ PlanDag；名字引用错误抛 PlanError"""
+    nodes, by_key, named = [], {}, {}
+    pipeline = last_scalar = last = None
+
+    def lookup(name, what):
+        if name not in named:
+            raise PlanError(f"{what} refers to undefined result {name!r}; defined so far: {list(named)}")
+        return named[name]
+
+    for i, action in enumerate(actions):
+        fname = action.get("function")
+        args = action.get("args") or {}
+        src = action.get("input")
+        if src is None:
+            source = pipeline
+        elif src == DATASET_INPUT:
+            source = None
+        else:
+            source = lookup(src, f"action {i} input")
+
+        deps = {}
+        if fname == "add_derived_column":
+            for p in placeholders(args.get("formula", "")):
+                deps[p] = last_scalar if p == "last_scalar" else lookup(p, f"action {i} formula")
+
+        key = (fname, json.dumps(args, sort_keys=True, default=str),
+               source.id if source is not None else None,
+               tuple((p, d.id if d is not None else None) for p, d in deps.items()))
+        node = by_key.get(key)
+        if node is None:
+            node = by_key[key] = DagNode(len(nodes), fname, args, source, deps)
+            nodes.append(node)
+            for up in node.upstream():
+                up.consumers += 1
+        node.actions.append(i)
+
+        if action.get("as") is not None:
+            name = check_name(action["as"])
+            if name in named:
+                raise PlanError(f"action {i}: result name {name!r} is already defined")
+            named[name] = node
+            node.names.append(name)
+        if node.kind == "scalar":
+            last_scalar = node
+        else:
+            pipeline = node
+        last = node
+
+    for name in ([returns] if isinstance(returns, str) else returns or []):
+        lookup(name, "return")
+    return PlanDag(nodes, named, last, returns)
+
+
+def _frame_bytes(value):
+    if isinstance(value, pd.DataFrame) and not DATASET.is_base(value):
+        return int(value.memory_usage(index=False).sum())
+    return 0
+
+
+def run_dag(node, dag, workers=DEFAULT_DAG_WORKERS):
+    """
+    执行 PlanDag，返回计划结果（见 PlanDag.result）。node 是 ExecutionNode，每一步走它的
+    _bind_placeholders / _apply（与线性执行同一套日志、span、分片）。
+    """
+    results = {}                                   # 节点 id → 输出；最后一个消费者完成后删除
+    remaining = {n.id: n.consumers for n in dag.nodes}
+    waiting = {n.id: len(n.upstream()) for n in dag.nodes}
+    pinned = {n.id for n in dag.output_nodes()}
+    downstream = {n.id: [] for n in dag.nodes}
+    for n in dag.nodes:
+        for up in n.upstream():
+            downstream[up.id].append(n)
+    peak = {"live": 0, "bytes": 0}
+    print(dag.explain())
+
+    def step(n, data, params):
+        if n.source is not None and n.source.kind == "scalar" and not isinstance(data, pd.DataFrame):
+            raise PlanError(f"input of #{n.id} {n.fname} is a scalar ({', '.join(n.source.names)}), not a table")
+        args = node._bind_placeholders(n.fname, n.args, params.get)
+        if args is None:
+            return data
+        return node._apply(n.fname, args, data)
+
+    def submit(pool, n):
+        data = results[n.source.id] if n.source is not None else None
+        params = {p: (results[d.id] if d is not None else None) for p, d in n.deps.items()}
+        return pool.submit(contextvars.copy_context().run, step, n, data, params)
+
+    def release(n):
+        if n.id not in pinned:
+            results.pop(n.id, None)
+
+    with TRACER.span("dag", actions=dag.n_actions, nodes=len(dag.nodes)) as span:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            running = {submit(pool, n): n for n in dag.nodes if waiting[n.id] == 0}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    n = running.pop(fut)
+                    try:
+                        results[n.id] = fut.result()
+                    except Exception:
+                        for f in running:
+                            f.cancel()
+                        raise
+                    peak["live"] = max(peak["live"], len(results))
+                    peak["bytes"] = max(peak["bytes"], sum(_frame_bytes(v) for v in results.values()))
+                    for up in n.upstream():                # 最后一个消费者完成 → 释放
+                        remaining[up.id] -= 1
+                        if remaining[up.id] == 0:
+                            release(up)
+                    if remaining[n.id] == 0:               # 没有消费者（如中途的标量）
+                        release(n)
+                    for nxt in downstream[n.id]:
+                        waiting[nxt.id] -= 1
+                        if waiting[nxt.id] == 0:
+                            running[submit(pool, nxt)] = nxt
+        span.set(peak_live_results=peak["live"], peak_intermediate_bytes=peak["bytes"])
+
+    print(f"[LOG] DAG finished: peak {peak['live']} live results, "
+          f"~{peak['bytes'] / 2**20:.1f} MB of intermediate tables")
+    return dag.result(results)
@@ -0,0 +1,262 @@
+# plan_optimizer.py
+# 说明：ExecutionNode 的 lazy 模式。先把 LLM 的 actions 建成逻辑计划，做几条安全的改写，
+#       再按物理计划执行。改写规则：
+#         ① 相邻的行过滤（select_rows / filter_date_range）融合成一个 mask，只物化一次
+#         ② 过滤下推到 add_derived_column / 分组 rolling_average 之前（仅在语义不变时）
+#         ③ 后续只被“与顺序无关”的标量消费的 sort_rows 直接删除
+#         ④ sort_rows + top_n（同一列）合并成一次部分选择
+#         ⑤ 连续的 calculate_* 标量里同一列出现多次 → 合并成一次 calculate_stats（一次转换、一次扫描）
+
+import numpy as np
+
+from predicate import parse_condition, referenced_columns
+from tool_functions import _df, column_stats, top_n
+
+ROW_FILTERS = {"select_rows", "filter_date_range"}
+
+# 结果与行顺序无关的标量函数
+ORDER_INSENSITIVE_SCALARS = {
+    "calculate_average", "calculate_median", "calculate_mode", "calculate_sum",
+    "calculate_min", "calculate_max", "calculate_std", "calculate_variance",
+    "calculate_percentile", "calculate_correlation", "calculate_covariance",
+    "calculate_delay_avg", "calculate_failure_rate", "count_rows",
+    "calculate_delay_avg_grouped", "calculate_stats",
+}
+
+# 可并入 calculate_stats 的单统计量标量 → 统计量名
+STAT_FUNCS = {
+    "calculate_average": "mean", "calculate_sum": "sum", "calculate_min": "min",
+    "calculate_max": "max", "calculate_std": "std", "calculate_variance": "var",
+    "calculate_median": "median", "calculate_percentile": None,     # None → 由 percentile 参数决定
+}
+
+
+class PlanStep:
+    """
+    物理计划中的一步
+      op = "filter"  → steps = [(fname, args), ...]，共用一个输入算 mask 后 AND
+      op = "top_n"   → 部分选择（nlargest / nsmallest），不做全排序
+      op = "stats"   → steps = [(fname, args, stat), ...]，按列一次算出全部统计量，再依次回填
+      op = "call"    → 直接调用工具函数 fname(args)
+    """
+    def __init__(self, op, fname=None, args=None, steps=None, note=None):
+        self.op, self.fname, self.args = op, fname, args or {}
+        self.steps = steps or []
+        self.notes = [note] if note else []
+
+    def describe(self):
+        if self.op == "filter":
+            inner = " AND ".join(_describe_call(f, a) for f, a in self.steps)
+            text = f"Filter[{inner}]"
+        elif self.op == "top_n":
+            a = self.args
+            text = f"TopN[{a.get('column')} {a.get('order', 'desc')} n={a.get('n', 5)}] (partial selection)"
+        elif self.op == "stats":
+            cols = ", ".join(f"{c}: {'/'.join(st)}" for c, st in self.args["columns"].items())
+            text = f"Stats[{cols}] (one scan per column)"
+        else:
+            text = _describe_call(self.fname, self.args)
+        return text + (f"    -- {'; '.join(self.notes)}" if self.notes else "")
+
+
+def _describe_call(fname, args):
+    body = ", ".join(f"{k}={v!r}" for k, v in args.items())
+    return f"{fname}({body})"
+
+
+class Plan:
+    def __init__(self, steps):
+        self.steps = steps
+        self.rewrites = []
+
+    def explain(self):
+        lines = ["[PLAN] Physical plan:"]
+        lines += [f"  {i:>2}. {s.describe()}" for i, s in enumerate(self.steps)]
+        if self.rewrites:
+            lines.append("[PLAN] Rewrites: " + "; ".join(self.rewrites))
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.explain()
+
+
+# ---------- 建立逻辑计划 ----------
+def build_plan(actions):
+    steps = []
+    for action in actions:
+        fname = action.get("function")
+        args = action.get("args", {}) or {}
+        if fname in ROW_FILTERS:
+            steps.append(PlanStep("filter", steps=[(fname, args)]))
+        else:
+            steps.append(PlanStep("call", fname, args))
+    return Plan(steps)
+
+
+def _filter_columns(step):
+    cols = set()
+    for fname, args in step.steps:
+        if fname == "select_rows":
+            cols |= referenced_columns(parse_condition(args["condition"].strip()), args.get("column"))
+        else:
+            cols.add(args.get("column"))
+    return cols
+
+
+def _can_push_below(filt, step):
+    """filt 能否挪到 step 之前执行"""
+    if step.op != "call":
+        return False
+    cols = _filter_columns(filt)
+    if step.fname == "add_derived_column":
+        # 逐行运算：只要过滤不依赖新列即可
+        return step.args.get("name") not in cols
+    if step.fname == "rolling_average" and step.args.get("group_by"):
+        # 分组滚动：按分组键整组保留/丢弃时，组内窗口不受影响
+        g = step.args["group_by"]
+        return cols <= ({g} if isinstance(g, str) else set(g))
+    return False
+
+
+# ---------- 改写规则 ----------
+def _push_down_filters(plan):
+    steps = plan.steps
+    changed = True
+    while changed:
+        changed = False
+        for i in range(1, len(steps)):
+            if steps[i].op == "filter" and _can_push_below(steps[i], steps[i - 1]):
+                plan.rewrites.append(f"pushed filter below {steps[i - 1].fname}")
+                steps[i - 1], steps[i] = steps[i], steps[i - 1]
+                changed = True
+
+
+def _fuse_filters(plan):
+    fused = []
+    for step in plan.steps:
+        if step.op == "filter" and fused and fused[-1].op == "filter":
+            fused[-1].steps.extend(step.steps)
+            continue
+        fused.append(step)
+    for step in fused:
+        if step.op == "filter" and len(step.steps) > 1:
+            step.notes.append(f"fused {len(step.steps)} filters into one mask")
+            plan.rewrites.append(f"fused {len(step.steps)} filters")
+    plan.steps = fused
+
+
+def _eliminate_sorts(plan):
+    out = []
+    steps = plan.steps
+    i = 0
+    while i < len(steps):
+        step = steps[i]
+        if step.op == "call" and step.fname == "sort_rows":
+            verdict, j = _sort_fate(steps, i)
+            if verdict == "dead":
+                plan.rewrites.append(f"dropped sort_rows({step.args.get('column')}): order never observed")
+                i += 1
+                continue
+            if verdict == "top_n":
+                tn = steps[j]
+                args = dict(tn.args)
+                if not args.get("column"):
+                    args["column"] = step.args["column"]
+                    args["order"] = step.args.get("order", "asc")
+                steps[j] = PlanStep("top_n", "top_n", args, note="sort_rows fused")
+                plan.rewrites.append(f"fused sort_rows({step.args['column']}) + top_n")
+                i += 1
+                continue
+        elif step.op == "call" and step.fname == "top_n":
+            step = PlanStep("top_n", "top_n", step.args)
+        out.append(step)
+        i += 1
+    plan.steps = out
+
+
+def _sort_fate(steps, i):
+    """向后扫描，判断 steps[i] 这个排序是否真的被观察到"""
+    col = steps[i].args.get("column")
+    for j in range(i + 1, len(steps)):
+        s = steps[j]
+        if s.op == "filter":
+            continue                                    # 过滤保持相对顺序
+        if s.fname in ORDER_INSENSITIVE_SCALARS:
+            continue                                    # 标量不改 current_data
+        if s.fname == "add_derived_column":
+            continue
+        if s.fname == "top_n" and s.args.get("column") in (None, col):
+            return "top_n", j
+        if s.fname == "group_by_aggregate" and not s.args.get("keep_all"):
+            return "dead", j                            # 输出按分组键排列，与输入顺序无关
+        return "keep", j                                # 其余步骤可能依赖顺序
+    # 走到计划末尾：最后一步是标量时排序结果无人观察；否则排好序的 DF 就是最终输出
+    last = steps[-1]
+    return ("dead" if last.op == "call" and last.fname in ORDER_INSENSITIVE_SCALARS else "keep"), None
+
+
+def _stat_of(fname, args):
+    """单统计量标量 → 统计量名；分组 / 不可并入时返回 None"""
+    if fname not in STAT_FUNCS or not args.get("column") or args.get("group_by") or args.get("group_column"):
+        return None
+    if fname == "calculate_percentile":
+        return f"p{float(args.get('percentile', args.get('q', 90))):g}"
+    return STAT_FUNCS[fname]
+
+
+def _fuse_stats(plan):
+    out, run = [], []
+
+    def flush():
+        per_col = {}
+        for fname, args, stat in run:
+            per_col.setdefault(args["column"], []).append(stat)
+        if len(run) > 1 and any(len(v) > 1 for v in per_col.values()):
+            cols = {c: list(dict.fromkeys(v)) for c, v in per_col.items()}
+            out.append(PlanStep("stats", "calculate_stats", {"columns": cols}, steps=list(run),
+                                note=f"fused {len(run)} scalar calls"))
+            plan.rewrites.append(f"fused {len(run)} scalars into calculate_stats")
+        else:
+            out.extend(PlanStep("call", f, a) for f, a, _ in run)
+        run.clear()
+
+    for step in plan.steps:
+        stat = _stat_of(step.fname, step.args) if step.op == "call" else None
+        if stat is not None:
+            run.append((step.fname, step.args, stat))      # 标量不改 current_data，可以连续收集
+            continue
+        flush()
+        out.append(step)
+    flush()
+    plan.steps = out
+
+
+def optimize(actions):
+    """actions → 优化后的物理计划"""
+    plan = build_plan(actions)
+    _push_down_filters(plan)
+    _fuse_filters(plan)
+    _eliminate_sorts(plan)
+    _fuse_stats(plan)
+    return plan
+
+
+# ---------- 物理算子 ----------
+def run_filter(cur, step, mask_funcs):
+    """所有过滤在同一个输入上求 mask，AND 后只切片一次"""
+    mask = np.ones(len(cur), dtype=bool)
+    for fname, args in step.steps:
+        mask &= mask_funcs[fname](cur, args)
+    return cur[mask]
+
+
+def run_top_n(cur, args):
+    """部分选择：tool_functions.top_n 已是 nlargest/nsmallest"""
+    return top_n(cur, args)
+
+
+def run_stats(cur, step):
+    """每列只转换 / 扫描一次，按原顺序返回 [(fname, value), ...]"""
+    df = _df(cur)
+    values = {c: column_stats(df[c], st) for c, st in step.args["columns"].items()}
+    return [(fname, values[args["column"]][stat]) for fname, args, stat in step.steps]
@@ -0,0 +1,487 @@
+# plan_validator.py
+# 说明：静态计划检查。不碰数据，只沿着 actions 推导每一步之后表里有哪些列（及其类型），
+#       在执行前找出 LLM 计划里的常见错误：
+#         • 未知函数 / 缺少必需参数 / args 不是对象
+#         • 引用不存在的列（如 rolling 输出列名写错、聚合之后再用原始列），给出相近列名
+#         • 数值统计用在文本 / 时间列上，时间窗口用在非时间列上
+#         • 不支持的聚合方式 / 统计量 / rolling func，公式语法错误
+#         • {last_scalar} 前面没有产生标量的步骤
+#         • 命名结果（as / input / return，见 plan_dag.py）：引用未定义的名字、重名、把标量当表用
+#
+#   validate_plan(text_or_obj) → 问题列表（空列表表示通过）
+
+import difflib
+import json
+import re
+
+import pandas as pd
+
+from formula import FormulaError, compile_formula
+from predicate import And, Not, Or, parse_condition
+from schema import SCHEMA
+from plan_dag import DATASET_INPUT, PlanError, check_name
+from tool_functions import _AGG_MAP, _ROLL_FUNCS, COLUMN_STATS, _metric_agg, _stat_name
+from dataset_cache import MEASURES, UNIT_SECONDS
+from tool_registry import TOOLS
+
+NUMERIC = {"key", "int", "float"}
+_PAIR_AGGS = {"cov", "corr"}
+
+
+class _State:
+    """
+    推导中的表结构：列名 → 类型；是否已有可供 {last_scalar} 使用的标量；
+    命名的表（名字 → 列，None 表示分组结果等推不出结构的表）和命名标量
+    """
+
+    def __init__(self, columns):
+        self.columns = dict(columns)
+        self.has_scalar = False
+        self.frames = {}
+        self.scalars = set()
+
+
+class _Checker:
+    def __init__(self, index, fname, args, state, errors):
+        self.prefix = f"action {index} ({fname})"
+        self.args, self.state, self.errors = args, state, errors
+
+    def error(self, msg):
+        self.errors.append(f"{self.prefix}: {msg}")
+
+    def require(self, *names):
+        missing = [n for n in names if self.args.get(n) in (None, "")]
+        for n in missing:
+            self.error(f"missing required arg {n!r}")
+        return not missing
+
+    def column(self, name, kinds=None, what="column"):
+        """列存在（且类型在 kinds 内）时返回 True"""
+        if name is None:
+            return False
+        if not isinstance(name, str):
+            self.error(f"{what} must be a column name, got {name!r}")
+            return False
+        kind = self.state.columns.get(name)
+        if kind is None:
+            close = difflib.get_close_matches(name, self.state.columns, n=1, cutoff=0.6)
+            hint = f" (did you mean {close[0]!r}?)" if close else ""
+            self.error(f"unknown {what} {name!r}{hint}; available: {list(self.state.columns)}")
+            return False
+        if kinds is not None and kind not in kinds:
+            self.error(f"{what} {name!r} is {kind}, expected {'/'.join(sorted(kinds))}")
+            return False
+        return True
+
+    def columns(self, names, what="group column"):
+        names = [names] if isinstance(names, str) else list(names or [])
+        return all([self.column(n, what=what) for n in names]) and bool(names)
+
+    def condition(self, cond, default, columns=None):
+        """条件串里显式写出的列必须存在；裸词值不看数据无法判定，交给执行期"""
+        if not isinstance(cond, str) or not cond.strip():
+            self.error("condition must be a non-empty string")
+            return
+        try:
+            node = parse_condition(cond.strip())
+        except ValueError as e:
+            self.error(str(e))
+            return
+        for col in _explicit_columns(node, default):
+            if columns is None:
+                self.column(col)
+            elif col not in columns:
+                self.error(f"unknown column {col!r} in condition; available: {list(columns)}")
+
+
+def _explicit_columns(node, default):
+    if isinstance(node, (And, Or)):
+        return _explicit_columns(node.left, default) | _explicit_columns(node.right, default)
+    if isinstance(node, Not):
+        return _explicit_columns(node.child, default)
+    return {node.column or default} - {None}
+
+
+# ---------- DataFrame → DataFrame ----------
+def _select_rows(c):
+    if c.require("condition"):
+        c.condition(c.args["condition"], c.args.get("column"))      # 省略列的条件落在 "column" 上
+
+
+def _sort_rows(c):
+    if c.require("column"):
+        c.column(c.args["column"])
+
+
+def _top_n(c):
+    if c.require("column"):
+        c.column(c.args["column"])
+    _check_int(c, "n")
+
+
+def _group_top_n(c):
+    if c.require("group_column", "sort_column"):
+        ok = c.column(c.args["group_column"], what="group column")
+        ok = c.column(c.args["sort_column"]) and ok
+        if ok and not c.args.get("keep_all", True):
+            keep = [k for k in ("Job_ID", "Machine_ID", c.args["group_column"], c.args["sort_column"])
+                    if k in c.state.columns]
+            c.state.columns = {k: c.state.columns[k] for k in keep}
+    _check_int(c, "n")
+
+
+def _filter_date_range(c):
+    if c.require("column"):
+        c.column(c.args["column"], {"datetime"})
+    if c.args.get("start") is None and c.args.get("end") is None:
+        c.error("needs start and/or end")
+    for k in ("start", "end"):
+        if c.args.get(k) is not None and pd.isna(pd.to_datetime(c.args[k], errors="coerce")):
+            c.error(f"{k} is not a datetime: {c.args[k]!r}")
+
+
+def _add_derived_column(c):
+    if not c.require("name", "formula"):
+        return
+    try:
+        program = compile_formula(str(c.args["formula"]))
+    except FormulaError as e:
+        c.error(str(e))
+        return
+    for col in program.columns:
+        c.column(col)
+    for p in program.params:
+        if p == "last_scalar":
+            if not c.state.has_scalar:
+                c.error("{last_scalar} used before any step produced a scalar")
+        elif p in c.state.frames:
+            c.error(f"placeholder {{{p}}} names a table, not a scalar")
+        elif p not in c.state.scalars:
+            known = sorted(c.state.scalars)
+            c.error(f"unknown placeholder {{{p}}}" + (f"; named scalars so far: {known}" if known else ""))
+    c.state.columns[c.args["name"]] = "float"
+
+
+def _rolling_average(c):
+    if not c.require("column"):
+        return
+    c.column(c.args["column"], NUMERIC)
+    if c.args.get("group_by"):
+        c.columns(c.args["group_by"])
+    func = str(c.args.get("func", "mean")).lower()
+    if func not in _ROLL_FUNCS:
+        c.error(f"unsupported func {func!r}; use one of {sorted(_ROLL_FUNCS)}")
+    window = c.args.get("window", 3)
+    if isinstance(window, str) and not window.strip().isdigit():
+        try:
+            pd.Timedelta(window)
+        except ValueError:
+            c.error(f"bad time window {window!r}")
+        if not c.args.get("order_by"):
+            c.error("a time-based window requires order_by")
+    elif not _is_int(window):
+        c.error(f"window must be an int or a time span, got {window!r}")
+    if c.args.get("order_by"):
+        c.column(c.args["order_by"], what="order_by column")
+    name = f"rolling_avg_{c.args['column']}" if _ROLL_FUNCS.get(func) == "mean" \
+        else f"rolling_{_ROLL_FUNCS.get(func, func)}_{c.args['column']}"
+    c.state.columns[name] = "float"
+
+
+def _group_by_aggregate(c):
+    keys = c.args.get("group_columns", c.args.get("group_column"))
+    if not keys:
+        c.error("missing required arg 'group_column'")
+        return
+    c.columns(keys)
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    metrics = c.args.get("metrics") or [{
+        "column": c.args.get("target_column"), "derived": c.args.get("derived"),
+        "agg": c.args.get("agg", "avg"), "other_column": c.args.get("other_column"),
+        "percentile": c.args.get("percentile", c.args.get("q"))}]
+    if not isinstance(metrics, list):
+        c.error("metrics must be a list")
+        return
+
+    out = {k: c.state.columns.get(k, "category") for k in keys}
+    for m in metrics:
+        if not isinstance(m, dict):
+            c.error(f"metric must be an object, got {m!r}")
+            continue
+        agg, q = _metric_agg(m)
+        if agg not in _AGG_MAP and agg not in _PAIR_AGGS and agg != "percentile":
+            c.error(f"unsupported agg {m.get('agg')!r}; use one of "
+                    f"{sorted(set(_AGG_MAP) | _PAIR_AGGS | {'percentile'})}")
+            continue
+        d = m.get("derived")
+        if d:
+            if not isinstance(d, dict) or d.get("type") != "timedelta":
+                c.error(f"unsupported derived metric {d!r} (only type 'timedelta')")
+                continue
+            for k in ("end_col", "start_col"):
+                if d.get(k):
+                    c.column(d[k], {"datetime"}, k)
+                else:
+                    c.error(f"derived metric needs {k}")
+            colname = d.get("name", "derived")
+        else:
+            colname = m.get("column")
+            if colname is None and agg != "count":
+                c.error(f"metric needs a column: {m}")
+                continue
+            if colname is not None:
+                c.column(colname, None if agg in ("count", "nunique") else NUMERIC)
+        if colname is None:                                    # count(*)
+            alias = m.get("alias") or "count"
+        elif agg == "percentile":
+            if not _is_number(q if q is not None else 90):
+                c.error(f"percentile must be a number, got {q!r}")
+                continue
+            alias = m.get("alias") or f"p{int(float(q if q is not None else 90))}_{colname}"
+        elif agg in _PAIR_AGGS:
+            if not m.get("other_column"):
+                c.error(f"agg {agg!r} needs other_column")
+                continue
+            c.column(m["other_column"], NUMERIC, "other_column")
+            alias = m.get("alias") or f"{agg}_{colname}_{m['other_column']}"
+        else:
+            alias = m.get("alias") or f"{agg}_{colname}"
+        out[alias] = "int" if agg in ("count", "nunique") else "float"
+
+    if c.args.get("having"):
+        having = c.args["having"]
+        if isinstance(having, dict):
+            c.condition(having.get("condition"), having.get("column"), out)
+        else:
+            c.condition(having, None, out)
+    c.state.columns = {**c.state.columns, **out} if c.args.get("keep_all") else out
+
+
+# ---------- DataFrame → 标量 ----------
+def _numeric_stat(c):
+    if c.require("column"):
+        c.column(c.args["column"], NUMERIC)
+    c.state.has_scalar = True
+
+
+def _min_max(c):
+    if c.require("column"):
+        c.column(c.args["column"], NUMERIC | {"datetime"})
+    c.state.has_scalar = True
+
+
+def _mode(c):
+    if c.require("column"):
+        c.column(c.args["column"])
+    c.state.has_scalar = True
+
+
+def _percentile(c):
+    if c.require("column"):
+        c.column(c.args["column"], NUMERIC)
+    q = c.args.get("percentile", c.args.get("q", 90))
+    if not _is_number(q) or not 0 <= float(q) <= 100:
+        c.error(f"percentile must be a number in [0, 100], got {q!r}")
+    g = c.args.get("group_by") or c.args.get("group_column")
+    if g:
+        c.columns(g)
+    else:
+        c.state.has_scalar = True
+
+
+def _pair(c):
+    x = c.args.get("x") or c.args.get("column1")
+    y = c.args.get("y") or c.args.get("column2")
+    if x is None or y is None:
+        c.error("needs column1 and column2")
+    else:
+        c.column(x, NUMERIC, "column1")
+        c.column(y, NUMERIC, "column2")
+    g = c.args.get("group_by") or c.args.get("group_column")
+    if g:
+        c.columns(g)
+    else:
+        c.state.has_scalar = True
+
+
+def _stats(c):
+    if c.require("column"):
+        c.column(c.args["column"], NUMERIC)
+    c.state.has_scalar = True                    # 返回 Series（不分组），不能再当表用
+    stats = c.args.get("stats") or []
+    if not isinstance(stats, list):
+        c.error("stats must be a list")
+        return
+    for st in stats:
+        name = _stat_name(st)
+        if name not in COLUMN_STATS and not re.fullmatch(r"p\d+(\.\d+)?", name):
+            c.error(f"unknown stat {st!r}; use {sorted(COLUMN_STATS)} or pNN")
+
+
+def _count_rows(c):
+    c.state.has_scalar = True
+
+
+def _delay(c, grouped):
+    unit = c.args.get("unit", "seconds")
+    if unit not in UNIT_SECONDS:
+        c.error(f"unit must be one of {list(UNIT_SECONDS)}, got {unit!r}")
+    for col in MEASURES["end_delay"] + (() if grouped else ("Job_Status",)):
+        c.column(col, what="required column")
+    if grouped:
+        if c.require("group_column"):
+            c.columns(c.args["group_column"])
+    else:
+        c.state.has_scalar = True
+
+
+def _failure_rate(c):
+    if c.require("group_column"):
+        c.columns(c.args["group_column"])
+    c.column("Job_Status", what="required column")
+
+
+_CHECKS = {
+    "select_rows": _select_rows,
+    "sort_rows": _sort_rows,
+    "top_n": _top_n,
+    "group_top_n": _group_top_n,
+    "filter_date_range": _filter_date_range,
+    "add_derived_column": _add_derived_column,
+    "rolling_average": _rolling_average,
+    "group_by_aggregate": _group_by_aggregate,
+    "calculate_average": _numeric_stat,
+    "calculate_median": _numeric_stat,
+    "calculate_sum": _numeric_stat,
+    "calculate_std": _numeric_stat,
+    "calculate_variance": _numeric_stat,
+    "calculate_min": _min_max,
+    "calculate_max": _min_max,
+    "calculate_mode": _mode,
+    "calculate_percentile": _percentile,
+    "calculate_correlation": _pair,
+    "calculate_covariance": _pair,
+    "calculate_stats": _stats,
+    "count_rows": _count_rows,
+    "calculate_delay_avg": lambda c: _delay(c, grouped=False),
+    "calculate_delay_avg_grouped": lambda c: _delay(c, grouped=True),
+    "calculate_failure_rate": _failure_rate,
+}
+
+
+def _is_number(v):
+    try:
+        float(v)
+        return not isinstance(v, bool)
+    except (TypeError, ValueError):
+        return False
+
+
+def _is_int(v):
+    try:
+        return int(v) == float(v)
+    except (TypeError, ValueError):
+        return False
+
+
+def _check_int(c, name):
+    if c.args.get(name) is not None and not _is_int(c.args[name]):
+        c.error(f"{name} must be an integer, got {c.args[name]!r}")
+
+
+# ---------- 入口 ----------
+def validate_actions(actions, columns=None):
+    """actions 列表 → 问题列表；columns 默认是作业表的 SCHEMA"""
+    errors = []
+    if not isinstance(actions, list):
+        return [f"'actions' must be a list, got {type(actions).__name__}"]
+    if not actions:
+        return ["'actions' is empty"]
+    schema = columns if columns is not None else SCHEMA
+    state = _State(schema)
+    for i, action in enumerate(actions):
+        if not isinstance(action, dict):
+            errors.append(f"action {i}: must be an object, got {action!r}")
+            continue
+        fname = action.get("function")
+        args = action.get("args", {})
+        if fname not in TOOLS:
+            close = difflib.get_close_matches(str(fname), TOOLS, n=1)
+            hint = f" (did you mean {close[0]!r}?)" if close else ""
+            errors.append(f"action {i}: unknown function {fname!r}{hint}")
+            continue
+        if args is None:
+            args = {}
+        if not isinstance(args, dict):
+            errors.append(f"action {i} ({fname}): args must be an object")
+            continue
+        _check_action(i, fname, args, action, state, schema, errors)
+    return errors
+
+
+def _check_action(i, fname, args, action, state, schema, errors):
+    """
+    按数据来源切换表结构后检查一步：input 指向命名表（或原始表）时按那张表检查；
+    标量步骤不改变流水线，DataFrame 步骤的输出成为新的流水线；as 记下输出的结构
+    """
+    pipeline, src = state.columns, action.get("input")
+    if src is not None:
+        if src == DATASET_INPUT:
+            state.columns = dict(schema)
+        elif src in state.frames:
+            state.columns = state.frames[src]
+        else:
+            what = "is a scalar, not a table" if src in state.scalars else "is not defined before this action"
+            errors.append(f"action {i} ({fname}): input {src!r} {what}")
+            return
+    kind = TOOLS[fname].kind
+    had_scalar, state.has_scalar = state.has_scalar, False
+    if state.columns is None:                  # 推不出结构的表：不做列检查，输出结构也未知
+        produced = kind == "scalar"
+    else:
+        state.columns = dict(state.columns)
+        check = _CHECKS.get(fname)
+        if check is not None:
+            check(_Checker(i, fname, args, state, errors))
+        produced = state.has_scalar
+    state.has_scalar = had_scalar or produced
+
+    name = action.get("as")
+    if name is not None:
+        try:
+            check_name(name)
+            if name in state.frames or name in state.scalars:
+                raise PlanError(f"result name {name!r} is already defined")
+        except PlanError as e:
+            errors.append(f"action {i} ({fname}): {e}")
+            name = None
+    if kind == "scalar":
+        if name is not None:
+            if produced:
+                state.scalars.add(name)
+            else:                              # 分组统计返回表，结构这里不推导
+                state.frames[name] = None
+        state.columns = pipeline
+    elif name is not None:
+        state.frames[name] = state.columns
+
+
+def validate_plan(plan, columns=None):
+    """LLM 原始输出（str）或已解析的 dict → 问题列表"""
+    if isinstance(plan, str):
+        try:
+            plan = json.loads(plan)
+        except json.JSONDecodeError as e:
+            return [f"not valid JSON: {e}"]
+    if not isinstance(plan, dict) or "actions" not in plan:
+        return ["no 'actions' in plan"]
+    errors = validate_actions(plan["actions"], columns)
+    returns = plan.get("return")
+    if returns is not None:
+        names = [returns] if isinstance(returns, str) else returns
+        if not isinstance(names, list) or not names:
+            return errors + ["'return' must be a result name or a non-empty list of names"]
+        actions = plan["actions"] if isinstance(plan["actions"], list) else []
+        defined = {a.get("as") for a in actions if isinstance(a, dict)}
+        errors += [f"return refers to undefined result {n!r}" for n in names if n not in defined]
+    return errors
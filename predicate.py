@@ -0,0 +1,329 @@
+# predicate.py
+# 说明：select_rows 的条件解析器。条件串 → 表达式树（缓存），再对原始 DataFrame 一次性算出布尔 mask。
+"""
+语法（关键字大小写不敏感）
+  expr    := term (OR term)*
+  term    := factor (AND factor)*
+  factor  := NOT factor | "(" expr ")" | pred
+  pred    := [column] op value
+           | [column] [NOT] IN "(" value {"," value} ")"
+           | [column] [NOT] BETWEEN value AND value
+           | [column] IS [NOT] NULL
+  op      := == | = | != | < | <= | > | >=
+
+省略 column 时使用 select_rows 的 "column" 参数，例如
+  ">= 50 AND <= 120"
+  "== 'Grinding' OR (Machine_ID IN ('M01','M02') AND NOT Job_Status == 'Failed')"
+  "BETWEEN 2023-03-18 08:00 AND 2023-03-18 12:00"
+  "> Scheduled_End"            # 列‑列比较：裸词恰好是列名时按列处理
+"""
+
+import operator
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from dataset_cache import KEY_FORMATS, parse_key
+
+# ---------- 表达式树节点 ----------
+Value   = namedtuple("Value", "text quoted")              # quoted=False 的裸词可能是列名
+Cmp     = namedtuple("Cmp", "column op value")
+In      = namedtuple("In", "column values negate")
+Between = namedtuple("Between", "column low high negate")
+IsNull  = namedtuple("IsNull", "column negate")
+And     = namedtuple("And", "left right")
+Or      = namedtuple("Or", "left right")
+Not     = namedtuple("Not", "child")
+
+_OPS = {"==": operator.eq, "=": operator.eq, "!=": operator.ne,
+        "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+_KEYWORDS = {"AND", "OR", "NOT", "IN", "BETWEEN", "IS", "NULL"}
+_CONNECTIVES = {"AND", "OR"}                               # 裸值后面只可能接这两个关键字
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+      (?P<str>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    | (?P<op>==|!=|<=|>=|<|>|=)
+    | (?P<punct>[(),])
+    | (?P<word>[^\s(),'"=!<>]+)
+    )""", re.X)
+
+
+# ---------- 词法 ----------
+def _tokenize(cond):
+    """关键字也按 word 输出，由语法分析按位置判定（"== In Progress" 里的 In 是值，不是 IN）"""
+    toks, pos, cond = [], 0, cond.strip()
+    while pos < len(cond):
+        m = _TOKEN_RE.match(cond, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f"Bad condition syntax near: {cond[pos:]!r}")
+        pos = m.end()
+        kind = m.lastgroup
+        text = m.group(kind)
+        if kind == "str":
+            toks.append(("str", text[1:-1].replace("\\" + text[0], text[0])))
+        else:
+            toks.append((kind, text))
+    return toks
+
+
+# ---------- 语法 ----------
+class _Parser:
+    def __init__(self, toks):
+        self.toks, self.i = toks, 0
+
+    def peek(self, k=0):
+        j = self.i + k
+        return self.toks[j] if j < len(self.toks) else (None, None)
+
+    def kw(self, k=0):
+        """第 k 个 token 若是关键字词，返回其大写形式；否则 None"""
+        kind, text = self.peek(k)
+        return text.upper() if kind == "word" and text.upper() in _KEYWORDS else None
+
+    def take_kw(self, name):
+        if self.kw() != name:
+            raise ValueError(f"Bad condition syntax: expected {name}, got {self.peek()[1]!r}")
+        self.i += 1
+
+    def take(self, kind=None, text=None):
+        tok = self.peek()
+        if (kind and tok[0] != kind) or (text and tok[1] != text):
+            raise ValueError(f"Bad condition syntax: expected {text or kind}, got {tok[1]!r}")
+        self.i += 1
+        return tok
+
+    def parse(self):
+        node = self.expr()
+        if self.peek()[0] is not None:
+            raise ValueError(f"Bad condition syntax: unexpected {self.peek()[1]!r}")
+        return node
+
+    def expr(self):
+        node = self.term()
+        while self.kw() == "OR":
+            self.take()
+            node = Or(node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.kw() == "AND":
+            self.take()
+            node = And(node, self.factor())
+        return node
+
+    def factor(self):
+        tok = self.peek()
+        if self.kw() == "NOT":
+            self.take()
+            return Not(self.factor())
+        if tok == ("punct", "("):
+            self.take()
+            node = self.expr()
+            self.take("punct", ")")
+            return node
+        return self.pred()
+
+    def _starts_pred(self, k):
+        return self.peek(k)[0] == "op" or self.kw(k) in {"IN", "BETWEEN", "IS", "NOT"}
+
+    def pred(self):
+        column = None
+        kind = self.peek()[0]
+        if (kind == "str" or (kind == "word" and self.kw() is None)) and self._starts_pred(1):
+            column = self.take()[1]
+
+        kind, text = self.peek()
+        if kind == "op":
+            self.take()
+            return Cmp(column, "==" if text == "=" else text, self.value())
+        negate = False
+        if self.kw() == "IS":
+            self.take()
+            if self.kw() == "NOT":
+                self.take(); negate = True
+            self.take_kw("NULL")
+            return IsNull(column, negate)
+        if self.kw() == "NOT":
+            self.take(); negate = True
+        kind, text = self.peek()
+        if self.kw() == "IN":
+            self.take()
+            self.take("punct", "(")
+            values = [self.value()]
+            while self.peek() == ("punct", ","):
+                self.take()
+                values.append(self.value())
+            self.take("punct", ")")
+            return In(column, tuple(values), negate)
+        if self.kw() == "BETWEEN":
+            self.take()
+            low = self.value()
+            self.take_kw("AND")
+            return Between(column, low, self.value(), negate)
+        raise ValueError(f"Bad condition syntax near {text!r}")
+
+    def value(self):
+        kind, text = self.peek()
+        if kind == "str":
+            self.take()
+            return Value(text, True)
+        # 裸值可以包含空格（Low Efficiency、2023-03-18 10:00、In Progress），读到 AND/OR/括号/逗号为止；
+        # 值的第一个词即使是关键字也按值处理（"== Not Started"）
+        words = []
+        while self.peek()[0] == "word" and not (words and self.kw() in _CONNECTIVES):
+            words.append(self.take()[1])
+        if not words:
+            raise ValueError(f"Bad condition syntax: missing value near {text!r}")
+        return Value(" ".join(words), False)
+
+
+@lru_cache(maxsize=1024)
+def parse_condition(cond):
+    """条件串 → 表达式树；同一条件只解析一次"""
+    return _Parser(_tokenize(cond)).parse()
+
+
+def referenced_columns(node, default=None):
+    """表达式树里引用到的列（裸词值无法在不看数据时判定，按列名候选一并返回）"""
+    if isinstance(node, (And, Or)):
+        return referenced_columns(node.left, default) | referenced_columns(node.right, default)
+    if isinstance(node, Not):
+        return referenced_columns(node.child, default)
+    cols = {node.column or default} - {None}
+    if isinstance(node, Cmp) and not node.value.quoted:
+        cols.add(node.value.text)
+    return cols
+
+
+def _to_timestamp(text):
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", text):   # 如果缺少时分，补 00:00
+        text += " 00:00"
+    return pd.to_datetime(text, errors="coerce")
+
+
+def time_range(node, default=None, columns=None):
+    """
+    若表达式只是同一列上的区间条件（比较 / BETWEEN / 二者 AND），返回
+      (column, start, end, left_closed, right_closed)
+    供有序时间索引二分查找；否则返回 None
+    columns 给出时，列不在其中直接返回 None（不对 'Grinding' 这类值做时间解析）
+    """
+    if isinstance(node, And):
+        a = time_range(node.left, default, columns)
+        b = time_range(node.right, default, columns) if a else None
+        if not a or not b or a[0] != b[0]:
+            return None
+        col, start, left = a[0], a[1], a[3]
+        if b[1] is not None and (start is None or b[1] > start or (b[1] == start and not b[3])):
+            start, left = b[1], b[3]
+        end, right = a[2], a[4]
+        if b[2] is not None and (end is None or b[2] < end or (b[2] == end and not b[4])):
+            end, right = b[2], b[4]
+        return col, start, end, left, right
+    if isinstance(node, (Between, Cmp)) and columns is not None and (node.column or default) not in columns:
+        return None
+    if isinstance(node, Between) and not node.negate:
+        lo, hi = _to_timestamp(node.low.text), _to_timestamp(node.high.text)
+        return (None if pd.isna(lo) or pd.isna(hi) else
+                (node.column or default, lo, hi, True, True))
+    if isinstance(node, Cmp) and node.op in {"==", "<", "<=", ">", ">="}:
+        ts = _to_timestamp(node.value.text)
+        if pd.isna(ts):
+            return None
+        col = node.column or default
+        return {"==": (col, ts, ts, True, True),
+                "<":  (col, None, ts, True, False), "<=": (col, None, ts, True, True),
+                ">":  (col, ts, None, False, True), ">=": (col, ts, None, True, True)}[node.op]
+    return None
+
+
+# ---------- 求值 ----------
+def _coerce(ser, val):
+    """按目标列类型转换字面量"""
+    text = val.text
+    if ser.name in KEY_FORMATS and pd.api.types.is_integer_dtype(ser):
+        try:
+            return parse_key(ser.name, text)       # 'J001' → 1，与整数 key 列比较
+        except ValueError:
+            raise ValueError(f"Bad key value for {ser.name!r}: {text!r}")
+    if pd.api.types.is_datetime64_any_dtype(ser):
+        return _to_timestamp(text)
+    if pd.api.types.is_bool_dtype(ser) and text in {"True", "False", "true", "false"}:
+        return text.lower() == "true"
+    if pd.api.types.is_numeric_dtype(ser):
+        try:
+            return float(text)
+        except ValueError:
+            raise ValueError(f"Cannot compare numeric column {ser.name!r} with {text!r}")
+    return text
+
+
+def _compare(ser, op, val):
+    if isinstance(ser.dtype, pd.CategoricalDtype):
+        # 先在类别上比较（k 个值），再按整数 code 取回，整列只扫一遍
+        codes = ser.cat.codes.to_numpy()
+        hit = np.asarray(_OPS[op](ser.cat.categories.to_series(), val), dtype=bool)
+        # 缺失值与 object 列一致：!= 为 True，其它比较为 False
+        return np.where(codes >= 0, hit[codes], op == "!=")
+    return np.asarray(_OPS[op](ser, val), dtype=bool)
+
+
+def _decoded(ser):
+    return ser.astype(object) if isinstance(ser.dtype, pd.CategoricalDtype) else ser
+
+
+def _compare_columns(ser, op, other):
+    # 两列类别集合不同（或无序类别做大小比较）时 pandas 直接报 TypeError → 按解码后的值比较
+    if ser.dtype != other.dtype or (op not in ("==", "!=") and isinstance(ser.dtype, pd.CategoricalDtype)):
+        ser, other = _decoded(ser), _decoded(other)
+    return np.asarray(_OPS[op](ser, other), dtype=bool)
+
+
+def _operand(df, val):
+    """裸词恰好是列名 → 列‑列比较，否则按字面量"""
+    if not val.quoted and val.text in df.columns:
+        return df[val.text]
+    return None
+
+
+def _eval(node, df, default):
+    if isinstance(node, And):
+        return _eval(node.left, df, default) & _eval(node.right, df, default)
+    if isinstance(node, Or):
+        return _eval(node.left, df, default) | _eval(node.right, df, default)
+    if isinstance(node, Not):
+        return ~_eval(node.child, df, default)
+
+    col = node.column or default
+    if col is None:
+        raise ValueError("Condition has no column")
+    if col not in df.columns:
+        raise KeyError(col)
+    ser = df[col]
+
+    if isinstance(node, IsNull):
+        mask = ser.isna().to_numpy()
+        return ~mask if node.negate else mask
+    if isinstance(node, Cmp):
+        other = _operand(df, node.value)
+        if other is not None:
+            return _compare_columns(ser, node.op, other)
+        return _compare(ser, node.op, _coerce(ser, node.value))
+    if isinstance(node, In):
+        mask = ser.isin([_coerce(ser, v) for v in node.values]).to_numpy()
+        return ~mask if node.negate else mask
+    if isinstance(node, Between):
+        mask = (_compare(ser, ">=", _coerce(ser, node.low)) &
+                _compare(ser, "<=", _coerce(ser, node.high)))
+        return ~mask if node.negate else mask
+    raise ValueError(f"Unknown predicate node: {node!r}")
+
+
+def condition_mask(df, column, condition):
+    """对 df 一次性求出布尔 mask（numpy 数组，与 df 行对齐）"""
+    return _eval(parse_condition(condition.strip()), df, column)
@@ -0,0 +1,116 @@
+# prompt_builder.py
+# 说明：PromptingNode 的提示词构造。结构固定为
+#
+#     静态前缀（角色 / 输出格式 / 规则 / 列 / 示例）  ← 每个请求逐字节相同，服务端前缀缓存可以复用
+#     本请求相关的工具说明                          ← 由 tool_registry 生成，只挑相关的几个
+#     用户请求
+#
+#   工具挑选不用 embedding：请求里的词对 tool_registry 的触发词和列名词表做匹配，
+#   一个都没匹配上时退回全量工具（宁多勿漏）。PROMPT_SLIM=0 时总是给全量工具。
+#   token 数用 estimate_tokens 估算（不依赖分词器），用于日志 / 追踪里比较节省了多少。
+
+import re
+
+from schema import SCHEMA
+from tool_registry import CORE_TOOLS, STAT_TOOLS, TOOLS
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+_DATE_RE = re.compile(r"\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}/\d{2,4}|\b\d{1,2}:\d{2}\b")
+_TOKEN_RE = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+_NOISE_RE = re.compile(r"\bat (?:least|most)\b")         # 「至少 / 至多」不是求最值
+
+_KIND_LABELS = {"key": "id", "category": "text", "int": "int", "float": "float", "datetime": "datetime"}
+
+STATIC_PREFIX = f"""You translate a request about a manufacturing job table into a raw JSON plan of data-processing steps.
+Output ONLY the JSON, no markdown and no explanation, in this shape:
+{{"actions": [{{"function": "<tool name>", "args": {{...}}}}, ...]}}
+
+Rules:
+- If the request restricts rows (e.g. "for Grinding jobs"), start with a select_rows action for that filter.
+- Actions run in order on one table; a scalar tool returns a value and leaves the table unchanged.
+- Use only the tools listed for this request and the columns below (plus columns created by earlier actions).
+- Use {{last_scalar}} only if an earlier action computed a scalar.
+- To work on several subsets, add "as": "<name>" to an action to name its result, start a later action from it
+  with "input": "<name>" ("dataset" = the full table), use a named scalar as {{<name>}} in formulas, and list
+  the named results to answer with in a top-level "return": [...].
+
+Columns:
+{" · ".join(f"{c} ({_KIND_LABELS.get(k, k)})" for c, k in SCHEMA.items())}
+
+Example request: "Low Efficiency jobs with Processing_Time <= 50, sorted by Machine_Availability descending"
+{{"actions": [{{"function": "select_rows", "args": {{"column": "Optimization_Category", "condition": "== 'Low Efficiency'"}}}}, {{"function": "select_rows", "args": {{"column": "Processing_Time", "condition": "<= 50"}}}}, {{"function": "sort_rows", "args": {{"column": "Machine_Availability", "order": "desc"}}}}]}}
+
+Example request: "Average Energy_Consumption of Grinding vs Milling jobs"
+{{"actions": [{{"function": "select_rows", "args": {{"column": "Operation_Type", "condition": "== 'Grinding'"}}}}, {{"function": "calculate_average", "args": {{"column": "Energy_Consumption"}}, "as": "grinding"}}, {{"function": "select_rows", "args": {{"column": "Operation_Type", "condition": "== 'Milling'"}}, "input": "dataset"}}, {{"function": "calculate_average", "args": {{"column": "Energy_Consumption"}}, "as": "milling"}}], "return": ["grinding", "milling"]}}
+"""
+
+
+def estimate_tokens(text):
+    """粗略的 BPE token 数：英文词约 6 字母一个 token，数字每 3 位一个，标点各一个"""
+    n = 0
+    for piece in _TOKEN_RE.findall(text):
+        n += 1 + (len(piece) - 1) // 6 if piece[0].isalpha() else 1
+    return n
+
+
+def _words(text):
+    return set(_WORD_RE.findall(_NOISE_RE.sub(" ", text.lower())))
+
+
+def _matches(keyword, words):
+    for part in keyword.split("+"):
+        if part.endswith("*"):
+            if not any(w.startswith(part[:-1]) for w in words):
+                return False
+        elif part not in words:
+            return False
+    return True
+
+
+def _mentions_time(text, words):
+    """提到某个时间列（Scheduled_Start / "actual end" …）或日期、时刻字面量"""
+    if _DATE_RE.search(text):
+        return True
+    return any(set(_WORD_RE.findall(col.lower())) <= words
+               for col, kind in SCHEMA.items() if kind == "datetime")
+
+
+def select_tools(request):
+    """与请求相关的工具名（登记顺序）；没有任何线索时返回全部"""
+    words = _words(request)
+    chosen = set(CORE_TOOLS)
+    for tool in TOOLS.values():
+        if any(_matches(k, words) for k in tool.keywords):
+            chosen.add(tool.name)
+    if _mentions_time(request, words):
+        chosen.update(t.name for t in TOOLS.values() if "time" in t.tags)
+    if len(chosen & STAT_TOOLS) >= 2:
+        chosen.add("calculate_stats")
+    if chosen == set(CORE_TOOLS):
+        return list(TOOLS)
+    return [name for name in TOOLS if name in chosen]
+
+
+def render_tool(tool):
+    return "\n".join([f"{tool.name} {tool.args}"] + [f"  - {line}" for line in tool.doc])
+
+
+class PromptBuilder:
+    """
+    build(request) → (prompt, 工具名列表)
+    slim=False 时总是给全量工具（与挑选前的行为一致，便于对照）
+    """
+
+    def __init__(self, slim=True):
+        self.slim = slim
+        self._rendered = {name: render_tool(t) for name, t in TOOLS.items()}
+        self.full_tokens = estimate_tokens(self._assemble(list(TOOLS), ""))
+
+    def _assemble(self, names, request):
+        tools = "\n".join(self._rendered[n] for n in names)
+        return f'{STATIC_PREFIX}\nTools for this request:\n{tools}\n\nRequest: """{request}"""\nJSON:'
+
+    def build(self, request, slim=None):
+        slim = self.slim if slim is None else slim
+        names = select_tools(request) if slim else list(TOOLS)
+        return self._assemble(names, request), names
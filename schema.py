@@ -0,0 +1,26 @@
+# schema.py
+# 说明：作业表的列与类型。只有常量、不依赖 pandas，
+#       数据加载（dataset_cache）、提示词构造（prompt_builder）共用。
+
+# ---------- 列类型（schema 驱动的加载） ----------
+#   key       → "J001" 这类编号去掉前缀后存成整数；显示时由 format_keys 还原
+#   category  → 低基数字符串，字典编码（整数 code + 类别表）
+#   int/float → 数值，向下转换到安全的最小宽度（见 dataset_cache._downcast）
+#   datetime  → TIME_COLS
+SCHEMA = {
+    "Job_ID": "key",
+    "Machine_ID": "category",
+    "Operation_Type": "category",
+    "Material_Used": "float",
+    "Processing_Time": "int",
+    "Energy_Consumption": "float",
+    "Machine_Availability": "int",
+    "Scheduled_Start": "datetime",
+    "Scheduled_End": "datetime",
+    "Actual_Start": "datetime",
+    "Actual_End": "datetime",
+    "Job_Status": "category",
+    "Optimization_Category": "category",
+}
+
+TIME_COLS = [c for c, kind in SCHEMA.items() if kind == "datetime"]
@@ -0,0 +1,171 @@
+# server.py
+# 说明：常驻查询服务。进程启动时建好三个节点、加载作业表、创建 LLM 客户端，之后每个请求只付
+#       LLM 时间 + 查询本身的时间。ThreadingHTTPServer 每个连接一个线程，请求之间互不干扰：
+#         • ExecutionNode 不保存请求状态（last_scalar 在每次 run() 的 RunState 里）
+#         • 每个请求新建一张 Graph（节点共用），计时互不覆盖
+#         • 日志按请求收集（contextvars），[ERROR] / [WARN] 行随结果一起返回
+#
+#   python server.py --port 8765 [--lazy] [--parallel] [--speculative] [--stream]
+#
+#   curl -s localhost:8765/query   -d '{"request": "Average Processing_Time of Grinding jobs"}'
+#   curl -s localhost:8765/execute -d '{"plan": {"actions": [...]}}'       # 跳过 LLM，直接执行计划
+#   curl -s localhost:8765/health
+#
+# 请求体可选字段：max_rows（DataFrame 结果预览行数，默认 20）、log（true 时返回完整日志）
+
+import argparse
+import json
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from action_stream import StreamingPlan
+from dataset_cache import DATASET
+from log_capture import captured, installed
+from main import build_graph, build_nodes
+from node_2_execution import result_to_json
+from tracing import TRACER
+
+
+def _log_fields(lines, with_log):
+    text = "".join(lines)
+    out = {"errors": [l for l in text.splitlines() if l.startswith("[ERROR]")],
+           "warnings": [l for l in text.splitlines() if l.startswith("[WARN]")]}
+    if with_log:
+        out["log"] = text
+    return out
+
+
+def _plan_json(plan):
+    text = plan.wait() if isinstance(plan, StreamingPlan) else plan
+    try:
+        return json.loads(text)
+    except (TypeError, ValueError):
+        return text
+
+
+class QueryService:
+    """共用的节点 + 请求处理；HTTP 层之外也可以直接调用 query() / execute()"""
+
+    def __init__(self, argv=(), max_concurrency=8):
+        self.pre_node, self.prompt_node, self.exec_node = build_nodes(argv)
+        self._slots = threading.BoundedSemaphore(max_concurrency)   # 同时在跑的请求数上限
+        self._warm_llm()
+
+    def _warm_llm(self):
+        """提前创建 LLM 客户端（导入 openai、建连接池），第一个请求不再付这部分开销"""
+        backend = getattr(self.prompt_node.backend, "inner", self.prompt_node.backend)
+        if hasattr(backend, "_get_client"):
+            try:
+                backend._get_client()
+            except Exception as e:                  # 缺密钥 / 缺依赖：/execute 仍然可用
+                print(f"[WARN] LLM client not ready: {type(e).__name__}: {e}")
+
+    def query(self, text, max_rows=20, with_log=False):
+        t0 = time.perf_counter()
+        graph = build_graph(self.pre_node, self.prompt_node, self.exec_node)
+        with self._slots, captured() as lines, TRACER.span("request", request=text):
+            outputs = graph.run(start_node=self.pre_node, input_data=text)
+        timings = {label: graph.timings.get(graph._name(node))
+                   for label, node in (("preprocess_s", self.pre_node), ("prompting_s", self.prompt_node),
+                                       ("execution_s", self.exec_node))}
+        timings["total_s"] = time.perf_counter() - t0
+        return {"request": text, "plan": _plan_json(outputs[self.prompt_node]),
+                "result": result_to_json(outputs[self.exec_node], max_rows),
+                **_log_fields(lines, with_log), "timings": timings}
+
+    def execute(self, plan, max_rows=20, with_log=False):
+        t0 = time.perf_counter()
+        text = plan if isinstance(plan, str) else json.dumps(plan)
+        with self._slots, captured() as lines, TRACER.span("request", plan=text):
+            result = self.exec_node.run(text)
+        return {"plan": _plan_json(text), "result": result_to_json(result, max_rows),
+                **_log_fields(lines, with_log), "timings": {"total_s": time.perf_counter() - t0}}
+
+    def health(self):
+        df = DATASET.get()
+        return {"status": "ok", "rows": int(len(df)), "dataset_version": DATASET.version,
+                "model": self.prompt_node.model}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None                               # serve() 里设置
+    protocol_version = "HTTP/1.1"                # keep-alive：客户端可复用连接
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self._send(200, self.service.health())
+        else:
+            self._send(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("body must be a JSON object")
+            opts = {"max_rows": int(body.get("max_rows", 20)), "with_log": bool(body.get("log"))}
+        except (TypeError, ValueError) as e:
+            self._send(400, {"error": f"bad request body: {e}"})
+            return
+
+        path = self.path.rstrip("/")
+        try:
+            if path == "/query":
+                if not isinstance(body.get("request"), str) or not body["request"].strip():
+                    self._send(400, {"error": "'request' (non-empty string) is required"})
+                    return
+                self._send(200, self.service.query(body["request"], **opts))
+            elif path == "/execute":
+                if "plan" not in body:
+                    self._send(400, {"error": "'plan' is required"})
+                    return
+                self._send(200, self.service.execute(body["plan"], **opts))
+            else:
+                self._send(404, {"error": f"unknown path {self.path}"})
+        except Exception as e:
+            print(f"[ERROR] {path} failed: {type(e).__name__}: {e}")
+            self._send(500, {"error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()})
+
+    def log_message(self, fmt, *args):
+        print(f"[LOG] {self.address_string()} {fmt % args}")
+
+
+def serve(host="127.0.0.1", port=8765, argv=(), max_concurrency=8, echo=True):
+    with installed(echo):
+        _Handler.service = QueryService(argv, max_concurrency)
+        httpd = ThreadingHTTPServer((host, port), _Handler)
+        httpd.daemon_threads = True
+        print(f"[LOG] Query server listening on http://{host}:{port}")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+            if _Handler.service.exec_node.sharded is not None:
+                _Handler.service.exec_node.sharded.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Long-running query server with a warm dataset and LLM client")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--max-concurrency", type=int, default=8, help="requests executed at the same time")
+    ap.add_argument("--quiet", action="store_true", help="don't echo per-request logs to the terminal")
+    # 其余开关与 main.py 相同：--lazy / --chunked / --parallel / --speculative / --stream
+    args, node_flags = ap.parse_known_args()
+    serve(args.host, args.port, node_flags, args.max_concurrency, echo=not args.quiet)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# sharded.py
+# 说明：分组类工具的多进程并行执行。按分组键哈希分片，每个分片交给进程池里的一个 worker，
+#       各 worker 在自己的分片上跑原来的工具函数，结果拼接后按分组键排序。
+#       同一个组的行一定落在同一个分片里，所以每组的结果与单进程完全一致。
+#
+#   • 列数据不 pickle：DataFrame 的每一列导出成 .npy，worker 用 np.load(mmap_mode="r") 映射，
+#     只按分片行号取出自己那部分；全量数据每个版本只导出一次
+#   • 行数少于 min_rows 时直接单进程执行（进程间调度开销大于收益）
+#
+#   python main.py --parallel          （worker 数取环境变量 EXEC_WORKERS，默认 CPU 核数）
+
+import atexit
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import tool_functions
+from dataset_cache import DATASET
+from tracing import current_span
+from tool_functions import _group_keys
+
+DEFAULT_MIN_ROWS = 200_000
+
+_EXPORT_ROOT = None
+_WORKER_ARRAYS = {}       # worker 内：文件路径 → 映射好的数组
+
+
+# ---------- 哪些调用可以分片 ----------
+def shard_keys(fname, args):
+    """可以按分组键分片时返回分组键列表，否则 None"""
+    if fname == "group_by_aggregate" and not args.get("keep_all"):
+        return _group_keys(args)
+    if fname in ("calculate_failure_rate", "calculate_delay_avg_grouped"):
+        g = args["group_column"]
+        return [g] if isinstance(g, str) else list(g)
+    if fname == "calculate_percentile":
+        g = args.get("group_by") or args.get("group_column")
+        if g:
+            return [g] if isinstance(g, str) else list(g)
+    return None
+
+
+# ---------- 列导出（内存映射文件） ----------
+def _export_root():
+    global _EXPORT_ROOT
+    if _EXPORT_ROOT is None:
+        _EXPORT_ROOT = tempfile.mkdtemp(prefix="sharded_cols_")
+        atexit.register(shutil.rmtree, _EXPORT_ROOT, True)
+    return _EXPORT_ROOT
+
+
+def export_columns(df):
+    """
+    DataFrame → manifest {列名: (kind, 文件, 附加信息)}
+      kind = "array"       → 数值 / 时间列，原样写成 .npy
+      kind = "categorical" → 写整数 code，类别表放在 manifest 里（很小）
+    其它 object 列先转成 category 再导出
+    """
+    path = tempfile.mkdtemp(dir=_export_root())
+    manifest = {}
+    for i, col in enumerate(df.columns):
+        ser = df[col]
+        if not isinstance(ser.dtype, pd.CategoricalDtype) and ser.dtype.kind not in "biufcmM":
+            ser = ser.astype("category")
+        fname = os.path.join(path, f"{i}.npy")
+        if isinstance(ser.dtype, pd.CategoricalDtype):
+            np.save(fname, ser.cat.codes.to_numpy())
+            manifest[col] = ("categorical", fname, (list(ser.cat.categories), ser.cat.ordered))
+        else:
+            np.save(fname, ser.to_numpy())
+            manifest[col] = ("array", fname, None)
+    return {"dir": path, "columns": manifest, "keep": False}
+
+
+def _base_export():
+    """全量数据的导出按数据集版本缓存"""
+    return DATASET.derived("sharded_export", lambda df: {**export_columns(df), "keep": True})
+
+
+def _drop_export(export):
+    shutil.rmtree(export["dir"], ignore_errors=True)
+
+
+def shard_positions(df, keys, n_shards):
+    """
+    按分组键哈希分片：返回 (positions, bounds)
+      positions[bounds[i]:bounds[i+1]] → 第 i 个分片的行号（保持原始行序）
+    """
+    h = np.zeros(len(df), dtype=np.uint64)
+    for k in keys:
+        ser = df[k]
+        codes = (ser.cat.codes.to_numpy() if isinstance(ser.dtype, pd.CategoricalDtype)
+                 else pd.factorize(ser)[0])
+        h = h * np.uint64(1000003) ^ codes.astype(np.int64).astype(np.uint64)
+    shard = (h % np.uint64(n_shards)).astype(np.int64)
+    positions = np.argsort(shard, kind="stable")
+    bounds = np.r_[0, np.cumsum(np.bincount(shard, minlength=n_shards))]
+    return positions, bounds
+
+
+# ---------- worker 端 ----------
+def _mapped(fname, keep):
+    """全量数据的映射在 worker 里常驻；临时导出（过滤后的 DF）用完即弃"""
+    if fname in _WORKER_ARRAYS:
+        return _WORKER_ARRAYS[fname]
+    arr = np.load(fname, mmap_mode="r")
+    if keep:
+        _WORKER_ARRAYS[fname] = arr
+    return arr
+
+
+def _shard_frame(export, rows):
+    cols = {}
+    for col, (kind, fname, extra) in export["columns"].items():
+        arr = _mapped(fname, export["keep"])[rows]      # 只把本分片的行读进内存
+        if kind == "categorical":
+            cats, ordered = extra
+            cols[col] = pd.Categorical.from_codes(arr, categories=cats, ordered=ordered)
+        else:
+            cols[col] = arr
+    return pd.DataFrame(cols, index=rows)
+
+
+def _run_shard(export, rows, fname, args):
+    return getattr(tool_functions, fname)(_shard_frame(export, rows), args)
+
+
+# ---------- 调度端 ----------
+class ShardedRunner:
+    """
+    进程池 + 分片调度
+      run(fname, args, df) → 与 tool_functions.<fname>(df, args) 相同的结果；不能分片时返回 None
+    """
+
+    def __init__(self, workers=None, min_rows=DEFAULT_MIN_ROWS):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_rows = min_rows
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def run(self, fname, args, df):
+        keys = shard_keys(fname, args)
+        if keys is None or len(df) < self.min_rows or self.workers < 2:
+            return None
+
+        shared = DATASET.is_base(df)
+        export = _base_export() if shared else export_columns(df)
+        try:
+            positions, bounds = shard_positions(df, keys, self.workers)
+            pool = self._get_pool()
+            futs = [pool.submit(_run_shard, export, positions[lo:hi], fname, args)
+                    for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+            parts = [f.result() for f in futs]
+        finally:
+            if not shared:
+                _drop_export(export)
+        print(f"[LOG] {fname}: {len(parts)} shards on {self.workers} workers")
+        current_span().set(shards=len(parts), workers=self.workers, shard_rows=np.diff(bounds).tolist())
+        if not parts:
+            return getattr(tool_functions, fname)(df.iloc[:0], args)
+        res = pd.concat(parts, ignore_index=True)
+        return res.sort_values(keys, kind="stable").reset_index(drop=True)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -3,32 +3,34 @@
 #       以及对 CSV 数据的加载和处理逻辑
 """
 全局 DataFrame → DataFrame
-select_rows（支持 AND/OR）、sort_rows、top_n、group_top_n、filter_date_range、add_derived_column、rolling_average
+select_rows（AND/OR/NOT/IN/BETWEEN/列‑列比较）、sort_rows、top_n、group_top_n、filter_date_range、add_derived_column、rolling_average
 
 统计标量
 calculate_average、median、mode、sum、min、max、std、variance、percentile、correlation、covariance
+calculate_stats（同一列多个统计量，一次扫描）
 
 专用
 calculate_failure_rate、calculate_delay_avg
 """
 
-import os, re
+import re
 import pandas as pd
 import numpy as np
+from pandas.api.indexers import BaseIndexer
 
 # ---------- 基础 ----------
-TIME_COLS = ["Scheduled_Start", "Scheduled_End", "Actual_Start", "Actual_End"]
-CSV_FILE = os.path.join("data", "hybrid_manufacturing_categorical.csv")
+from dataset_cache import TIME_COLS, DATASET, format_key, get_dataset, measure, seconds_between
+from predicate import condition_mask, parse_condition, time_range
+from formula import compile_formula
 
 
 # ----------- 通用小工具 -----------
-def _df(cur):  # 始终返回一个 DataFrame；避免布尔歧义
-    return cur if cur is not None else load_data()
+def _df(cur):  # 始终返回一个 DataFrame；避免布尔歧义。cur 为空时直接用共享缓存（只读）
+    return cur if cur is not None else get_dataset()
 
 def load_data():
-    if not os.path.exists(CSV_FILE):
-        raise FileNotFoundError(CSV_FILE)
-    return pd.read_csv(CSV_FILE, parse_dates=TIME_COLS, dayfirst=False)
+    """全量数据的独立副本；只读场景请用 _df(None)，不必拷贝"""
+    return get_dataset().copy()
 
 def _num(s):
     """安全转数值"""
@@ -37,85 +39,60 @@ def _num(s):
 # ---------- 1) 行级函数 (DF→DF) ----------
 def select_rows(cur, args):
     """
-    单列筛选 + 可选 AND/OR 第二条件
+    条件筛选：条件串解析成表达式树后，对原始 DataFrame 一次求出布尔 mask
       args = { "column": "Processing_Time",
                "condition": ">= 50 AND <= 120" }
+    支持 AND / OR / NOT、括号、IN (...)、BETWEEN ... AND ...、IS [NOT] NULL、
+    以及列‑列比较（"> Scheduled_End"）；条件里也可以显式写别的列名。语法见 predicate.py
     """
-    if cur is None:
-        cur = load_data()
-    col = args["column"]
-    cond = args["condition"]
-
-    # 1. 递归处理 AND/OR
-    if m := re.search(r"\s+(AND|OR)\s+", cond, flags=re.I):
-        left, op, right = re.split(r"\s+(AND|OR)\s+", cond, 1, flags=re.I)
-        df1 = select_rows(cur, {"column": col, "condition": left})
-        df2 = select_rows(cur, {"column": col, "condition": right})
-        return pd.merge(df1, df2) if op.upper()=="AND" else pd.concat([df1,df2]).drop_duplicates()
-
-    # 2. 解析简单条件
-    m = re.match(r"^(==|!=|<=|>=|<|>)\s*(.+)$", cond.strip())
-    if not m: raise ValueError("Bad condition syntax")
-    op, val_raw = m.groups()
-    val_raw = val_raw.strip(' "\'')
-
-    if col in TIME_COLS:
-        # 如果缺少时分，补 00:00
-        if re.fullmatch(r"\d{4}-\d{2}-\d{2}", val_raw):
-            val_raw += " 00:00"
-        val = pd.to_datetime(val_raw, errors="coerce")
-    else:
-        try:   val = float(val_raw)
-        except ValueError: val = val_raw
-
-    ops = {"==":"eq","!=":"ne","<":"lt","<=":"le",">":"gt",">=":"ge"}
-    mask = getattr(cur[col], ops[op])(val)
-    return cur[mask]
-
-    # 布尔 & 列‑列比较
-    # 之前出现错误：对布尔列 "== True" 解析失败。
-    # 方案：自定义解析器，先检测值是否 "True"/"False" 映射为 bool；如未匹配，再检测是否 现有列名
-
-    val_raw = val_raw.strip(' "\'')
-    if val_raw in {"True", "False"}:
-        val = val_raw == "True"
-    elif val_raw in cur.columns:  # 列名比较
-        return cur[getattr(cur[col], ops[op])(cur[val_raw])]
-    else:
-        try:
-            val = float(val_raw)
-        except ValueError:
-            val = val_raw
+    cur = _df(cur)
+    pos = _indexed_positions(cur, args)
+    if pos is not None:                     # 全量数据上的时间区间条件：二分查找，不扫整列
+        return cur.take(pos)
+    return cur[select_mask(cur, args)]
 
 def sort_rows(cur, args):
-    if cur is None: cur = load_data()
-    return cur.sort_values(args["column"], ascending=args.get("order","asc")=="asc")
+    cur = _df(cur)
+    return cur.sort_values(args["column"], ascending=args.get("order","asc")=="asc", kind="stable")
 
 def top_n(cur, args):
-    if cur is None: cur = load_data()
+    """
+    前 N 行：部分选择（nlargest / nsmallest，O(n)），不做全排序
+    并列时按原始行序取前面的行；非数值列退回稳定排序
+    """
+    cur = _df(cur)
     n   = int(args.get("n",5))
+    col = args["column"]
     asc = args.get("order","desc")!="desc"
-    return cur.sort_values(args["column"], ascending=asc).head(n)
+    try:
+        return cur.nsmallest(n, col) if asc else cur.nlargest(n, col)
+    except TypeError:
+        return cur.sort_values(col, ascending=asc, kind="mergesort").head(n)
 
 def group_top_n(cur, args):
     """
-    每组取前 N
+    每组取前 N：一次分组 rank(method="first") 选出每组前 N 行，再只对这 ≤ 组数×N 行排序
       args = {"group_column":"Machine_ID",
               "sort_column":"Processing_Time",
               "order":"desc","n":2,"keep_all":True}
     """
-    if cur is None: cur = load_data()
+    cur = _df(cur)
     g,s,n = args["group_column"], args["sort_column"], int(args.get("n",1))
     asc   = args.get("order","desc")!="desc"
-    out = (cur.sort_values(s, ascending=asc)
-              .groupby(g, as_index=False).head(n))
+    try:
+        rank = (cur.groupby(g, observed=True)[s]
+                   .rank(method="first", ascending=asc, na_option="bottom"))
+        out = cur[(rank <= n).to_numpy()].sort_values(s, ascending=asc, kind="mergesort")
+    except TypeError:                          # 不能 rank 的列：退回整表稳定排序
+        out = (cur.sort_values(s, ascending=asc, kind="mergesort")
+                  .groupby(g, as_index=False, observed=True).head(n))
     keep = args.get("keep_all", True)
 
     if keep:
         return out
     # 即使 keep_all = false 也保留核心标识列，避免后续 KeyError
     id_cols = [c for c in ("Job_ID", "Machine_ID") if c in out.columns]
-    return out[id_cols + [g, s]]
+    return out[list(dict.fromkeys(id_cols + [g, s]))]
 
 def filter_date_range(cur, args):
     """
@@ -125,129 +102,330 @@ def filter_date_range(cur, args):
               "end":"2023-03-18 12:00",
               "inclusive":"both"}
     """
-    if cur is None: cur = load_data()
+    cur = _df(cur)
+    pos = _date_range_positions(cur, args)
+    if pos is not None:                     # 全量数据：有序时间索引 + searchsorted，只取窗口内的行
+        return cur.take(pos)
+    return cur[date_range_mask(cur, args)]
+
+def date_range_mask(cur, args):
+    """filter_date_range 的布尔 mask 版本，供 ExecutionNode 融合多个过滤条件"""
+    pos = _date_range_positions(cur, args)
+    if pos is not None:
+        return _positions_to_mask(pos, len(cur))
     col = args["column"]
     s   = pd.to_datetime(args.get("start")) if args.get("start") else None
     e   = pd.to_datetime(args.get("end"))   if args.get("end")   else None
     inc = args.get("inclusive","both")
     ser = pd.to_datetime(cur[col], errors="coerce")
-    mask = pd.Series(True, index=cur.index)
-    if s is not None: mask &= ser.ge(s) if inc in ("both","left") else ser.gt(s)
-    if e is not None: mask &= ser.le(e) if inc in ("both","right") else ser.lt(e)
-    return cur[mask]
+    mask = np.ones(len(cur), dtype=bool)
+    if s is not None: mask &= (ser.ge(s) if inc in ("both","left") else ser.gt(s)).to_numpy()
+    if e is not None: mask &= (ser.le(e) if inc in ("both","right") else ser.lt(e)).to_numpy()
+    return mask
+
+def select_mask(cur, args):
+    """select_rows 的布尔 mask 版本"""
+    pos = _indexed_positions(cur, args)
+    if pos is not None:
+        return _positions_to_mask(pos, len(cur))
+    return condition_mask(cur, args.get("column"), args["condition"])
+
+# ----------- 时间索引（仅对共享的全量数据可用） -----------
+def _time_window(cur, col, start, end, left_closed, right_closed):
+    if col not in TIME_COLS or not DATASET.is_base(cur):
+        return None
+    if not pd.api.types.is_datetime64_any_dtype(cur[col]):
+        return None
+    return DATASET.time_index(col).window(start, end, left_closed, right_closed)
+
+def _date_range_positions(cur, args):
+    col = args["column"]
+    inc = args.get("inclusive", "both")
+    if not DATASET.is_base(cur) or col not in TIME_COLS:
+        return None
+    s = pd.to_datetime(args.get("start")) if args.get("start") else None
+    e = pd.to_datetime(args.get("end"))   if args.get("end")   else None
+    return _time_window(cur, col, s, e, inc in ("both", "left"), inc in ("both", "right"))
+
+def _indexed_positions(cur, args):
+    if not DATASET.is_base(cur):
+        return None
+    rng = time_range(parse_condition(args["condition"].strip()), args.get("column"), TIME_COLS)
+    return _time_window(cur, *rng) if rng else None
+
+def _positions_to_mask(pos, n):
+    mask = np.zeros(n, dtype=bool)
+    mask[pos] = True
+    return mask
 
 def add_derived_column(cur, args):
     """
-    新增表达式列
+    新增表达式列（formula.py 编译：按公式文本缓存，NumPy 向量化求值）
       args = {"name":"EC_per_PT",
               "formula":"Energy_Consumption / Processing_Time"}
-    问题1：未设置时报错
-    解决方案：
-        在执行替换时，若 self.last_scalar is None 则直接照字面保留，不报错
-    问题2：派生列 Scheduled_Start - Actual_Start 抛 numexpr 错
-    解决方案：
-        执行 cur.eval 前，若检测到日期列差分，改为 pd.to_datetime(col1) - pd.to_datetime(col2) 并转 .dt.total_seconds()
+    • 两个时间列相减得到秒，可继续参与运算："(Actual_End - Actual_Start) / Processing_Time"
+    • {last_scalar} 作为参数绑定：args["params"] = {"last_scalar": ...}（ExecutionNode 负责填入）
+    • 引用不存在的列时报 FormulaError，并列出可用列
     """
-    formula = args["formula"].replace("{last_scalar}",
-                                      str(last_scalar) if (
-                                          last_scalar := globals().get("_LAST_SCALAR")) else "{last_scalar}")
-
-    if " - " in formula and any(c in formula for c in TIME_COLS):
-        lhs, rhs = [s.strip() for s in formula.split("-", 1)]
-        delta = pd.to_datetime(cur[lhs]) - pd.to_datetime(cur[rhs])
-        cur[args["name"]] = delta.dt.total_seconds()
-    else:
-        cur[args["name"]] = cur.eval(formula)
-    return cur
+    cur = _df(cur)
+    program = compile_formula(args["formula"])
+    val = program.evaluate(cur, args.get("params"))
+    return cur.assign(**{args["name"]: val})   # 不原地修改：cur 可能是共享缓存
+
+class _WindowBounds(BaseIndexer):
+    """预先算好的每行窗口 [start, end)，交给 pandas rolling 的向量化内核"""
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        return self.start, self.end
+
+_ROLL_FUNCS = {"mean": "mean", "avg": "mean", "min": "min", "max": "max", "sum": "sum"}
+
+def _run_starts(codes):
+    """已按分组排好序的 codes → 每行所在分组的起始位置"""
+    n = len(codes)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    heads = np.r_[0, np.flatnonzero(codes[1:] != codes[:-1]) + 1]
+    return np.repeat(heads, np.diff(np.r_[heads, n])).astype(np.int64)
 
 def rolling_average(cur, args):
     """
-    滚动平均    之前的 rolling_average(无分组) 返回 DF 中无原列，而 LLM 仍按原列排序。 修改后让函数始终 return DataFrame 并保留原列
+    滚动统计，结果按原始行对齐写回（保留所有列）
+      args = {"column": "Energy_Consumption",
+              "window": 5 | "2h",             # 行数窗口，或时间窗口（需 order_by）
+              "group_by": "Machine_ID",       # 可选，str 或 list
+              "order_by": "Actual_Start",     # 可选，组内按此列排序
+              "func": "mean|min|max|sum"}     # 默认 mean
+    输出列：mean → rolling_avg_<col>（兼容旧名），其余 → rolling_<func>_<col>
+    做法：一次稳定排序得到 (分组, 时间) 顺序，向量化算出每行窗口边界（不跨组），
+          用自定义 BaseIndexer 交给 pandas 的 O(n) 滚动内核，最后按行号散回原顺序，
+          不产生 MultiIndex
     """
-    if cur is None: cur = load_data()
-    w   = int(args.get("window",3))
+    cur = _df(cur)
     col = args["column"]
     g   = args.get("group_by")
-    if g:                                      # 分组滚动
-        df = (cur.sort_values(g)    # 把多级索引行号改名为 row_idx，信息友好且不影响后续运算。
-                 .groupby(g, group_keys=False)[col]
-                 .rolling(w, min_periods=1).mean()
-                 .reset_index())
-        df.rename(columns={col:f"rolling_avg_{col}"}, inplace=True)
-        return df
-    else:                                     # 全局滚动
-        ser = _num(cur[col]).rolling(w, min_periods=1).mean()
-        return cur.assign(**{f"rolling_avg_{col}": ser})
+    by  = args.get("order_by")
+    func = _ROLL_FUNCS.get(str(args.get("func", "mean")).lower())
+    if func is None: raise ValueError(f"Unsupported rolling func: {args.get('func')}")
+    raw_w = args.get("window", 3)
+    time_window = isinstance(raw_w, str) and not raw_w.strip().isdigit()
+    if time_window and not by:
+        raise ValueError("Time-based window requires order_by")
+
+    n = len(cur)
+    vals = _num(cur[col]).to_numpy(dtype=np.float64, na_value=np.nan)
+    keys = [g] if isinstance(g, str) else list(g or [])
+    codes = (cur.groupby(keys, observed=True, sort=False, dropna=False).ngroup().to_numpy(np.int64)
+             if keys else np.zeros(n, dtype=np.int64))
+
+    # ---- 处理顺序：(分组, 时间)，稳定排序，保持同键行的原始先后 ----
+    t = None
+    nat = np.zeros(n, dtype=bool)
+    if by:
+        tser = cur[by]
+        if pd.api.types.is_datetime64_any_dtype(tser):
+            tv = tser.to_numpy()
+            nat = np.isnat(tv)
+            t = tv.astype("datetime64[ns]").view("i8")
+        else:
+            tv = _num(tser).to_numpy(dtype=np.float64, na_value=np.nan)
+            nat = np.isnan(tv)
+            t = np.where(nat, 0, tv).astype(np.int64)
+        t = np.where(nat, np.iinfo(np.int64).max, t)       # 时间缺失的行排在组尾，结果为 NaN
+        order = np.lexsort((t, codes))
+    elif keys:
+        order = np.argsort(codes, kind="stable")
+    else:
+        order = np.arange(n)
+
+    sc = codes[order]
+    gstart = _run_starts(sc)
+    end = np.arange(1, n + 1, dtype=np.int64)
+    if time_window:
+        w = pd.Timedelta(raw_w).value
+        st = t[order]
+        span = int(st[~nat[order]].max() - st[~nat[order]].min()) if (~nat).any() else 0
+        ngroups = int(sc.max()) + 1 if n else 0
+        if ngroups * (span + w + 1) < 2 ** 62:
+            # 组号 × 跨度 + 相对时间 → 全局单调的组合键，一次 searchsorted 得到所有窗口起点
+            base = st[~nat[order]].min() if (~nat).any() else 0
+            rel = np.where(nat[order], span + w, st - base)
+            key = sc * (span + w + 1) + rel
+            start = np.searchsorted(key, key - w, side="right").astype(np.int64)
+        else:
+            # 组合键会溢出：逐组二分（组数远小于行数）
+            start = np.empty(n, dtype=np.int64)
+            heads = np.unique(gstart)
+            for lo, hi in zip(heads, np.r_[heads[1:], n]):
+                seg = st[lo:hi]
+                start[lo:hi] = lo + np.searchsorted(seg, seg - w, side="right")
+        start = np.maximum(start, gstart)
+        empty = nat[order]
+        start[empty] = end[empty]                           # 时间缺失：空窗口
+    else:
+        w = int(raw_w)
+        start = np.maximum(end - w, gstart)
+
+    rolled = getattr(pd.Series(vals[order]).rolling(_WindowBounds(start=start, end=end), min_periods=1), func)()
+    out = np.empty(n, dtype=np.float64)
+    out[order] = rolled.to_numpy()
+    name = f"rolling_avg_{col}" if func == "mean" else f"rolling_{func}_{col}"
+    return cur.assign(**{name: out})
 
 # ---------- 2) group_by_aggregate ----------
+_AGG_MAP = {"avg": "mean", "mean": "mean", "sum": "sum", "min": "min", "max": "max",
+            "count": "count", "std": "std", "var": "var", "median": "median", "nunique": "nunique"}
+
+_AGG_ALIASES = {"covariance": "cov", "correlation": "corr", "average": "avg", "variance": "var"}
+
+def _group_keys(args):
+    g = args.get("group_columns", args.get("group_column"))
+    if not g: raise ValueError("group_column required")
+    return [g] if isinstance(g, str) else list(g)
+
+def _metric_specs(args):
+    """metrics 列表；旧写法（target_column/derived + agg）视为只有一个指标"""
+    if args.get("metrics"):
+        return args["metrics"]
+    return [{"column": args.get("target_column"), "derived": args.get("derived"),
+             "agg": args.get("agg", "avg"), "other_column": args.get("other_column"),
+             "percentile": args.get("percentile", args.get("q"))}]
+
+def _metric_agg(m):
+    """指标的聚合方式（规范化别名；p95 → ("percentile", 95)）"""
+    agg = str(m.get("agg", "avg")).lower()
+    agg = _AGG_ALIASES.get(agg, agg)
+    q = m.get("percentile", m.get("q"))
+    if re.fullmatch(r"p\d+(\.\d+)?", agg):
+        agg, q = "percentile", float(agg[1:])
+    return agg, q
+
+def apply_having(res, having):
+    """聚合结果上的后置过滤：条件串，或 {"column":..., "condition":...}"""
+    if isinstance(having, dict):
+        res = res[condition_mask(res, having.get("column"), having["condition"])]
+    else:
+        res = res[condition_mask(res, None, having)]
+    return res.reset_index(drop=True)
+
+def _metric_input(df, m, agg):
+    """指标的输入列：普通列 / 派生时间差；count(*) 返回 None"""
+    d = m.get("derived")
+    if d:   # 此段是为了正确处理 derived["type"]（但在后续开发中进行了一定修改），把 timedelta 放到第一分支，彻底消除 “Unsupported derived type”
+        if d.get("type") != "timedelta":
+            raise ValueError("Unsupported derived type")
+        # 时间差来自派生度量层（int64 秒缓存），单位换算只是缩放
+        ser = pd.Series(seconds_between(df, d["end_col"], d["start_col"], d.get("unit", "seconds")),
+                        index=df.index)
+        return ser, d.get("name", "derived")
+    col = m.get("column")
+    if col is None:
+        if agg == "count": return None, None
+        raise ValueError(f"metric needs a column: {m}")
+    return (df[col] if agg in ("count", "nunique") else _num(df[col])), col
+
+def pair_moments(x, y, by=None):
+    """
+    分组协方差 / 相关系数：一次 groupby-sum 求充分统计量 (n, Σx, Σy, Σxy, Σx², Σy²)，
+    不回调 Python。只用 x、y 同时非空的行（与 Series.cov/corr 一致，ddof=1）。
+    by=None 时返回单行结果。先减去全局均值，降低 Σxy − ΣxΣy/n 的抵消误差。
+    返回 DataFrame[n, cov, corr]，索引为分组键
+    """
+    x = x.to_numpy(dtype=np.float64, na_value=np.nan)
+    y = y.to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    if valid.any():
+        x = x - x[valid].mean()
+        y = y - y[valid].mean()
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    stats = pd.DataFrame({"n": valid.astype(np.int64), "sx": x, "sy": y,
+                          "sxy": x * y, "sxx": x * x, "syy": y * y})
+    if by is None:
+        sums = stats.sum().to_frame().T
+    else:
+        sums = stats.groupby([k.reset_index(drop=True) for k in by], observed=True, sort=True).sum()
+    return pair_from_sums(sums)
+
+def pair_from_sums(sums):
+    """充分统计量 DataFrame[n, sx, sy, sxy, sxx, syy]（可逐块相加）→ DataFrame[n, cov, corr]"""
+    n = sums["n"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cxy = sums["sxy"] - sums["sx"] * sums["sy"] / n
+        vx = sums["sxx"] - sums["sx"] ** 2 / n
+        vy = sums["syy"] - sums["sy"] ** 2 / n
+        cov = (cxy / (n - 1)).where(n > 1)
+        corr = (cxy / np.sqrt(vx * vy)).where((n > 1) & (vx > 0) & (vy > 0)).clip(-1, 1)
+    return pd.DataFrame({"n": n, "cov": cov, "corr": corr})
+
 def group_by_aggregate(cur, args):
     """
-    支持 agg：avg/sum/min/max/count/std/var
-    支持派生列 {"derived":{...}}
-    elif agg == "percentile":
-        q = float(args.get("q", args.get("percentile", 90)))
-        grouped = target.groupby(cur[g]).quantile(q/100)
+    分组聚合：多个分组键 × 多个指标，一次分组完成
+      args = {"group_column": "Machine_ID" | ["Operation_Type", "Machine_ID"],
+              // 单指标（旧写法）：
+              "target_column": <str> | "derived": {...}, "agg": "avg", "other_column": <str?>,
+              // 多指标：
+              "metrics": [{"column": "Job_ID", "agg": "count", "alias": "n_jobs"},
+                          {"column": "Energy_Consumption", "agg": "avg", "alias": "avg_energy"},
+                          {"column": "Processing_Time", "agg": "percentile", "percentile": 95}],
+              "having": "n_jobs >= 5",          // 聚合结果上的后置过滤，语法同 select_rows
+              "keep_all": false}                // true：结果按分组键并回原始行
+    支持 agg：avg/mean/sum/min/max/count/std/var/median/nunique/percentile（或 p95）/cov/corr
+    支持派生列 {"derived":{"type":"timedelta", "end_col":..., "start_col":..., "unit":..., "name":...}}
     """
-    df = _df(cur); g = args["group_column"]
+    df = _df(cur)
+    keys = _group_keys(args)
     keep = args.get("keep_all", False)
-    agg = args.get("agg", "avg").lower()
-
-    # 扩展 agg_map + percentile/cov/corr，增加了功能
-
-    if agg == "percentile":
-        q = float(args.get("q", args.get("percentile", 90)))
-        res = (_num(cur[args["target_column"]])
-               .groupby(cur[g])
-               .quantile(q / 100)
-               .reset_index(name=f"p{int(q)}_{args['target_column']}"))
-        return cur.merge(res, on=g, how="left") if keep else res
-
-    if agg in {"cov", "corr"}:  # 支持 cov / corr
-        other = args.get("other_column")
-        if other is None: raise ValueError("other_column required for cov/corr")
-        grp = cur.groupby(g)
-        func = "cov" if agg == "cov" else "corr"
-        res = grp.apply(lambda df: _num(df[args["target_column"]]).__getattribute__(func)(_num(df[other])))
-        res = res.reset_index(name=f"{agg}_{args['target_column']}_{other}")
-        return cur.merge(res, on=g, how="left") if keep else res
-
-    # ------- 目标列或派生 --------
-    if "derived" in args:   # 此段是为了正确处理 derived["type"]（但在后续开发中进行了一定修改），把 timedelta 放到第一分支，彻底消除 “Unsupported derived type”
-        d = args["derived"]
-        if d["type"] == "timedelta":
-            delta = (pd.to_datetime(df[d["end_col"]]) -
-                     pd.to_datetime(df[d["start_col"]])).dt.total_seconds()
-            if d.get("unit") == "minutes":
-                delta /= 60
-            elif d.get("unit") == "hours":
-                delta /= 3600
-            target = delta
-            colname = d.get("name", "derived")
-        else:
-            raise ValueError("Unsupported derived type")
-    else:
-        colname = args["target_column"]
-        target = _num(df[colname])
-
-    # ------- 聚合 ---------  之前的版本 1.不支持 cov/percentile；2.keep_all=True 且无 derived 时 target 未定义；3.只有 timedelta 派生类型
-    if agg in {"cov", "corr"}:  # 双列聚合
-        other = _num(df[args["other_column"]])
-        func = pd.Series.cov if agg == "cov" else pd.Series.corr
-        res = (target.groupby(df[g])
-               .apply(lambda s: func(s, other.loc[s.index]))
-               .reset_index(name=f"{agg}_{colname}"))
-    elif agg == "percentile":
-        q = float(args.get("percentile", args.get("q", 90))) / 100
-        res = (target.groupby(df[g]).quantile(q)
-               .reset_index(name=f"p{int(q * 100)}_{colname}"))
-    else:
-        agg_map = {"avg": "mean", "mean": "mean", "sum": "sum", "min": "min", "max": "max",
-                   "count": "count", "std": "std", "var": "var"}
-        if agg not in agg_map: raise ValueError("Bad agg")
-        res = getattr(target.groupby(df[g]), agg_map[agg])() \
-            .reset_index(name=f"{agg}_{colname}")
 
-    return df.merge(res, on=g) if keep else res
+    # ------- 收集每个指标的输入列与聚合方式 --------
+    work = {k: df[k] for k in keys}
+    named, quantiles, pairs, sizes, order = {}, [], [], [], []
+    for i, m in enumerate(_metric_specs(args)):
+        agg, q = _metric_agg(m)
+        ser, colname = _metric_input(df, m, agg)
+        if ser is None:                                     # count(*)
+            sizes.append(m.get("alias") or "count")
+            order.append(sizes[-1])
+            continue
+        tmp = f"__m{i}"
+        work[tmp] = ser
+        if agg == "percentile":
+            q = float(q if q is not None else 90)
+            quantiles.append((m.get("alias") or f"p{int(q)}_{colname}", tmp, q / 100))
+            order.append(quantiles[-1][0])
+        elif agg in {"cov", "corr"}:
+            other = m.get("other_column")
+            if other is None: raise ValueError("other_column required for cov/corr")
+            work[tmp + "_y"] = _num(df[other])
+            pairs.append((m.get("alias") or f"{agg}_{colname}_{other}", tmp, tmp + "_y", agg))
+            order.append(pairs[-1][0])
+        elif agg in _AGG_MAP:
+            alias = m.get("alias") or f"{agg}_{colname}"
+            named[alias] = (tmp, _AGG_MAP[agg])
+            order.append(alias)
+        else:
+            raise ValueError(f"Bad agg: {agg}")
+
+    # ------- 一次分组：分组键只分解一次，各指标共用同一个 grouper --------
+    gb = pd.DataFrame(work, index=df.index).groupby(keys, observed=True, sort=True)
+    parts = []
+    if named:
+        parts.append(gb.agg(**named))
+    for alias in sizes:
+        parts.append(gb.size().rename(alias))
+    for alias, tmp, q in quantiles:
+        parts.append(gb[tmp].quantile(q).rename(alias))
+    for alias, x, y, agg in pairs:   # 充分统计量一次 groupby-sum，不走 groupby.apply
+        parts.append(pair_moments(work[x], work[y], [work[k] for k in keys])[agg].rename(alias))
+    if not parts:
+        raise ValueError("No metrics to aggregate")
+    res = pd.concat(parts, axis=1)[order].reset_index()
+
+    # ------- HAVING：聚合后的过滤 --------
+    having = args.get("having")
+    if having:
+        res = apply_having(res, having)
+
+    return df.merge(res, on=keys, how="inner" if having else "left") if keep else res
 
 
 # ---------- 3) 标量 ----------
@@ -256,14 +434,14 @@ def calculate_average(cur,args):
 def calculate_median(cur,args):
     df = _df(cur); return _num(df[args["column"]]).median()
 def calculate_mode(cur,args):
-    ser = (cur if cur is not None else load_data())[args["column"]].mode()
-    return ser.iloc[0] if not ser.empty else None
+    ser = _df(cur)[args["column"]].mode()
+    return format_key(args["column"], ser.iloc[0]) if not ser.empty else None
 def calculate_sum(cur,args):
     df=_df(cur); return _num(df[args["column"]]).sum()
 def calculate_min(cur,args):
-    df=_df(cur); return _num(df[args["column"]]).min()
+    df=_df(cur); return format_key(args["column"], _num(df[args["column"]]).min())
 def calculate_max(cur,args):
-    df=_df(cur); return _num(df[args["column"]]).max()
+    df=_df(cur); return format_key(args["column"], _num(df[args["column"]]).max())
 def calculate_std(cur,args):
     df=_df(cur); return _num(df[args["column"]]).std()
 def calculate_variance(cur,args):
@@ -272,20 +450,85 @@ def calculate_percentile(cur,args):
     df=_df(cur); q=float(args.get("percentile", args.get("q",90)))
     g = args.get("group_by") or args.get("group_column")
     if g:
-        return (df.groupby(g)[args["column"]]
+        return (df.groupby(g, observed=True)[args["column"]]
                   .quantile(q/100)
                   .reset_index(name=f"p{int(q)}_{args['column']}"))
     return _num(df[args["column"]]).quantile(q/100)
 def calculate_correlation(cur,args):
-    x = args.get("x") or args.get("column1")
-    y = args.get("y") or args.get("column2")
-    df=_df(cur)
-    return _num(df[x]).corr(_num(df[y]))
+    """args = {"column1": <str>, "column2": <str>, "group_by": <str | [str]?>}；分组时返回 DataFrame"""
+    return _pair_stat(cur, args, "corr")
 def calculate_covariance(cur,args):
+    """args = {"column1": <str>, "column2": <str>, "group_by": <str | [str]?>}；分组时返回 DataFrame"""
+    return _pair_stat(cur, args, "cov")
+def _pair_stat(cur, args, stat):
     x = args.get("x") or args.get("column1")
     y = args.get("y") or args.get("column2")
     df=_df(cur)
-    return _num(df[x]).cov(_num(df[y]))
+    g = args.get("group_by") or args.get("group_column")
+    if not g:
+        return float(pair_moments(_num(df[x]), _num(df[y]))[stat].iloc[0])
+    keys = [g] if isinstance(g, str) else list(g)
+    res = pair_moments(_num(df[x]), _num(df[y]), [df[k] for k in keys])
+    return res[[stat]].rename(columns={stat: f"{stat}_{x}_{y}"}).reset_index()
+
+# ---------- 多统计量：一次数值转换、一次扫描 ----------
+_STAT_ALIASES = {"avg": "mean", "average": "mean", "variance": "var", "stddev": "std"}
+COLUMN_STATS = {"mean", "sum", "min", "max", "std", "var", "median", "count"}   # 另有分位数 pNN
+
+def _stat_name(stat):
+    stat = str(stat).strip().lower()
+    return _STAT_ALIASES.get(stat, stat)
+
+def column_stats(ser, stats):
+    """
+    对一列一次性算出多个统计量，返回 {stat: value}
+      stats ⊆ mean / sum / min / max / std / var / median / count / pNN（如 p90、p99.5）
+    列只转换成 float64 一次；所有分位数（含 median）合并成一次 np.quantile
+    """
+    stats = [_stat_name(s) for s in stats]
+    if pd.api.types.is_numeric_dtype(ser) and not pd.api.types.is_bool_dtype(ser):
+        arr = ser.to_numpy(dtype=np.float64, na_value=np.nan)
+    else:
+        arr = _num(ser).to_numpy(dtype=np.float64, na_value=np.nan)
+    vals = arr[~np.isnan(arr)]
+    n = len(vals)
+    is_int = pd.api.types.is_integer_dtype(ser)
+
+    qs = {}
+    for st in stats:
+        if st == "median":
+            qs[st] = 0.5
+        elif re.fullmatch(r"p\d+(\.\d+)?", st):
+            qs[st] = float(st[1:]) / 100
+        elif st not in COLUMN_STATS:
+            raise ValueError(f"Unknown stat {st!r}")
+    qv = dict(zip(qs, np.quantile(vals, list(qs.values())))) if qs and n else dict.fromkeys(qs, np.nan)
+
+    total = vals.sum()
+    mean = total / n if n else np.nan
+    ss = ((vals - mean) ** 2).sum() if n else np.nan
+    var = ss / (n - 1) if n > 1 else np.nan
+    cast = np.int64 if is_int else np.float64
+    base = {"count": n,
+            "sum": cast(total),
+            "mean": np.float64(mean),
+            "min": format_key(ser.name, cast(vals.min())) if n else np.nan,
+            "max": format_key(ser.name, cast(vals.max())) if n else np.nan,
+            "var": np.float64(var),
+            "std": np.float64(np.sqrt(var))}
+    return {st: (qv[st] if st in qv else base[st]) for st in stats}
+
+def calculate_stats(cur, args):
+    """
+    同一列的多个统计量，一次转换 + 一次扫描
+      args = {"column": "Processing_Time",
+              "stats": ["mean", "std", "min", "max", "p90"]}
+    返回以统计量为索引的 Series
+    """
+    df = _df(cur)
+    col = args["column"]
+    stats = args.get("stats") or ["count", "mean", "std", "min", "max"]
+    return pd.Series(column_stats(df[col], stats), name=col, dtype=object)
 
 # ---------- 新增 count_rows ----------
 def count_rows(cur,args=None):
@@ -299,44 +542,37 @@ def calculate_delay_avg(cur,args=None):
     use_abs = bool(args.get("abs", False)) # 取绝对值？
 
     df = _df(cur)
-    completed = df[df["Job_Status"] == "Completed"]
-    delta = (pd.to_datetime(completed["Actual_End"]) -
-             pd.to_datetime(completed["Scheduled_End"])).dt.total_seconds()
+    completed = (df["Job_Status"] == "Completed").to_numpy()
+    delta = measure(df, "end_delay", unit)[completed]
 
     if use_abs:
         delta = delta.abs()
 
-    if unit == "minutes":
-        delta /= 60
-    elif unit == "hours":
-        delta /= 3600
-
     return delta.mean()
 
 def calculate_failure_rate(cur,args):
     """
     Failed / total per group_column
-      args={"group_column":"Machine_ID"}
+      args={"group_column":"Machine_ID"}        （也可以是列名列表）
     """
-    df = cur if cur is not None else load_data()
+    df = _df(cur)
     g = args["group_column"]
-    failed = df[df["Job_Status"]=="Failed"].groupby(g).size()
-    total  = df.groupby(g).size()
-    return (failed/total).fillna(0).reset_index(name="failure_rate")
+    keys = [g] if isinstance(g, str) else list(g)
+    # Job_Status 是 category：== 比较落在整数 code 上；一次分组求均值即为失败率
+    failed = (df["Job_Status"] == "Failed").astype(np.float64)
+    return failed.groupby([df[k] for k in keys], observed=True).mean().reset_index(name="failure_rate")
 
 # --------- 新增：延迟平均（分组）-----------
 def calculate_delay_avg_grouped(cur, args):
     """
     • Average (Actual_End − Scheduled_End) per group.
-    • args = { "group_column": <str>, "unit": "seconds|minutes|hours" }
+    • args = { "group_column": <str | [str]>, "unit": "seconds|minutes|hours" }
     """
-    df = cur if cur is not None else load_data()
+    df = _df(cur)
     gcol = args["group_column"]
+    keys = [gcol] if isinstance(gcol, str) else list(gcol)
     unit = args.get("unit","seconds")
-    delta = (pd.to_datetime(df["Actual_End"]) -
-             pd.to_datetime(df["Scheduled_End"])).dt.total_seconds()
-    if unit=="minutes": delta /= 60
-    elif unit=="hours": delta /= 3600
-    res = delta.groupby(df[gcol]).mean().reset_index(name=f"avg_delay_{unit}")
+    delta = measure(df, "end_delay", unit)
+    res = delta.groupby([df[k] for k in keys], observed=True).mean().reset_index(name=f"avg_delay_{unit}")
     return res
 
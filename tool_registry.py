@@ -0,0 +1,137 @@
+# tool_registry.py
+# 说明：工具函数的唯一登记表。ExecutionNode 据此建立 df_funcs / scalar_funcs，
+#       prompt_builder 据此生成给 LLM 的精简工具说明，并按关键词挑选与请求相关的工具。
+#       新增工具：在 tool_functions.py 实现，再在这里登记一行即可，两边自动同步。
+#
+#   kind      → "df"（DataFrame → DataFrame）| "scalar"（DataFrame → 标量 / 小结果表）
+#   args      → 提示词里的参数签名
+#   doc       → 说明（每条一行，尽量短）
+#   keywords  → 触发词：普通词按整词匹配；以 * 结尾按前缀匹配；"a+b" 表示 a、b 都出现
+#   tags      → "time"：请求提到时间列 / 日期时自动带上
+
+from collections import namedtuple
+
+Tool = namedtuple("Tool", "name kind args doc keywords tags")
+
+
+def _tool(name, kind, args, doc, keywords=(), tags=()):
+    return Tool(name, kind, args, tuple(doc), tuple(keywords), tuple(tags))
+
+
+_TOP_WORDS = ("top", "bottom", "first", "highest", "lowest", "largest", "smallest", "longest", "shortest",
+              "most", "least", "best", "worst", "biggest")
+_GROUP_WORDS = ("per", "each", "every", "group*", "breakdown", "across", "by+machine*", "by+operation*",
+                "by+status", "by+categor*", "by+type*")
+
+TOOLS = {t.name: t for t in [
+    # ---------- DataFrame → DataFrame ----------
+    _tool("select_rows", "df",
+          '{"column": str, "condition": "<op> <value> [AND|OR <op> <value>]"}',
+          ["Keep rows whose column satisfies the condition.",
+           "ops: == != < <= > >=, IN (v1, v2), BETWEEN a AND b, IS [NOT] NULL; combine with AND/OR/NOT and ().",
+           "A term may name another column (\"== 'Grinding' OR Machine_ID IN ('M01','M02')\");"
+           " a bare column name as value compares two columns (\"> Scheduled_End\").",
+           "Values: number, 'string', or datetime (dd/mm/yyyy HH:MM)."]),
+    _tool("sort_rows", "df",
+          '{"column": str, "order": "asc|desc"}',
+          ["Sort the current rows by a column."],
+          ("sort*", "order*", "rank*", "ascending", "descending") + _TOP_WORDS),
+    _tool("top_n", "df",
+          '{"column": str, "n": int, "order": "asc|desc"}',
+          ["Keep the first n rows after sorting by column (no separate sort_rows needed)."],
+          _TOP_WORDS),
+    _tool("group_top_n", "df",
+          '{"group_column": str, "sort_column": str, "n": int, "order": "asc|desc"}',
+          ["Top n rows within each group."],
+          tuple(f"{g}+{t}" for g in ("per", "each", "every", "group*") for t in _TOP_WORDS)),
+    _tool("filter_date_range", "df",
+          '{"column": <datetime column>, "start": datetime, "end": datetime,'
+          ' "inclusive": "both|left|right|neither"}',
+          ["Keep rows whose datetime column lies between start and end."],
+          ("date*", "until", "before", "after", "since", "during", "period", "day*",
+           "hour*", "week*", "month*", "march", "morning", "afternoon", "evening", "night"),
+          ("time",)),
+    _tool("add_derived_column", "df",
+          '{"name": str, "formula": "<expr>"}',
+          ["New column from a formula: + - * / // % **, comparisons, & |, abs/sqrt/log/log10/exp/floor/ceil/round;"
+           " quote column names containing spaces in backticks.",
+           "datetime - datetime gives seconds and mixes with other columns:"
+           " \"(Actual_End - Actual_Start) / Processing_Time\".",
+           "{last_scalar} in the formula is the scalar from the most recent scalar step"
+           " (only if such a step came before); {<name>} is a scalar named with \"as\"."],
+          ("ratio", "divided", "times", "multipl*", "differen*", "minus", "deviation*", "derive*", "formula",
+           "efficiency", "duration*", "elapsed", "above", "below", "relative", "normali*", "per+unit",
+           "new+column", "compute", "than+average", "than+mean"),
+          ("time",)),
+    _tool("rolling_average", "df",
+          '{"column": str, "window": int | "<time span, e.g. 2h>", "group_by": str?,'
+          ' "order_by": <datetime column, required for time spans>, "func": "mean|min|max|sum"}',
+          ["Rolling mean/min/max/sum; keeps all columns and row order.",
+           "Output column: rolling_avg_<column> for mean, rolling_<func>_<column> otherwise."],
+          ("rolling", "moving", "window*", "trailing", "smooth*", "running")),
+    _tool("group_by_aggregate", "df",
+          '{"group_column": str | [str, ...],'
+          ' "metrics": [{"column": str, "agg": <agg>, "alias": str?, "percentile": num?, "other_column": str?}, ...],'
+          ' "having": "<condition on result columns>"?}',
+          ["Group by one or more columns and compute several metrics in one call.",
+           "agg: avg sum min max count std var median percentile cov corr (cov/corr need other_column).",
+           "Single metric shorthand: \"target_column\": str, \"agg\": <agg>.",
+           "Time-delta metric: {\"derived\": {\"name\": str, \"type\": \"timedelta\", \"end_col\": str,"
+           " \"start_col\": str, \"unit\": \"seconds|minutes|hours\"}, \"agg\": <agg>}.",
+           "having filters groups, e.g. \"n_jobs >= 5\" (use the metric alias)."],
+          _GROUP_WORDS),
+
+    # ---------- DataFrame → 标量 ----------
+    _tool("calculate_average", "scalar", '{"column": str}', ["Mean of a numeric column."],
+          ("average*", "mean", "avg")),
+    _tool("calculate_mode", "scalar", '{"column": str}', ["Most common value of a column."],
+          ("mode", "common", "frequent*", "popular", "typical")),
+    _tool("calculate_median", "scalar", '{"column": str}', ["Median of a numeric column."],
+          ("median", "middle")),
+    _tool("calculate_sum", "scalar", '{"column": str}', ["Sum of a numeric column."],
+          ("sum", "total*", "overall")),
+    _tool("calculate_min", "scalar", '{"column": str}', ["Minimum of a column."],
+          ("min", "minimum", "lowest", "smallest", "shortest", "least", "earliest")),
+    _tool("calculate_max", "scalar", '{"column": str}', ["Maximum of a column."],
+          ("max", "maximum", "highest", "largest", "longest", "most", "peak", "latest", "biggest")),
+    _tool("calculate_std", "scalar", '{"column": str}', ["Standard deviation of a numeric column."],
+          ("std", "stdev", "standard+deviation", "spread", "variab*", "dispersion", "volatil*")),
+    _tool("calculate_variance", "scalar", '{"column": str}', ["Variance of a numeric column."],
+          ("variance", "var", "spread", "variab*", "dispersion")),
+    _tool("calculate_percentile", "scalar", '{"column": str, "percentile": 0-100, "group_by": str?}',
+          ["Percentile of a column; per group (DataFrame) if group_by is given."],
+          ("percentile*", "quantile*", "quartile*", "p50", "p75", "p90", "p95", "p99", "tail")),
+    _tool("calculate_correlation", "scalar", '{"column1": str, "column2": str, "group_by": str?}',
+          ["Correlation of two numeric columns; per group (DataFrame) if group_by is given."],
+          ("correlat*", "relationship", "related", "relate", "associat*")),
+    _tool("calculate_covariance", "scalar", '{"column1": str, "column2": str, "group_by": str?}',
+          ["Covariance of two numeric columns; per group (DataFrame) if group_by is given."],
+          ("covarian*", "covary", "co-vary")),
+    _tool("calculate_stats", "scalar",
+          '{"column": str, "stats": ["mean","std","min","max","median","sum","var","count","p90", ...]}',
+          ["Several statistics of ONE column in a single step; prefer it over chaining calculate_* on one column."],
+          ("stat*", "summar*", "describe", "profile", "distribution")),
+    _tool("count_rows", "scalar", '{}', ["Number of current rows."],
+          ("count*", "how+many", "number+of")),
+    _tool("calculate_delay_avg", "scalar", '{"unit": "seconds|minutes|hours", "abs": bool}',
+          ["Average delay of completed jobs (Actual_End - Scheduled_End); default unit seconds."],
+          ("delay*", "late*", "overdue", "behind+schedule", "on+time", "punctual*", "tardi*")),
+    _tool("calculate_failure_rate", "scalar", '{"group_column": str}',
+          ["Failed / total jobs per group (DataFrame)."],
+          ("fail*", "reliab*", "success*", "error*")),
+    _tool("calculate_delay_avg_grouped", "scalar", '{"group_column": str, "unit": "seconds|minutes|hours"}',
+          ["Average delay of all jobs (Actual_End - Scheduled_End) per group, any Job_Status (DataFrame)."],
+          tuple(f"{d}+{g}" for d in ("delay*", "late*", "overdue") for g in _GROUP_WORDS if "+" not in g)),
+]}
+
+# 每个请求都带上的工具：先过滤是几乎所有计划的第一步；提示词里的示例也只用到这两个
+CORE_TOOLS = ("select_rows", "sort_rows")
+
+# 选中两个以上时顺带给出 calculate_stats（合并成一次扫描）
+STAT_TOOLS = {"calculate_average", "calculate_median", "calculate_sum", "calculate_min", "calculate_max",
+               "calculate_std", "calculate_variance", "calculate_percentile"}
+
+
+def tools_of_kind(kind):
+    """登记顺序下某一类工具的名字"""
+    return [t.name for t in TOOLS.values() if t.kind == kind]
@@ -0,0 +1,161 @@
+# tracing.py
+# 说明：结构化追踪。每个请求 / 节点 / action 一个 span，结束时以 JSON 行写出，
+#       字段与 OpenTelemetry span 对齐（trace_id / span_id / parent_span_id / 纳秒时间戳 / attributes），
+#       可直接导入 OTel collector 或用 jq / pandas 分析。
+#
+#   TRACE_FILE=traces.jsonl python main.py            → 打开追踪（未设置时所有 span 都是空操作）
+#   TRACE_PROFILE_DIR=.cache/profiles python main.py  → 另外给每个 action 做 cProfile，写 .prof 文件
+#                                                       （snakeviz / pstats 查看）
+#
+# span 自带的属性：duration_ms、cpu_ms（当前线程 CPU 时间）、rss_delta_bytes、error
+# 其余属性由调用方通过 span.set(...) 补充（rows_in / rows_out / dataset_source / ttft_ms …）
+
+import contextvars
+import cProfile
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+_CURRENT = contextvars.ContextVar("trace_span", default=None)
+
+
+def _rss_bytes():
+    """当前常驻内存；Linux 读 /proc，其它平台用 psutil，再退回 ru_maxrss（峰值），都没有时为 0"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource                          # 仅 Unix；Windows 上没有这个模块
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return 0
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name, self.trace_id, self.parent_id = name, trace_id, parent_id
+        self.span_id = secrets.token_hex(8)
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def to_dict(self, end_ns):
+        return {"name": self.name, "trace_id": self.trace_id, "span_id": self.span_id,
+                "parent_span_id": self.parent_id,
+                "start_time_unix_nano": self.start_ns, "end_time_unix_nano": end_ns,
+                "attributes": self.attributes}
+
+
+class _NoopSpan:
+    """追踪关闭时的占位 span：set() 什么也不做"""
+    trace_id = span_id = None
+
+    def set(self, **attributes):
+        return self
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    path=None → 关闭（span() 几乎零开销）
+      span(name, **attrs)          → 上下文管理器，嵌套时自动挂到当前 span 下
+      stream(name, chunks, **attrs) → 包装 LLM 流式输出，记录 ttft_ms / stream_ms / chunks
+    """
+
+    def __init__(self, path=None, profile_dir=None):
+        self.path, self.profile_dir = path, profile_dir
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def _emit(self, span, end_ns):
+        line = json.dumps(span.to_dict(end_ns), ensure_ascii=False, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def _new_span(self, name, attributes, parent=None):
+        parent = parent if parent is not None else _CURRENT.get()
+        if parent is None or parent is NOOP_SPAN:
+            return Span(name, secrets.token_hex(16), None, attributes)
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+
+    @contextmanager
+    def span(self, name, profile=False, **attributes):
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        span = self._new_span(name, attributes)
+        token = _CURRENT.set(span)
+        prof = cProfile.Profile() if profile and self.profile_dir else None
+        rss0, cpu0, t0 = _rss_bytes(), time.thread_time(), time.perf_counter()
+        if prof:
+            prof.enable()
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            if prof:
+                prof.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                fname = os.path.join(self.profile_dir, f"{span.trace_id[:8]}-{span.span_id}-"
+                                                       f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}.prof")
+                prof.dump_stats(fname)
+                span.set(profile_file=fname)
+            span.set(duration_ms=(time.perf_counter() - t0) * 1e3,
+                     cpu_ms=(time.thread_time() - cpu0) * 1e3,
+                     rss_delta_bytes=_rss_bytes() - rss0)
+            _CURRENT.reset(token)
+            self._emit(span, time.time_ns())
+
+    def stream(self, name, chunks, **attributes):
+        """
+        包装一个文本块迭代器；父 span 在调用 stream() 时确定（消费可能发生在别的线程）
+        ttft_ms = 调用 stream() 到第一个文本块的时间
+        """
+        if not self.enabled:
+            return chunks
+        return self._stream(self._new_span(name, attributes), chunks, time.perf_counter())
+
+    def _stream(self, span, chunks, t0):
+        n, chars = 0, 0
+        try:
+            for chunk in chunks:
+                if n == 0:
+                    span.set(ttft_ms=(time.perf_counter() - t0) * 1e3)
+                n, chars = n + 1, chars + len(chunk)
+                yield chunk
+        except BaseException as e:
+            span.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            span.set(stream_ms=(time.perf_counter() - t0) * 1e3, chunks=n, chars=chars)
+            self._emit(span, time.time_ns())
+
+
+def current_span():
+    """当前上下文里的 span（没有时返回空操作 span）"""
+    return _CURRENT.get() or NOOP_SPAN
+
+
+# 进程内唯一实例：由环境变量打开
+TRACER = Tracer(os.getenv("TRACE_FILE"), os.getenv("TRACE_PROFILE_DIR"))